@@ -0,0 +1,67 @@
+"""
+ARC-28 events logged by the Staking contract.
+
+Every stake, unstake and restake logs an event: the 4 byte selector of its signature followed by
+its ABI encoded arguments, which include the resulting global `locked` and `total_liability`.
+The event schemas are read from the "events" entry of the contract's abi.json, so consumers can
+follow positions from the log stream alone, box-backed positions included, without replaying
+state deltas.
+
+`decode` turns one log into an `Event`; `events` streams the events of `app_id` from a block
+source (`analytics.indexer.AlgodBlocks` or `FileBlocks`), inner calls included.
+"""
+from typing import NamedTuple
+
+from algosdk import abi, encoding
+
+
+class Event(NamedTuple):
+    round: int
+    # Sender of the top level transaction that caused the event
+    sender: bytes
+    name: str
+    args: dict
+
+
+class EventDecoder:
+    """Decodes logs against the events of an ABI JSON dict (a build/<name>/abi.json)."""
+
+    def __init__(self, abi_json):
+        self.events = {}
+        for event in abi_json.get("events", []):
+            types = [arg["type"] for arg in event["args"]]
+            # ARC-28 selectors hash the signature without a return type
+            signature = f"{event['name']}({','.join(types)})"
+            selector = encoding.checksum(signature.encode())[:4]
+            self.events[selector] = (
+                event["name"],
+                [arg["name"] for arg in event["args"]],
+                abi.ABIType.from_string(f"({','.join(types)})"),
+            )
+
+    def decode(self, log):
+        """(name, {arg: value}) of the event in `log`, or None if it is not one of ours."""
+        event = self.events.get(bytes(log[:4]))
+        if event is None:
+            return None
+        name, names, codec = event
+        return name, dict(zip(names, codec.decode(bytes(log[4:]))))
+
+
+def events(app_id, source, first, last, decoder):
+    """Yield the Event of every log of `app_id` in blocks `first` to `last`, in order."""
+
+    def visit(round, sender, stib):
+        txn = stib["txn"]
+        delta = stib.get("dt", {})
+        if txn.get("type") == "appl" and (txn.get("apid") or stib.get("apid")) == app_id:
+            for log in delta.get("lg", []):
+                decoded = decoder.decode(log)
+                if decoded is not None:
+                    yield Event(round, sender, *decoded)
+        for inner in delta.get("itx", []):
+            yield from visit(round, sender, inner)
+
+    for round in range(first, last + 1):
+        for stib in source.block(round).get("txns", []):
+            yield from visit(round, stib["txn"]["snd"], stib)
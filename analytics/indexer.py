@@ -0,0 +1,306 @@
+"""
+Incremental indexer of Staking positions held in local state.
+
+`PositionStore` keeps one row per opted-in account in fixed-width NumPy columns (`staked`,
+`total_reward`, `stake_unlock`) next to the global `locked` and `total_liability`, so totals and
+reconciliation are single vectorised reductions. It is seeded once from an indexer account search
+(`snapshot`) and then kept current by `StakingIndexer`, which applies the local and global state
+deltas that every app call to the contract leaves in its block. Nothing is ever rescanned.
+Apps built with the packed state layout, which keep a position in one record, are read the same way.
+
+Blocks come from a block source: `AlgodBlocks` follows a node, `FileBlocks` replays blocks recorded
+with `record`, which is also how the indexer is exercised without a network.
+
+Box-backed positions are not part of the local state deltas and are not tracked here; their
+events are, see `analytics.events`.
+
+`call_profile` counts calls per ABI method over the same block sources, for ordering the contract's
+method dispatch (`python staking.py --profile`).
+"""
+import base64
+from collections import Counter
+
+import msgpack
+import numpy as np
+from algosdk import encoding
+
+STAKED = "s"
+TOTAL_REWARD = "tr"
+STAKE_UNLOCK = "su"
+LOCKED = "l"
+TOTAL_LIABILITY = "tl"
+
+COLUMNS = {STAKED: "staked", TOTAL_REWARD: "total_reward", STAKE_UNLOCK: "stake_unlock"}
+# Packed layout: the position as one record of staked, total reward and stake unlock
+POSITION = "p"
+
+# EvalDelta actions setting bytes or a uint; deleting reads as 0 here
+SET_BYTES = 1
+SET_UINT = 2
+
+# OnCompletion values that add or remove the sender's local state
+OPT_IN = 1
+CLOSE_OUT = 2
+CLEAR_STATE = 3
+
+
+def _key(key):
+    # Delta keys decode as str when they are valid UTF-8 and as bytes otherwise
+    return key if isinstance(key, str) else key.decode(errors="replace")
+
+
+class PositionStore:
+    """
+    Columnar store of every opted-in account's position. Rows are kept dense: removing an account
+    moves the last row into its place, so the first `size` entries of each column are always live.
+    """
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        # Raw void bytes, as "S32" would strip trailing zero bytes off addresses
+        self.addresses = np.zeros(capacity, dtype="V32")
+        self.staked = np.zeros(capacity, dtype=np.uint64)
+        self.total_reward = np.zeros(capacity, dtype=np.uint64)
+        self.stake_unlock = np.zeros(capacity, dtype=np.uint64)
+        self.rows = {}
+        self.locked = 0
+        self.total_liability = 0
+        self.round = 0
+
+    def _columns(self):
+        return [self.addresses, self.staked, self.total_reward, self.stake_unlock]
+
+    def _grow(self):
+        capacity = 2 * len(self.addresses)
+        self.addresses, self.staked, self.total_reward, self.stake_unlock = (
+            np.resize(column, capacity) for column in self._columns()
+        )
+
+    def row(self, address):
+        """Row of `address`, added with an empty position if it is not yet in the store."""
+        row = self.rows.get(address)
+        if row is None:
+            if self.size == len(self.addresses):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.rows[address] = row
+            self.addresses[row] = address
+            for column in self._columns()[1:]:
+                column[row] = 0
+        return row
+
+    def remove(self, address):
+        row = self.rows.pop(address, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            for column in self._columns():
+                column[row] = column[last]
+            self.rows[bytes(self.addresses[row])] = row
+        self.size = last
+
+    def set_local(self, address, key, value):
+        if key == POSITION:
+            # A packed position record, or 0 when deleted
+            value = value or bytes(24)
+            row = self.row(address)
+            for i, column in enumerate(COLUMNS.values()):
+                getattr(self, column)[row] = int.from_bytes(value[8 * i:8 * i + 8], "big")
+            return
+        column = COLUMNS.get(key)
+        if column is not None:
+            getattr(self, column)[self.row(address)] = value
+
+    def set_global(self, key, value):
+        if key == LOCKED:
+            self.locked = value
+        elif key == TOTAL_LIABILITY:
+            self.total_liability = value
+
+    def view(self):
+        """Live rows as a dict of column name to array (views, not copies)."""
+        return {
+            "addresses": self.addresses[:self.size],
+            **{column: getattr(self, column)[:self.size] for column in COLUMNS.values()},
+        }
+
+    def reconcile(self):
+        """
+        Differences between the summed positions and the global counters, as
+        (staked - locked, total_reward - total_liability). Both are 0 for consistent state;
+        `locked` starts at 1 on create, so a freshly created app reconciles to (-1, 0).
+        """
+        staked = int(self.staked[:self.size].sum(dtype=np.uint64))
+        reward = int(self.total_reward[:self.size].sum(dtype=np.uint64))
+        return staked - self.locked, reward - self.total_liability
+
+    def save(self, path):
+        np.savez(
+            path, round=self.round, locked=self.locked, total_liability=self.total_liability,
+            **self.view(),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        size = len(data["addresses"])
+        store = cls(capacity=max(size, 1))
+        store.size = size
+        for column in ("addresses", *COLUMNS.values()):
+            getattr(store, column)[:size] = data[column]
+        store.rows = {bytes(address): row for row, address in enumerate(store.addresses[:size])}
+        store.round = int(data["round"])
+        store.locked = int(data["locked"])
+        store.total_liability = int(data["total_liability"])
+        return store
+
+
+def snapshot(indexer, algod, app_id, limit=1000):
+    """
+    Seed a PositionStore from an indexer search of every account opted in to `app_id`, plus the
+    app's global state. The store's round is the indexer round the search was served at.
+    """
+    store = PositionStore()
+    next_page = None
+    while True:
+        response = indexer.accounts(application_id=app_id, limit=limit, next_page=next_page)
+        store.round = response["current-round"]
+        for info in response["accounts"]:
+            for local in info.get("apps-local-state", []):
+                if local["id"] != app_id:
+                    continue
+                address = encoding.decode_address(info["address"])
+                store.row(address)
+                for kv in local.get("key-value", []):
+                    value = kv["value"]
+                    store.set_local(
+                        address, base64.b64decode(kv["key"]).decode(),
+                        # TealValue type 1 is bytes
+                        base64.b64decode(value["bytes"]) if value["type"] == 1 else value.get("uint", 0),
+                    )
+        next_page = response.get("next-token")
+        if not next_page:
+            break
+
+    for kv in algod.application_info(app_id)["params"].get("global-state", []):
+        store.set_global(base64.b64decode(kv["key"]).decode(), kv["value"].get("uint", 0))
+    return store
+
+
+class AlgodBlocks:
+    """Block source following an algod node."""
+
+    def __init__(self, algod):
+        self.algod = algod
+
+    def block(self, round):
+        """Block `round` as a msgpack decoded dict, waiting for it if needed."""
+        self.algod.status_after_block(round - 1)
+        raw = self.algod.block_info(round, response_format="msgpack")
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)["block"]
+
+
+class FileBlocks:
+    """Block source replaying a file written by `record`. Raises KeyError past its last block."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.blocks = msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+
+    def block(self, round):
+        return self.blocks[round]
+
+
+def record(algod, first, last, path):
+    """Record blocks `first` to `last` from algod into a file for FileBlocks."""
+    blocks = {}
+    for round in range(first, last + 1):
+        raw = algod.block_info(round, response_format="msgpack")
+        blocks[round] = msgpack.unpackb(raw, raw=False, strict_map_key=False)["block"]
+    with open(path, "wb") as f:
+        f.write(msgpack.packb(blocks, use_bin_type=True))
+
+
+def call_profile(app_id, source, first, last, contract):
+    """
+    Count the calls to each ABI method of `app_id`, inner calls included, in blocks `first` to
+    `last`. `contract` is the app's algosdk Contract. Returns {"method name": calls}.
+    """
+    selectors = {method.get_selector(): method.name for method in contract.methods}
+    counts = Counter()
+
+    def visit(stib):
+        txn = stib["txn"]
+        if txn.get("type") == "appl" and txn.get("apid") == app_id and txn.get("apaa"):
+            name = selectors.get(txn["apaa"][0])
+            if name is not None:
+                counts[name] += 1
+        for inner in stib.get("dt", {}).get("itx", []):
+            visit(inner)
+
+    for round in range(first, last + 1):
+        for stib in source.block(round).get("txns", []):
+            visit(stib)
+    return dict(counts)
+
+
+class StakingIndexer:
+    """
+    Keeps a PositionStore current by applying the state deltas of every app call to `app_id`,
+    including inner app calls, block by block from `store.round + 1`.
+    """
+
+    def __init__(self, app_id, store, source):
+        self.app_id = app_id
+        self.store = store
+        self.source = source
+
+    def _apply(self, stib):
+        txn = stib["txn"]
+        delta = stib.get("dt", {})
+        if txn.get("type") == "appl" and (txn.get("apid") or stib.get("apid")) == self.app_id:
+            sender = txn["snd"]
+            on_completion = txn.get("apan", 0)
+            if on_completion == OPT_IN:
+                self.store.row(sender)
+
+            # Local delta account 0 is the sender, then the accounts array, then shared accounts
+            accounts = [sender, *txn.get("apat", []), *delta.get("sa", [])]
+            for index, changes in delta.get("ld", {}).items():
+                for key, change in changes.items():
+                    value = change.get("ui", 0) if change["at"] == SET_UINT else 0
+                    if change["at"] == SET_BYTES:
+                        value = change.get("bs", b"")
+                    self.store.set_local(accounts[index], _key(key), value)
+            for key, change in delta.get("gd", {}).items():
+                value = change.get("ui", 0) if change["at"] == SET_UINT else 0
+                self.store.set_global(_key(key), value)
+
+            if on_completion in (CLOSE_OUT, CLEAR_STATE):
+                self.store.remove(sender)
+
+        for inner in delta.get("itx", []):
+            self._apply(inner)
+
+    def apply_block(self, round, block):
+        for stib in block.get("txns", []):
+            self._apply(stib)
+        self.store.round = round
+
+    def follow(self, until=None, checkpoint=None, checkpoint_every=100):
+        """
+        Apply blocks until round `until` (forever if None). If `checkpoint` is a path, the store is
+        saved there every `checkpoint_every` rounds and on exit.
+        """
+        try:
+            while until is None or self.store.round < until:
+                round = self.store.round + 1
+                self.apply_block(round, self.source.block(round))
+                if checkpoint and round % checkpoint_every == 0:
+                    self.store.save(checkpoint)
+        finally:
+            if checkpoint:
+                self.store.save(checkpoint)
+        return self.store
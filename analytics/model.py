@@ -0,0 +1,170 @@
+"""
+Vectorised reference model of the Staking contract math.
+
+Every function mirrors the TEAL evaluated by `contracts/staking.py`, including the uint64 integer
+truncation at each step, and works on whole NumPy arrays at once. All arguments broadcast against
+each other, so a parameter sweep is just a matter of shaping the inputs, e.g. `ss[:, None]` against
+a vector of positions.
+
+The AVM panics on uint64 overflow, underflow and division by zero. NumPy wraps silently instead,
+so every result carries an `ok` mask that is False wherever the contract would have rejected the
+call. Values at those indexes are meaningless.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+SCALE = 1_000_000
+DAYS_PER_YEAR = 365
+SECONDS_PER_DAY = 86400
+UINT64_MAX = np.iinfo(np.uint64).max
+
+
+class Stake(NamedTuple):
+    staked: np.ndarray
+    total_reward: np.ndarray
+    stake_unlock: np.ndarray
+    rate: np.ndarray
+    ok: np.ndarray
+
+
+class Restake(NamedTuple):
+    staked: np.ndarray
+    total_reward: np.ndarray
+    stake_unlock: np.ndarray
+    rate: np.ndarray
+    ok: np.ndarray
+
+
+def _u64(*values):
+    return np.broadcast_arrays(*(np.asarray(v, dtype=np.uint64) for v in values))
+
+
+def _add(a, b, ok):
+    with np.errstate(over="ignore"):
+        out = a + b
+    return out, ok & (out >= a)
+
+
+def _sub(a, b, ok):
+    with np.errstate(over="ignore"):
+        out = a - b
+    return out, ok & (a >= b)
+
+
+def _mul(a, b, ok):
+    with np.errstate(over="ignore"):
+        out = a * b
+    overflow = (a != 0) & (b > UINT64_MAX // np.maximum(a, 1))
+    return out, ok & ~overflow
+
+
+def _div(a, b, ok):
+    zero = b == 0
+    return a // np.where(zero, 1, b), ok & ~zero
+
+
+def _wide_scale(a, rate, ok):
+    """WideRatio([a, SCALE + rate], [SCALE]) without a 128-bit intermediate."""
+    q, r = a // SCALE, a % SCALE
+    high, ok = _mul(q, rate, ok)
+    low, ok = _mul(r, rate, ok)
+    out, ok = _add(high, low // SCALE, ok)
+    return _add(a, out, ok)
+
+
+def interest_rate(length, ss, se, ls, le, ok=None):
+    """
+    Mirrors the `interest_rate` subroutine: linear APR between (ls, ss) and (le, se), adjusted to the
+    rate over `length` days. Returns (rate, ok).
+    """
+    length, ss, se, ls, le = _u64(length, ss, se, ls, le)
+    ok = np.ones(length.shape, dtype=bool) if ok is None else ok
+
+    span, ok = _sub(se, ss, ok)
+    span, ok = _mul(np.uint64(SCALE), span, ok)
+    offset, ok = _sub(length, ls, ok)
+    slope, ok = _mul(offset, span, ok)
+    width, ok = _sub(le, ls, ok)
+    slope, ok = _div(slope, width, ok)
+    apr, ok = _add(ss, slope // SCALE, ok)
+
+    # Adjust APR to rate over the given length
+    days, ok = _mul(length, np.uint64(SCALE), ok)
+    rate, ok = _mul(days // DAYS_PER_YEAR, apr, ok)
+    return rate // SCALE, ok
+
+
+def curve(ss, se, ls, le):
+    """
+    The table `build_curve` writes to the curve box: entry i is the rate for a lock of ls + i days.
+    Raises ValueError for settings the contract would reject.
+    """
+    lengths = np.arange(ls, le + 1, dtype=np.uint64)
+    rates, ok = interest_rate(lengths, ss, se, ls, le)
+    if lengths.size == 0 or not ok.all():
+        raise ValueError("Settings overflow or have an empty length range")
+    return rates
+
+
+def curve_rate(length, ls, le, table, ok):
+    """Rate read from a curve `table` (see `curve`), for custom curves set with `set_curve`."""
+    table = np.asarray(table, dtype=np.uint64)
+    ok = ok & (length >= ls) & (length <= le) & (length - ls < table.size)
+    index = np.where(ok, length - ls, 0)
+    return table[index], ok
+
+
+def stake(amount, length, stake_price, reward_price, ss, se, ls, le, now=0, table=None):
+    """
+    Mirrors `stake`: the position written to local state for a fresh stake of `amount` over
+    `length` days, including the length bound check. Rates come from the linear curve unless a
+    custom curve `table` is given.
+    """
+    amount, length, stake_price, reward_price, ss, se, ls, le, now = _u64(
+        amount, length, stake_price, reward_price, ss, se, ls, le, now
+    )
+    ok = (amount > 0) & (length >= ls) & (length <= le)
+    if table is None:
+        rate, ok = interest_rate(length, ss, se, ls, le, ok)
+    else:
+        rate, ok = curve_rate(length, ls, le, table, ok)
+
+    out, ok = _mul(amount, stake_price, ok)
+    factor, ok = _add(np.uint64(SCALE), rate, ok)
+    out, ok = _mul(out, factor, ok)
+    out, ok = _div(out, reward_price, ok)
+    reward, ok = _sub(out // SCALE, amount, ok)
+
+    lock, ok = _mul(length, np.uint64(SECONDS_PER_DAY), ok)
+    unlock, ok = _add(now, lock, ok)
+    return Stake(amount, reward, unlock, rate, ok)
+
+
+def restake(staked, total_reward, length, ss, se, ls, le, now=0, table=None):
+    """
+    Mirrors `restake`: principal and reward compound into the new principal and a fresh reward is
+    fixed over `length` days using the 128-bit `WideRatio`. The unlock uses the full lock period,
+    which debug builds of the contract currently zero out.
+    """
+    staked, total_reward, length, ss, se, ls, le, now = _u64(
+        staked, total_reward, length, ss, se, ls, le, now
+    )
+    ok = (staked > 0) & (length >= ls) & (length <= le)
+    if table is None:
+        rate, ok = interest_rate(length, ss, se, ls, le, ok)
+    else:
+        rate, ok = curve_rate(length, ls, le, table, ok)
+
+    principal, ok = _add(staked, total_reward, ok)
+    out, ok = _wide_scale(principal, rate, ok)
+    reward, ok = _sub(out, principal, ok)
+
+    lock, ok = _mul(length, np.uint64(SECONDS_PER_DAY), ok)
+    unlock, ok = _add(now, lock, ok)
+    return Restake(principal, reward, unlock, rate, ok)
+
+
+def liability(result, axis=None):
+    """Total reward owed by a `stake`/`restake` result, ignoring calls the contract would reject."""
+    return np.where(result.ok, result.total_reward, np.uint64(0)).sum(axis=axis, dtype=np.uint64)
@@ -0,0 +1,111 @@
+"""
+Maturity and cash-flow projection over Staking positions.
+
+Positions are bucketed by `stake_unlock` into time windows and the principal (`staked`) and reward
+(`total_reward`) falling due in each window are summed in one vectorised pass. `unstake` pays the
+principal in the stake token and the reward in the reward token; given oracle prices both are
+also valued in one of the two tokens, by default the reward token.
+
+Inputs are plain arrays, so positions can come from an `analytics.indexer.PositionStore`
+(see `project_store`), from box positions, or from a `model.stake` sweep.
+"""
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+
+class Projection(NamedTuple):
+    start: np.ndarray
+    end: np.ndarray
+    positions: np.ndarray
+    staked: np.ndarray
+    total_reward: np.ndarray
+    # Principal (stake token) due by the end of each window
+    cumulative: np.ndarray
+    # Sums valued in the `value_in` token, None without prices
+    staked_value: Optional[np.ndarray]
+    reward_value: Optional[np.ndarray]
+
+
+def windows(start, width=SECONDS_PER_DAY, count=30):
+    """Window edges for `count` windows of `width` seconds from timestamp `start`."""
+    return start + width * np.arange(count + 1, dtype=np.uint64)
+
+
+def _value(amounts, price, unit_price):
+    # Per window sums can exceed uint64 once multiplied by a price, so value them as Python ints
+    return np.array([amount * price // unit_price for amount in amounts.tolist()], dtype=object)
+
+
+def project(staked, total_reward, stake_unlock, edges, stake_price=None, reward_price=None, value_in="reward"):
+    """
+    Sum the positions unlocking in each window [edges[i], edges[i + 1]).
+
+    Positions already unlocked before edges[0] are due now and fall in the first window; positions
+    unlocking at or after edges[-1] are beyond the horizon and left out. Empty positions
+    (staked == 0) are skipped.
+
+    `staked` and `total_reward` are in their own tokens and must not be added together or summed
+    across pools. Given both prices, `staked_value` and `reward_value` are valued in the token
+    `value_in` ("reward" or "stake"), so they can be.
+    """
+    staked = np.asarray(staked, dtype=np.uint64)
+    total_reward = np.asarray(total_reward, dtype=np.uint64)
+    stake_unlock = np.asarray(stake_unlock, dtype=np.uint64)
+    edges = np.asarray(edges, dtype=np.uint64)
+    count = len(edges) - 1
+
+    window = np.searchsorted(edges, stake_unlock, side="right") - 1
+    window = np.maximum(window, 0)
+    live = (staked > 0) & (stake_unlock < edges[-1])
+    window = window[live]
+
+    positions = np.zeros(count, dtype=np.uint64)
+    staked_due = np.zeros(count, dtype=np.uint64)
+    reward_due = np.zeros(count, dtype=np.uint64)
+    np.add.at(positions, window, np.uint64(1))
+    np.add.at(staked_due, window, staked[live])
+    np.add.at(reward_due, window, total_reward[live])
+
+    staked_value = reward_value = None
+    if stake_price is not None and reward_price is not None:
+        if value_in == "reward":
+            staked_value = _value(staked_due, stake_price, reward_price)
+            reward_value = reward_due.astype(object)
+        elif value_in == "stake":
+            staked_value = staked_due.astype(object)
+            reward_value = _value(reward_due, reward_price, stake_price)
+        else:
+            raise ValueError(f"value_in must be 'reward' or 'stake', not {value_in!r}")
+
+    return Projection(
+        start=edges[:-1],
+        end=edges[1:],
+        positions=positions,
+        staked=staked_due,
+        total_reward=reward_due,
+        cumulative=np.cumsum(staked_due, dtype=np.uint64),
+        staked_value=staked_value,
+        reward_value=reward_value,
+    )
+
+
+def project_store(store, edges, stake_price=None, reward_price=None, value_in="reward"):
+    """`project` over every position in an indexer PositionStore."""
+    view = store.view()
+    return project(
+        view["staked"], view["total_reward"], view["stake_unlock"], edges, stake_price, reward_price, value_in
+    )
+
+
+def releasable(balance, projection):
+    """
+    Stake token that can leave the app by the start of each window while still covering the
+    principal of every position due by its end. `withdraw` itself only allows balance - locked - total liability,
+    which also covers positions beyond the horizon.
+    """
+    balance = np.uint64(balance)
+    cumulative = projection.cumulative
+    return np.where(cumulative < balance, balance - np.minimum(cumulative, balance), np.uint64(0))
@@ -0,0 +1,131 @@
+"""
+Content-addressed build cache for the contracts.
+
+A build is keyed by a hash of the PyTeal version, the compile options and the source of every
+module under contracts/ that went into the router. Outputs live in build/.cache/<key>/ and are
+copied into build/<name>/ only when they differ, so repeated builds of unchanged sources neither
+compile nor touch the artifacts. build/manifest.json records where each contract's artifacts are,
+their hashes and state schema, and is the single place deploy scripts read from.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+from importlib.metadata import version
+
+CONTRACTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CONTRACTS_DIR)
+BUILD_DIR = os.path.join(ROOT_DIR, "build")
+CACHE_DIR = os.path.join(BUILD_DIR, ".cache")
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+
+ARTIFACTS = ("approval.teal", "clear.teal", "abi.json")
+
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def contract_sources():
+    """Paths of the loaded modules that live under contracts/."""
+    paths = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path and os.path.abspath(path).startswith(CONTRACTS_DIR + os.sep):
+            paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def source_hash(options):
+    h = hashlib.sha256()
+    h.update(version("pyteal").encode())
+    h.update(json.dumps(options, sort_keys=True).encode())
+    for path in contract_sources():
+        h.update(os.path.relpath(path, CONTRACTS_DIR).encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(manifest, indent=4, sort_keys=True))
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def _write(path, content):
+    """Write `content` to `path` unless it already holds exactly that. Returns True if written."""
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == content:
+                return False
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _compile_into_cache(key, compile_fn):
+    cache_path = os.path.join(CACHE_DIR, key)
+    if os.path.isdir(cache_path):
+        return cache_path, False
+
+    approval, clear, contract = compile_fn()
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    contents = (approval, clear, json.dumps(contract if isinstance(contract, dict) else contract.dictify(), indent=4))
+    for artifact, content in zip(ARTIFACTS, contents):
+        with open(os.path.join(tmp_path, artifact), "w") as f:
+            f.write(content)
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Another build got there first with identical content
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return cache_path, True
+
+
+def build_cached(name, options, compile_fn, **metadata):
+    """
+    Build contract `name` through the cache and record it in the manifest.
+    `compile_fn` is only called on a cache miss and must return (approval, clear, contract).
+    Extra keyword arguments (e.g. state schema) are stored in the manifest entry.
+    """
+    key = source_hash(options)
+    cache_path, compiled = _compile_into_cache(key, compile_fn)
+
+    out_dir = os.path.join(BUILD_DIR, name)
+    os.makedirs(out_dir, exist_ok=True)
+    entry = {"key": key, "options": options, **metadata}
+    written = []
+    for artifact in ARTIFACTS:
+        with open(os.path.join(cache_path, artifact)) as f:
+            content = f.read()
+        if _write(os.path.join(out_dir, artifact), content):
+            written.append(artifact)
+        entry[artifact.split(".")[0]] = {
+            "path": os.path.relpath(os.path.join(out_dir, artifact), BUILD_DIR),
+            "sha256": sha256(content),
+        }
+
+    manifest = load_manifest()
+    if manifest.get(name) != entry:
+        manifest[name] = entry
+        save_manifest(manifest)
+
+    print(f"{name}: {'compiled' if compiled else 'cached'} {key[:12]}, "
+          f"{', '.join(written) if written else 'artifacts unchanged'}")
+    return entry
@@ -0,0 +1,453 @@
+"""
+Opcode-cost and program-size benchmark for the Staking router.
+
+Builds the router exactly like `staking.py` does, then statically analyses the TEAL:
+
+* cost: the most expensive successful path through the approval program for each ABI method and
+  bare call, dispatch included. Subroutines are followed through their call stack, and branches on
+  the call itself (selector, OnCompletion, NumAppArgs, ApplicationID) are resolved for the method
+  being measured. Loops are walked once and flagged.
+* size: the assembled byte length of both programs, estimated the way algod packs constants into
+  intcblock/bytecblock. Pass --algod to get the exact figure from a node instead.
+
+Run from this directory:
+    python benchmark.py            # report and compare against benchmark.json
+    python benchmark.py --update   # accept the current figures as the new baseline
+    python benchmark.py --layout packed   # the packed state layout, against benchmark-packed.json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from base64 import b32decode, b64decode
+from collections import Counter
+
+from staking import DECLARED_DISPATCH, LAYOUTS, build, build_options, router
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark.json")
+
+
+def baseline_path(layout):
+    if layout == "keys":
+        return BASELINE_PATH
+    return os.path.join(os.path.dirname(BASELINE_PATH), f"benchmark-{layout}.json")
+
+OPCODE_BUDGET = 700
+PAGE_SIZE = 2048
+# Template variables are patched in at deploy time, so size them as the largest uint64 varuint
+TEMPLATE_INT_SIZE = 10
+
+# Opcodes whose cost is not 1. Variable-cost opcodes are charged their base cost.
+OPCODE_COSTS = {
+    "sha256": 35,
+    "keccak256": 130,
+    "sha512_256": 45,
+    "sha3_256": 130,
+    "ed25519verify": 1900,
+    "ed25519verify_bare": 1900,
+    "ecdsa_verify": 1700,
+    "ecdsa_pk_decompress": 650,
+    "ecdsa_pk_recover": 2000,
+    "vrf_verify": 5700,
+    "divmodw": 20,
+    "sqrt": 4,
+    "expw": 10,
+    "bsqrt": 40,
+    "b+": 10,
+    "b-": 10,
+    "b*": 20,
+    "b/": 20,
+    "b%": 20,
+    "b|": 6,
+    "b&": 6,
+    "b^": 6,
+    "b~": 4,
+    "json_ref": 25,
+}
+
+# Number of immediate bytes following the opcode byte, for opcodes that take fixed-size immediates.
+IMMEDIATE_SIZES = {
+    "txn": 1, "txna": 2, "txnas": 1, "gtxn": 2, "gtxna": 3, "gtxns": 1, "gtxnsa": 2, "gtxnas": 2,
+    "gtxnsas": 1, "global": 1, "itxn_field": 1, "itxn": 1, "itxna": 2, "itxnas": 1, "gitxn": 2,
+    "gitxna": 3, "gitxnas": 2, "asset_holding_get": 1, "asset_params_get": 1, "app_params_get": 1,
+    "acct_params_get": 1, "load": 1, "store": 1, "gload": 2, "gloads": 1, "gaid": 1, "b": 2,
+    "bz": 2, "bnz": 2, "callsub": 2, "substring": 2, "extract": 2, "replace2": 1, "dig": 1,
+    "bury": 1, "cover": 1, "uncover": 1, "frame_dig": 1, "frame_bury": 1, "proto": 2, "popn": 1,
+    "dupn": 1, "intc": 1, "bytec": 1, "arg": 1, "ecdsa_verify": 1, "ecdsa_pk_decompress": 1,
+    "ecdsa_pk_recover": 1, "base64_decode": 1, "json_ref": 1, "vrf_verify": 1, "block": 1,
+}
+
+NAMED_INTS = {
+    "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3, "UpdateApplication": 4,
+    "DeleteApplication": 5, "unknown": 0, "pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4,
+    "afrz": 5, "appl": 6,
+}
+
+BRANCHES = ("b", "bz", "bnz", "callsub", "switch", "match")
+TERMINATORS = ("return", "err", "retsub")
+
+
+class Instruction:
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+
+    @property
+    def cost(self):
+        return OPCODE_COSTS.get(self.op, 1)
+
+
+class Block:
+    def __init__(self, label):
+        self.label = label
+        self.instructions = []
+
+    @property
+    def cost(self):
+        return sum(i.cost for i in self.instructions)
+
+    @property
+    def last(self):
+        return self.instructions[-1] if self.instructions else None
+
+
+def tokenize(line):
+    """Split a TEAL line into tokens, keeping quoted strings whole and dropping comments."""
+    tokens = []
+    for match in re.finditer(r'"(?:\\.|[^"\\])*"|//.*|\S+', line):
+        token = match.group(0)
+        if token.startswith("//"):
+            break
+        tokens.append(token)
+    return tokens
+
+
+def parse(teal):
+    """Parse TEAL into basic blocks. A block ends at a label, a branch or a terminator."""
+    blocks = [Block(None)]
+    for line in teal.splitlines():
+        tokens = tokenize(line)
+        if not tokens or tokens[0].startswith("#pragma"):
+            continue
+        if tokens[0].endswith(":"):
+            blocks.append(Block(tokens[0][:-1]))
+            continue
+        blocks[-1].instructions.append(Instruction(tokens[0], tokens[1:]))
+        if tokens[0] in BRANCHES or tokens[0] in TERMINATORS:
+            blocks.append(Block(None))
+    return blocks
+
+
+def int_value(token):
+    if token in NAMED_INTS:
+        return NAMED_INTS[token]
+    return int(token, 0)
+
+
+def bytes_value(args):
+    """Decode the immediates of a `byte`/`pushbytes` pseudo-op into raw bytes."""
+    if args[0].startswith('"'):
+        return args[0][1:-1].encode().decode("unicode_escape").encode("latin-1")
+    if args[0].startswith("0x"):
+        return bytes.fromhex(args[0][2:])
+    if args[0] in ("base64", "b64"):
+        return b64decode(args[1])
+    if args[0] in ("base32", "b32"):
+        return b32decode(args[1] + "=" * (-len(args[1]) % 8))
+    if args[0].startswith(("base64(", "b64(")):
+        return b64decode(args[0][args[0].index("(") + 1:-1])
+    raise ValueError(f"Unsupported byte constant: {' '.join(args)}")
+
+
+class CallContext:
+    """The fields of the outer application call the router dispatches on."""
+
+    def __init__(self, num_app_args, on_completion, application_id, selector=None):
+        self.values = {
+            ("txn", "NumAppArgs"): num_app_args,
+            ("txn", "OnCompletion"): on_completion,
+            ("txn", "ApplicationID"): application_id,
+            ("txna", "ApplicationArgs", "0"): selector,
+        }
+
+    def resolve(self, instructions):
+        """
+        Evaluate a branch condition of the form `<field> <constant> ==|!=` when the field is
+        known for this call. Returns None when the condition can't be resolved statically.
+        """
+        if len(instructions) < 3:
+            return None
+        field, constant, comparison = instructions[-3:]
+        key = (field.op, *field.args)
+        if comparison.op not in ("==", "!=") or self.values.get(key) is None:
+            return None
+        if constant.op in ("int", "pushint"):
+            equal = self.values[key] == int_value(constant.args[0])
+        elif constant.op == "method":
+            equal = self.values[key] == constant.args[0][1:-1]
+        else:
+            return None
+        return equal if comparison.op == "==" else not equal
+
+
+class CostAnalysis:
+    def __init__(self, teal):
+        self.blocks = parse(teal)
+        self.labels = {b.label: i for i, b in enumerate(self.blocks) if b.label is not None}
+
+    def worst_case(self, context):
+        """Return (cost, has_loop) of the most expensive path that ends in `return`."""
+        self.context = context
+        self.memo = {}
+        self.active = set()
+        self.loop = False
+        return self._walk(0, ()), self.loop
+
+    def _walk(self, index, stack):
+        key = (index, stack)
+        if key in self.memo:
+            return self.memo[key]
+        if key in self.active:
+            self.loop = True
+            return 0
+        if index >= len(self.blocks):
+            return None
+
+        self.active.add(key)
+        block = self.blocks[index]
+        last = block.last
+        op = last.op if last else None
+
+        if op == "return":
+            tails = [0]
+        elif op == "err":
+            tails = []
+        elif op == "retsub":
+            tails = [self._walk(stack[-1], stack[:-1])] if stack else []
+        elif op == "callsub":
+            tails = [self._walk(self.labels[last.args[0]], stack + (index + 1,))]
+        elif op == "b":
+            tails = [self._walk(self.labels[last.args[0]], stack)]
+        elif op in ("bz", "bnz"):
+            taken = self.context.resolve(block.instructions[:-1])
+            if taken is not None and op == "bz":
+                taken = not taken
+            tails = []
+            if taken is not False:
+                tails.append(self._walk(self.labels[last.args[0]], stack))
+            if taken is not True:
+                tails.append(self._walk(index + 1, stack))
+        elif op in ("switch", "match"):
+            tails = [self._walk(self.labels[label], stack) for label in last.args]
+            tails.append(self._walk(index + 1, stack))
+        else:
+            tails = [self._walk(index + 1, stack)]
+
+        self.active.discard(key)
+        tails = [t for t in tails if t is not None]
+        result = block.cost + max(tails) if tails else None
+        self.memo[key] = result
+        return result
+
+
+def varuint_size(value):
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def constant_refs_size(counts, entry_size):
+    """
+    Bytes used by constants once algod has packed them: constants used more than once go into a
+    constant block ordered by frequency, single-use constants are pushed inline.
+    """
+    pooled = [c for c, n in counts.most_common() if n > 1]
+    size = 0
+    if pooled:
+        size += 1 + varuint_size(len(pooled)) + sum(entry_size(c) for c in pooled)
+        for i, c in enumerate(pooled):
+            size += counts[c] * (1 if i < 4 else 2)
+    for c, n in counts.items():
+        if n == 1:
+            size += 1 + entry_size(c)
+    return size
+
+
+def program_size(teal):
+    """Estimate the assembled size in bytes of a TEAL program."""
+    ints, byte_strings = Counter(), Counter()
+    size = 1  # version
+    for block in parse(teal):
+        for i in block.instructions:
+            if i.op == "int":
+                ints[int_value(i.args[0])] += 1
+            elif i.op == "byte":
+                byte_strings[bytes_value(i.args)] += 1
+            elif i.op == "method":
+                byte_strings[i.args[0]] += 1
+            elif i.op == "addr":
+                byte_strings[i.args[0]] += 1
+            elif i.op == "pushint" and i.args[0].startswith("TMPL_"):
+                size += 1 + TEMPLATE_INT_SIZE
+            elif i.op == "pushint":
+                size += 1 + varuint_size(int_value(i.args[0]))
+            elif i.op == "pushbytes":
+                data = bytes_value(i.args)
+                size += 1 + varuint_size(len(data)) + len(data)
+            elif i.op in ("switch", "match"):
+                size += 2 + 2 * len(i.args)
+            else:
+                size += 1 + IMMEDIATE_SIZES.get(i.op, 0)
+
+    def bytes_entry(c):
+        length = 4 if isinstance(c, str) and c.startswith('"') else 32 if isinstance(c, str) else len(c)
+        return varuint_size(length) + length
+
+    size += constant_refs_size(ints, varuint_size)
+    size += constant_refs_size(byte_strings, bytes_entry)
+    return size
+
+
+def contexts(contract):
+    """One call context per ABI method plus the bare calls the router accepts."""
+    result = {}
+    for method in contract.methods:
+        create = router.method_configs[method.get_signature()].no_op.name == "CREATE"
+        result[method.name] = CallContext(
+            num_app_args=1 + len(method.args),
+            on_completion=NAMED_INTS["NoOp"],
+            application_id=0 if create else 1,
+            selector=method.get_signature(),
+        )
+    result["opt_in"] = CallContext(0, NAMED_INTS["OptIn"], 1)
+    result["update_application"] = CallContext(0, NAMED_INTS["UpdateApplication"], 1)
+    result["no_op"] = CallContext(0, NAMED_INTS["NoOp"], 1)
+    return result
+
+
+def measure(algod=None, options=None):
+    approval, clear, contract = build(options) if options else build()
+    analysis = CostAnalysis(approval)
+    methods = {}
+    for name, context in contexts(contract).items():
+        cost, loop = analysis.worst_case(context)
+        methods[name] = {"cost": cost, "loop": loop}
+
+    if algod is not None:
+        sizes = {
+            # Template values compiled as 0, so the figure excludes their patched width
+            "approval": len(b64decode(algod.compile(re.sub(r"\bTMPL_\w+", "0", approval))["result"])),
+            "clear": len(b64decode(algod.compile(clear)["result"])),
+        }
+    else:
+        sizes = {"approval": program_size(approval), "clear": program_size(clear)}
+    return {"methods": methods, "size": sizes}
+
+
+def compare(current, baseline, threshold):
+    """Return a list of regressions of more than `threshold` percent against the baseline."""
+    failures = []
+
+    def check(name, now, before):
+        if now is None or before is None:
+            return
+        if now > before * (1 + threshold / 100):
+            failures.append(f"{name}: {before} -> {now} (+{(now - before) / before:.1%})")
+
+    for name, result in current["methods"].items():
+        if name in baseline["methods"]:
+            check(f"{name} cost", result["cost"], baseline["methods"][name]["cost"])
+    for name, size in current["size"].items():
+        check(f"{name} size", size, baseline["size"].get(name))
+    return failures
+
+
+def report(current, baseline):
+    print(f"{'method':<22}{'cost':>8}{'baseline':>10}{'headroom':>10}")
+    for name, result in current["methods"].items():
+        before = baseline["methods"].get(name, {}).get("cost") if baseline else None
+        cost = result["cost"]
+        headroom = OPCODE_BUDGET - cost if cost is not None else None
+        flag = " (loop: one iteration)" if result["loop"] else ""
+        print(f"{name:<22}{str(cost):>8}{str(before):>10}{str(headroom):>10}{flag}")
+
+    total = current["size"]["approval"] + current["size"]["clear"]
+    pages = -(-total // PAGE_SIZE)
+    print(f"\napproval {current['size']['approval']} bytes, clear {current['size']['clear']} bytes")
+    print(f"total {total} bytes, {pages} page(s), {max(pages - 1, 0)} extra page(s) required")
+
+
+def report_dispatch(declared, profiled, profile):
+    """Per-method cost saved by the profile's dispatch order, and the saving per profiled call."""
+    print(f"{'method':<24}{'calls':>8}{'declared':>10}{'profiled':>10}{'saved':>7}")
+    calls = saved = 0
+    for name in DECLARED_DISPATCH:
+        before = declared["methods"][name]["cost"]
+        after = profiled["methods"][name]["cost"]
+        count = profile.get(name, 0)
+        print(f"{name:<24}{count:>8}{before:>10}{after:>10}{before - after:>7}")
+        calls += count
+        saved += count * (before - after)
+    if calls:
+        print(f"\n{saved / calls:.1f} opcodes saved per call over {calls} profiled calls")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--update", action="store_true", help="write the current figures as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="allowed increase in percent before a figure counts as a regression")
+    parser.add_argument("--baseline", help="baseline file, benchmark[-<layout>].json by default")
+    parser.add_argument("--layout", choices=LAYOUTS, default="keys", help="state layout to build")
+    parser.add_argument("--algod", help="algod address used to compile for exact program sizes")
+    parser.add_argument("--algod-token", default="")
+    parser.add_argument("--profile", help="JSON call-frequency profile: report the dispatch cost it saves")
+    args = parser.parse_args()
+
+    algod = None
+    if args.algod:
+        from algosdk.v2client.algod import AlgodClient
+        algod = AlgodClient(args.algod_token, args.algod)
+
+    if args.profile:
+        with open(args.profile) as f:
+            profile = json.load(f)
+        report_dispatch(measure(algod, build_options(layout=args.layout)),
+                        measure(algod, build_options(args.profile, layout=args.layout)), profile)
+        return 0
+
+    args.baseline = args.baseline or baseline_path(args.layout)
+    current = measure(algod, build_options(layout=args.layout))
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report(current, baseline)
+
+    if args.update:
+        with open(args.baseline, "w") as f:
+            f.write(json.dumps(current, indent=4))
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    failures = []
+    for name, result in current["methods"].items():
+        if result["cost"] is not None and result["cost"] > OPCODE_BUDGET:
+            failures.append(f"{name}: cost {result['cost']} exceeds the {OPCODE_BUDGET} opcode budget")
+    if baseline:
+        failures += compare(current, baseline, args.threshold)
+
+    if failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,520 @@
+"""
+StakingFactory: one app managing many staking pools, each a token/reward pair.
+
+Pools are records in boxes keyed "p" + pool id, holding the settings and price cache a Staking app
+keeps in global state, each with its own rate curve box "c" + pool id. Adding a pool is one admin
+call instead of a deployment. Positions are boxes keyed by account address + pool id, one per
+account and pool, so stakers never opt in; the box MBR is paid on stake and refunded on unstake.
+Locked stake and reward liabilities are kept per asset in ledger boxes "t" + asset id, shared by
+every pool of the asset: stake is locked in the ledger of the pool's token and rewards are owed in
+the ledger of its reward asset, which unstake pays them in. withdraw leaves both in the app.
+
+The curve, reward and compounding logic and the position events are those of staking.py.
+"""
+from pyteal import *
+import artifacts
+from staking import (
+    BUILD_OPTIONS, EVENTS, POSITION_MBR, POSITION_SIZE, abi_json, admin_check, curve_rate,
+    emit, fill_curve, get_asset_price, load_position, position_key, position_value, price_restake,
+    scratch_amount, scratch_index, scratch_le, scratch_ls, scratch_out, scratch_rate, scratch_reward,
+    scratch_rewardPrice, scratch_stakePrice, scratch_staked, scratch_unlock, stake_reward, valid_length,
+)
+
+admin = Bytes("a")
+pool_count = Bytes("n")
+
+# Pool records hold these fields as uint64s, in order
+POOL_FIELDS = ("tid", "rid", "ss", "se", "ls", "le", "f", "o", "pa", "sp", "rp", "pt")
+POOL_SIZE = 8 * len(POOL_FIELDS)
+# Box key prefixes of pool records, rate curves and asset ledgers, each followed by a uint64 id
+POOL_PREFIX = b"p"
+CURVE_PREFIX = b"c"
+LEDGER_PREFIX = b"t"
+# Ledger boxes hold the stake locked in an asset and the rewards owed in it as uint64s
+LEDGER_LOCKED = 0
+LEDGER_LIABILITY = 8
+LEDGER_SIZE = 16
+
+POOL_MBR = 2_500 + 400 * (len(POOL_PREFIX) + 8 + POOL_SIZE)
+LEDGER_MBR = 2_500 + 400 * (len(LEDGER_PREFIX) + 8 + LEDGER_SIZE)
+# Paid with add_pool for the two asset opt-ins, the pool record and the ledgers of both assets, on
+# top of the curve
+POOL_FUNDING = 200_000 + POOL_MBR + 2 * LEDGER_MBR
+# Paid on top with the first add_pool, for the app account's own minimum balance
+APP_FUNDING = 100_000
+
+# Factory positions are the box positions of Staking with the pool id as position id
+FACTORY_EVENTS = {
+    "PoolAdd": [("uint64", "pool"), ("uint64", "token"), ("uint64", "reward")],
+    **{name: EVENTS[name] for name in ("PositionStake", "PositionUnstake", "PositionRestake")},
+}
+
+scratch_pool = ScratchVar(TealType.bytes)
+scratch_pool_id = ScratchVar(TealType.uint64)
+
+
+def pool_key(pool_id: Expr) -> Expr:
+    return Concat(Bytes(POOL_PREFIX), Itob(pool_id))
+
+
+def pool_curve(pool_id: Expr) -> Expr:
+    return Concat(Bytes(CURVE_PREFIX), Itob(pool_id))
+
+
+def ledger_key(asa_id: Expr) -> Expr:
+    return Concat(Bytes(LEDGER_PREFIX), Itob(asa_id))
+
+
+def pool_offset(name: str) -> Expr:
+    return Int(8 * POOL_FIELDS.index(name))
+
+
+def pool_field(name: str) -> Expr:
+    # Expects scratch_pool loaded
+    return ExtractUint64(scratch_pool.load(), pool_offset(name))
+
+
+@Subroutine(TealType.none)
+def load_pool(pool_id: Expr) -> Expr:
+    """Load a pool record into scratch_pool and its id into scratch_pool_id, failing if there is none"""
+    pool = App.box_get(pool_key(pool_id))
+    return Seq(
+        pool,
+        Assert(pool.hasValue()),
+        scratch_pool.store(pool.value()),
+        scratch_pool_id.store(pool_id),
+    )
+
+
+@Subroutine(TealType.none)
+def load_pool_prices() -> Expr:
+    """
+    Load the loaded pool's stake and reward token prices, from its cache while it is younger than the
+    max age, refreshing the cache otherwise
+    """
+    return If(
+        Global.latest_timestamp() < pool_field("pt") + pool_field("pa"),
+    ).Then(
+        scratch_stakePrice.store(pool_field("sp")),
+        scratch_rewardPrice.store(pool_field("rp")),
+    ).Else(
+        scratch_stakePrice.store(get_asset_price(pool_field("o"), pool_field("tid"))),
+        scratch_rewardPrice.store(get_asset_price(pool_field("o"), pool_field("rid"))),
+        # Refresh cache | sp, rp and pt are consecutive
+        App.box_replace(
+            pool_key(scratch_pool_id.load()), pool_offset("sp"),
+            Concat(Itob(scratch_stakePrice.load()), Itob(scratch_rewardPrice.load()), Itob(Global.latest_timestamp())),
+        ),
+    )
+
+
+@Subroutine(TealType.uint64)
+def update_ledger(asa_id: Expr, offset: Expr, add: Expr, sub: Expr) -> Expr:
+    """Add `add` less `sub` to the ledger entry of asa_id at offset, returning the new value"""
+    value = ScratchVar(TealType.uint64)
+    return Seq(
+        value.store(Btoi(App.box_extract(ledger_key(asa_id), offset, Int(8))) + add - sub),
+        App.box_replace(ledger_key(asa_id), offset, Itob(value.load())),
+        value.load(),
+    )
+
+
+def opt_in_asset(asa_id: Expr) -> Expr:
+    return InnerTxnBuilder.Execute({
+        TxnField.type_enum: TxnType.AssetTransfer,
+        TxnField.xfer_asset: asa_id,
+        TxnField.asset_receiver: Global.current_application_address(),
+        TxnField.asset_amount: Int(0),
+        TxnField.fee: Int(0),
+    })
+
+
+router = Router(
+    name="StakingFactory",
+    bare_calls=BareCallActions(
+        update_application=OnCompleteAction(action=admin_check, call_config=CallConfig.CALL),
+        # Approves, so groups can add calls to pool more opcode budget
+        no_op=OnCompleteAction.call_only(Approve()),
+    )
+)
+
+
+# Router methods
+@router.method(no_op=CallConfig.CREATE)
+def create() -> Expr:
+    return Seq(
+        # Set admin
+        App.globalPut(admin, Txn.sender()),
+        # Pool count | the id of the next pool
+        App.globalPut(pool_count, Int(0)),
+        Approve(),
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def add_pool(token: abi.Asset, reward: abi.Asset, ss: abi.Uint64, se: abi.Uint64, ls: abi.Uint64, le: abi.Uint64,
+             price_oracle: abi.Application, max_age: abi.Uint64, *, output: abi.Uint64) -> Expr:
+    """
+    ADMIN Function
+    Used to add a pool, opting in to its tokens and building its rate curve. Returns the pool id
+    Payment must cover POOL_FUNDING and the curve box minimum balance, and for the first pool
+    APP_FUNDING too
+    Fee: 3 + curve OpUp calls
+    """
+    curve_ss = ScratchVar(TealType.uint64)
+    curve_se = ScratchVar(TealType.uint64)
+
+    validation = And(
+        Gtxn[Txn.group_index() - Int(1)].type_enum() == TxnType.Payment,
+        Gtxn[Txn.group_index() - Int(1)].sender() == Txn.sender(),
+        Gtxn[Txn.group_index() - Int(1)].receiver() == Global.current_application_address(),
+        Gtxn[Txn.group_index() - Int(1)].amount() >= Int(POOL_FUNDING + 2_500 + 400 * (len(CURVE_PREFIX) + 8))
+        + (le.get() - ls.get() + Int(1)) * Int(400 * 8)
+        + If(App.globalGet(pool_count) == Int(0)).Then(Int(APP_FUNDING)).Else(Int(0)),
+        ls.get() <= le.get(),
+    )
+
+    logic = Seq(
+        scratch_pool_id.store(App.globalGet(pool_count)),
+        App.globalPut(pool_count, scratch_pool_id.load() + Int(1)),
+        App.box_put(pool_key(scratch_pool_id.load()), Concat(
+            Itob(token.asset_id()), Itob(reward.asset_id()),
+            Itob(ss.get()), Itob(se.get()), Itob(ls.get()), Itob(le.get()),
+            # Freeze flag, price oracle and price cache max age
+            Itob(Int(0)), Itob(price_oracle.application_id()), Itob(max_age.get()),
+            # Price cache
+            BytesZero(Int(24)),
+        )),
+        # Opt-ins and ledgers are shared with other pools of the same tokens
+        opt_in_asset(token.asset_id()),
+        opt_in_asset(reward.asset_id()),
+        Pop(App.box_create(ledger_key(token.asset_id()), Int(LEDGER_SIZE))),
+        Pop(App.box_create(ledger_key(reward.asset_id()), Int(LEDGER_SIZE))),
+        # Rate curve
+        curve_ss.store(ss.get()),
+        curve_se.store(se.get()),
+        scratch_ls.store(ls.get()),
+        scratch_le.store(le.get()),
+        fill_curve(pool_curve(scratch_pool_id.load()), curve_ss, curve_se, scratch_ls, scratch_le),
+        emit("PoolAdd", Itob(scratch_pool_id.load()), Itob(token.asset_id()), Itob(reward.asset_id()),
+             events=FACTORY_EVENTS),
+        output.set(scratch_pool_id.load()),
+    )
+
+    return Seq(
+        admin_check(),
+        Assert(validation),
+        logic,
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def update_admin(addr: abi.Account) -> Expr:
+    """
+    ADMIN Function
+    Used to update the admin address
+    Fee: 1
+    """
+    return Seq(
+        admin_check(),
+        App.globalPut(admin, addr.address()),
+        Approve(),
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def update_pool(pool_id: abi.Uint64, ss: abi.Uint64, se: abi.Uint64, ls: abi.Uint64, le: abi.Uint64) -> Expr:
+    """
+    ADMIN Function
+    Used to update a pool's slope and lengths and rebuild its rate curve
+    The app must hold the minimum balance of a larger curve
+    Fee: 1 + curve OpUp calls
+    """
+    curve_ss = ScratchVar(TealType.uint64)
+    curve_se = ScratchVar(TealType.uint64)
+
+    logic = Seq(
+        load_pool(pool_id.get()),
+        # ss, se, ls and le are consecutive
+        App.box_replace(pool_key(pool_id.get()), pool_offset("ss"),
+                        Concat(Itob(ss.get()), Itob(se.get()), Itob(ls.get()), Itob(le.get()))),
+        curve_ss.store(ss.get()),
+        curve_se.store(se.get()),
+        scratch_ls.store(ls.get()),
+        scratch_le.store(le.get()),
+        fill_curve(pool_curve(pool_id.get()), curve_ss, curve_se, scratch_ls, scratch_le),
+    )
+
+    return Seq(
+        admin_check(),
+        Assert(ls.get() <= le.get()),
+        logic,
+        Approve(),
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def set_pool(pool_id: abi.Uint64, price_oracle: abi.Application, max_age: abi.Uint64, frozen: abi.Uint64) -> Expr:
+    """
+    ADMIN Function
+    Used to set a pool's price oracle, price cache max age and freeze flag, dropping its cached prices
+    Fee: 1
+    """
+    return Seq(
+        admin_check(),
+        load_pool(pool_id.get()),
+        # f, o and pa are consecutive
+        App.box_replace(pool_key(pool_id.get()), pool_offset("f"),
+                        Concat(Itob(frozen.get()), Itob(price_oracle.application_id()), Itob(max_age.get()))),
+        App.box_replace(pool_key(pool_id.get()), pool_offset("pt"), Itob(Int(0))),
+        Approve(),
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def withdraw(asset: abi.Asset, amount: abi.Uint64) -> Expr:
+    """
+    ADMIN Function
+    Used to withdraw Algo or ASA from the contract, to withdraw ALGO, asset should be 1
+    Stake locked and rewards owed in any pool stay in the app
+    Fee: 2
+    """
+    ledger = App.box_get(ledger_key(asset.asset_id()))
+
+    logic = Seq(
+        InnerTxnBuilder.Begin(),
+        If(  # If ALGO
+            asset.asset_id() == Int(1),
+        ).Then(
+            # Send to admin
+            InnerTxnBuilder.SetFields({
+                TxnField.type_enum: TxnType.Payment,
+                TxnField.receiver: Txn.sender(),
+                TxnField.amount: amount.get(),
+                TxnField.fee: Int(0),
+            }),
+        ).Else(
+            # Validate there is enough token with locked value
+            balance := AssetHolding.balance(Global.current_application_address(), asset.asset_id()),
+            Assert(balance.hasValue()),
+            ledger,
+            # Verify free token is greater than amount, assets no pool uses have no ledger
+            Assert(Gt(
+                balance.value()
+                - If(ledger.hasValue())
+                .Then(ExtractUint64(ledger.value(), Int(LEDGER_LOCKED)) + ExtractUint64(ledger.value(), Int(LEDGER_LIABILITY)))
+                .Else(Int(0)),
+                amount.get(),
+            )),
+            # Send to admin
+            InnerTxnBuilder.SetFields({
+                TxnField.type_enum: TxnType.AssetTransfer,
+                TxnField.xfer_asset: asset.asset_id(),
+                TxnField.asset_receiver: Txn.sender(),
+                TxnField.asset_amount: amount.get(),
+                TxnField.fee: Int(0),
+            }),
+        ),
+        InnerTxnBuilder.Submit(),
+    )
+
+    return Seq(
+        admin_check(),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def stake(pool_id: abi.Uint64, asset: abi.Asset, length: abi.Uint64) -> Expr:
+    """
+    Used to stake tokens into a pool, in a new position box keyed by sender and pool id
+    Group: payment of POSITION_MBR to the app, asset transfer, app call
+    Fee: 1
+    """
+    load = Seq(
+        load_pool(pool_id.get()),
+        # Cache the asset transfer index, amount and length bounds
+        scratch_index.store(Txn.group_index() - Int(1)),
+        scratch_amount.store(Gtxn[scratch_index.load()].asset_amount()),
+        scratch_ls.store(pool_field("ls")),
+        scratch_le.store(pool_field("le")),
+    )
+
+    validation = And(
+        # Verify MBR payment
+        Gtxn[scratch_index.load() - Int(1)].type_enum() == TxnType.Payment,
+        Gtxn[scratch_index.load() - Int(1)].sender() == Txn.sender(),
+        Gtxn[scratch_index.load() - Int(1)].receiver() == Global.current_application_address(),
+        Gtxn[scratch_index.load() - Int(1)].amount() >= Int(POSITION_MBR),
+        # Verify ASA Tx
+        Gtxn[scratch_index.load()].type_enum() == TxnType.AssetTransfer,
+        Gtxn[scratch_index.load()].sender() == Txn.sender(),
+        Gtxn[scratch_index.load()].asset_receiver() == Global.current_application_address(),
+        scratch_amount.load() > Int(0),
+        Gtxn[scratch_index.load()].xfer_asset() == asset.asset_id(),
+        # Verify correct token id
+        pool_field("tid") == asset.asset_id(),
+        # Verify correct length
+        valid_length(length.get()),
+        # Frozen check
+        pool_field("f") == Int(0),
+    )
+
+    logic = Seq(
+        # Fails if the sender already has a position in the pool
+        Assert(App.box_create(position_key(pool_id.get()), Int(POSITION_SIZE))),
+        # Look up the interest rate for the length on the pool's curve
+        scratch_rate.store(curve_rate(length.get(), scratch_ls.load(), pool_curve(pool_id.get()))),
+        load_pool_prices(),
+        # Calculate reward as output less the staked amount
+        scratch_reward.store(stake_reward(scratch_amount.load())),
+        # Set position
+        scratch_unlock.store(Global.latest_timestamp() + (length.get() * Int(86400))),
+        App.box_put(
+            position_key(pool_id.get()),
+            position_value(scratch_amount.load(), scratch_reward.load(), scratch_unlock.load()),
+        ),
+        emit("PositionStake", Txn.sender(), Itob(pool_id.get()), Itob(scratch_amount.load()), Itob(scratch_reward.load()),
+             Itob(scratch_rate.load()), Itob(scratch_unlock.load()),
+             # Update ledger locked and liability
+             Itob(update_ledger(asset.asset_id(), Int(LEDGER_LOCKED), scratch_amount.load(), Int(0))),
+             Itob(update_ledger(pool_field("rid"), Int(LEDGER_LIABILITY), scratch_reward.load(), Int(0)))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def unstake(pool_id: abi.Uint64, asset: abi.Asset, reward: abi.Asset) -> Expr:
+    """
+    Used to unstake from a pool, deleting the position box and refunding its MBR
+    Fee: 4
+    """
+    validation = And(
+        # Verify correct token ids
+        pool_field("tid") == asset.asset_id(),
+        pool_field("rid") == reward.asset_id(),
+        # Verify time is up
+        Global.latest_timestamp() > scratch_unlock.load(),
+    )
+
+    logic = Seq(
+        # Send stake, reward and the box MBR to user
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: asset.asset_id(),
+            TxnField.asset_receiver: Txn.sender(),
+            TxnField.asset_amount: scratch_staked.load(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: reward.asset_id(),
+            TxnField.asset_receiver: Txn.sender(),
+            TxnField.asset_amount: scratch_reward.load(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.Payment,
+            TxnField.receiver: Txn.sender(),
+            TxnField.amount: Int(POSITION_MBR),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Submit(),
+        Pop(App.box_delete(position_key(pool_id.get()))),
+        emit("PositionUnstake", Txn.sender(), Itob(pool_id.get()), Itob(scratch_staked.load()), Itob(scratch_reward.load()),
+             # Subtract the position from ledger locked and liability
+             Itob(update_ledger(asset.asset_id(), Int(LEDGER_LOCKED), Int(0), scratch_staked.load())),
+             Itob(update_ledger(reward.asset_id(), Int(LEDGER_LIABILITY), Int(0), scratch_reward.load()))),
+    )
+
+    return Seq(
+        load_pool(pool_id.get()),
+        # Fails if the position does not exist
+        load_position(position_key(pool_id.get())),
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def restake(pool_id: abi.Uint64, asset: abi.Asset, length: abi.Uint64) -> Expr:
+    """
+    Used to restake a pool position in place
+    Fee: 1
+    """
+    load = Seq(
+        load_pool(pool_id.get()),
+        # Fails if the position does not exist
+        load_position(position_key(pool_id.get())),
+        scratch_ls.store(pool_field("ls")),
+        scratch_le.store(pool_field("le")),
+    )
+
+    validation = And(
+        # Verify correct token id
+        pool_field("tid") == asset.asset_id(),
+        # Verify correct length
+        valid_length(length.get()),
+        # Verify time is up
+        Global.latest_timestamp() > scratch_unlock.load(),
+        # Frozen check
+        pool_field("f") == Int(0),
+    )
+
+    logic = Seq(
+        price_restake(length.get(), pool_curve(pool_id.get())),
+        # Set position
+        scratch_unlock.store(Global.latest_timestamp() + (length.get() * Int(86400))),
+        App.box_put(
+            position_key(pool_id.get()),
+            position_value(scratch_amount.load(), scratch_out.load(), scratch_unlock.load()),
+        ),
+        emit("PositionRestake", Txn.sender(), Itob(pool_id.get()), Itob(scratch_amount.load()), Itob(scratch_out.load()),
+             Itob(scratch_rate.load()), Itob(scratch_unlock.load()),
+             # Replace the old position in ledger locked and liability
+             Itob(update_ledger(asset.asset_id(), Int(LEDGER_LOCKED), scratch_amount.load(), scratch_staked.load())),
+             Itob(update_ledger(pool_field("rid"), Int(LEDGER_LIABILITY), scratch_out.load(), scratch_reward.load()))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+# Compile
+GLOBAL_SCHEMA = {"num_uints": 1, "num_byte_slices": 1}
+LOCAL_SCHEMA = {"num_uints": 0, "num_byte_slices": 0}
+EXTRA_PAGES = 1
+
+
+def build(options=BUILD_OPTIONS):
+    return router.compile_program(version=options["version"], optimize=OptimizeOptions(**options["optimize"]))
+
+
+def build_artifacts(options=BUILD_OPTIONS):
+    """build(), with the ABI as a JSON dict carrying the ARC-28 events"""
+    approval, clear, contract = build(options)
+    return approval, clear, abi_json(contract, FACTORY_EVENTS, ())
+
+
+if __name__ == "__main__":
+    artifacts.build_cached(
+        router.name, BUILD_OPTIONS, build_artifacts,
+        global_schema=GLOBAL_SCHEMA,
+        local_schema=LOCAL_SCHEMA,
+        extra_pages=EXTRA_PAGES,
+    )
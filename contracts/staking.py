@@ -1,6 +1,7 @@
 from pyteal import *
-import os
+import argparse
 import json
+import artifacts
 
 token_id = Bytes("tid")
 reward_id = Bytes("rid")
@@ -14,11 +15,194 @@ total_liability = Bytes("tl")
 staked = Bytes("s")
 total_reward = Bytes("tr")
 stake_unlock = Bytes("su")
+curve = Bytes("c")
+oracle = Bytes("o")
+stake_price = Bytes("sp")
+reward_price = Bytes("rp")
+price_time = Bytes("pt")
+price_max_age = Bytes("pa")
+# Reward stream (accumulator mode): reward per share index, reward rate per second, last update,
+# period end and total staked shares
+reward_per_share = Bytes("rps")
+reward_rate = Bytes("rr")
+last_update = Bytes("lu")
+period_end = Bytes("pe")
+total_shares = Bytes("ts")
+# Packed layout: the settings in one global byte slice and the local position in one record
+packed_settings = Bytes("cfg")
+packed_position = Bytes("p")
+SETTINGS = ("tid", "rid", "ss", "se", "ls", "le", "f", "o", "pa")
+LOCAL_FIELDS = ("s", "tr", "su")
+
+# Opcode budget reserved per entry when building the curve
+CURVE_ENTRY_COST = 60
+
+# Position boxes are keyed by account address + position id and hold staked, total reward and
+# stake unlock as uint64s
+POSITION_SIZE = 24
+# Minimum balance a position box locks up, paid when staking and refunded on unstake
+POSITION_MBR = 2_500 + 400 * (32 + 8 + POSITION_SIZE)
+# Opcode budget reserved per position settled by unstake_positions
+UNSTAKE_ENTRY_COST = 120
+# Position id of the box migrate_positions moves a local state position into
+MIGRATED_POSITION = 2**64 - 1
+
+# Stream position boxes are keyed by "s" + account address and hold staked, the reward per share
+# index at the last settlement and the settled but unclaimed reward as uint64s
+STREAM_PREFIX = b"s"
+STREAM_SIZE = 24
+STREAM_MBR = 2_500 + 400 * (len(STREAM_PREFIX) + 32 + STREAM_SIZE)
+# Fixed point scale of the reward per share index. The index stays within uint64 while the reward
+# streamed per staked base unit over the pool's life stays below 1.8e10
+SHARE_SCALE = 1_000_000_000
+
+# Per-pool constants. build() pushes each template variable into its fixed scratch slot at the start
+# of the approval program, so one compiled program serves every pool and deploy patches the
+# values into the bytecode locally
+pool_token = ScratchVar(TealType.uint64, 250)
+pool_reward = ScratchVar(TealType.uint64, 251)
+TEMPLATE_VARS = {
+    "TMPL_TOKEN_ID": pool_token,
+    "TMPL_REWARD_ID": pool_reward,
+}
+
+# ARC-28 events logged on every position change, with the resulting global locked and liability.
+# Position events are those of box positions, keyed by account and position id
+_POSITION = [("address", "account"), ("uint64", "staked"), ("uint64", "total_reward")]
+_STAKE = [("uint64", "rate"), ("uint64", "stake_unlock"), ("uint64", "locked"), ("uint64", "total_liability")]
+_UNSTAKE = [("uint64", "locked"), ("uint64", "total_liability")]
+EVENTS = {
+    "Stake": _POSITION + _STAKE,
+    "Unstake": _POSITION + _UNSTAKE,
+    "Restake": _POSITION + _STAKE,
+    "PositionStake": _POSITION[:1] + [("uint64", "position")] + _POSITION[1:] + _STAKE,
+    "PositionUnstake": _POSITION[:1] + [("uint64", "position")] + _POSITION[1:] + _UNSTAKE,
+    "PositionRestake": _POSITION[:1] + [("uint64", "position")] + _POSITION[1:] + _STAKE,
+    "PositionMigrate": _POSITION[:1] + [("uint64", "position")] + _POSITION[1:] + [("uint64", "stake_unlock")],
+    "StreamStake": [("address", "account"), ("uint64", "amount"), ("uint64", "staked"),
+                    ("uint64", "reward_per_share"), ("uint64", "locked")],
+    "StreamUnstake": [("address", "account"), ("uint64", "amount"), ("uint64", "staked"), ("uint64", "claimed"),
+                      ("uint64", "reward_per_share"), ("uint64", "locked"), ("uint64", "total_liability")],
+    "StreamClaim": [("address", "account"), ("uint64", "claimed"), ("uint64", "reward_per_share"),
+                    ("uint64", "total_liability")],
+    "StreamFund": [("uint64", "amount"), ("uint64", "reward_rate"), ("uint64", "period_end"),
+                   ("uint64", "total_liability")],
+}
+# Event arguments are all static, and a transaction may log at most MAX_LOG_BYTES
+EVENT_ARG_SIZES = {"address": 32, "uint64": 8}
+MAX_LOG_BYTES = 1024
+
+
+def event_size(name: str, events=EVENTS) -> int:
+    return 4 + sum(EVENT_ARG_SIZES[arg_type] for arg_type, _ in events[name])
+
+
+# unstake_positions logs a PositionUnstake event per position
+MAX_UNSTAKE_POSITIONS = MAX_LOG_BYTES // event_size("PositionUnstake")
 
 scratch_rate = ScratchVar(TealType.uint64)
 scratch_out = ScratchVar(TealType.uint64)
 scratch_stakePrice = ScratchVar(TealType.uint64)
 scratch_rewardPrice = ScratchVar(TealType.uint64)
+scratch_index = ScratchVar(TealType.uint64)
+scratch_amount = ScratchVar(TealType.uint64)
+scratch_staked = ScratchVar(TealType.uint64)
+scratch_reward = ScratchVar(TealType.uint64)
+scratch_ls = ScratchVar(TealType.uint64)
+scratch_le = ScratchVar(TealType.uint64)
+scratch_unlock = ScratchVar(TealType.uint64)
+scratch_owner = ScratchVar(TealType.bytes)
+scratch_owner_amount = ScratchVar(TealType.uint64)
+scratch_owner_reward = ScratchVar(TealType.uint64)
+scratch_owner_positions = ScratchVar(TealType.uint64)
+scratch_position = ScratchVar(TealType.bytes)
+scratch_settings = ScratchVar(TealType.bytes)
+
+
+# Build profile and state layout the method bodies are generated for, set by build(). PyTeal
+# generates each body once, on the first compile, so one process builds one profile and layout
+build_profile = {"debug": None, "layout": None}
+
+# Comment compiled before every debug-only expression, which production builds are checked for
+DEBUG_MARKER = "DEBUG"
+
+
+def debug_only(expr: Expr, production: Expr = None) -> Expr:
+    # expr in debug builds, production (or nothing) in production builds
+    if build_profile["debug"]:
+        return Comment(DEBUG_MARKER, expr)
+    return production if production is not None else Seq()
+
+
+def packed() -> bool:
+    return build_profile["layout"] == "packed"
+
+
+def _offset(key: Bytes, fields) -> Expr:
+    return Int(8 * fields.index(key.byte_str.strip('"')))
+
+
+def load_settings() -> Expr:
+    # Packed layout: read the settings record once per call into scratch_settings, which
+    # get_setting extracts from and put_settings updates. Methods reading settings start with it
+    if packed():
+        return scratch_settings.store(App.globalGet(packed_settings))
+    return Seq()
+
+
+def get_setting(key: Bytes) -> Expr:
+    if packed():
+        return ExtractUint64(scratch_settings.load(), _offset(key, SETTINGS))
+    return App.globalGet(key)
+
+
+def put_settings(*values) -> Expr:
+    # Write (key, value) pairs of settings, in one global write in the packed layout
+    if not packed():
+        return Seq(*[App.globalPut(key, value) for key, value in values])
+    if len(values) == len(SETTINGS):
+        by_offset = sorted(values, key=lambda kv: SETTINGS.index(kv[0].byte_str.strip('"')))
+        settings = Concat(*[Itob(value) for _, value in by_offset])
+    else:
+        settings = scratch_settings.load()
+        for key, value in values:
+            settings = Replace(settings, _offset(key, SETTINGS), Itob(value))
+    return Seq(
+        scratch_settings.store(settings),
+        App.globalPut(packed_settings, scratch_settings.load()),
+    )
+
+
+def load_local_position(account: Expr) -> Expr:
+    # Load the local state position of account into scratch_staked, scratch_reward and scratch_unlock
+    if packed():
+        return Seq(
+            scratch_position.store(App.localGet(account, packed_position)),
+            scratch_staked.store(ExtractUint64(scratch_position.load(), Int(0))),
+            scratch_reward.store(ExtractUint64(scratch_position.load(), Int(8))),
+            scratch_unlock.store(ExtractUint64(scratch_position.load(), Int(16))),
+        )
+    return Seq(
+        scratch_staked.store(App.localGet(account, staked)),
+        scratch_reward.store(App.localGet(account, total_reward)),
+        scratch_unlock.store(App.localGet(account, stake_unlock)),
+    )
+
+
+def get_local_staked(account: Expr) -> Expr:
+    if packed():
+        return ExtractUint64(App.localGet(account, packed_position), Int(0))
+    return App.localGet(account, staked)
+
+
+def put_local_position(account: Expr, staked_value: Expr, reward: Expr, unlock: Expr) -> Expr:
+    if packed():
+        return App.localPut(account, packed_position, position_value(staked_value, reward, unlock))
+    return Seq(
+        App.localPut(account, staked, staked_value),
+        App.localPut(account, total_reward, reward),
+        App.localPut(account, stake_unlock, unlock),
+    )
 
 
 @Subroutine(TealType.none)
@@ -27,63 +211,314 @@ def admin_check() -> Expr:
 
 
 @Subroutine(TealType.uint64)
-def interest_rate(length: abi.Uint64) -> Expr:
-    rate = App.globalGet(slope_start) + ((length.get() - App.globalGet(length_start)) *
-                                          (Int(1_000_000) * (App.globalGet(slope_end) - App.globalGet(slope_start))) /
-                                          (App.globalGet(length_end) - App.globalGet(length_start))) / Int(1_000_000)
+def interest_rate(length: Expr, ss: Expr, se: Expr, ls: Expr, le: Expr) -> Expr:
+    # Settings are passed in so each is read from global state once per call
+    rate = ss + ((length - ls) * (Int(1_000_000) * (se - ss)) / (le - ls)) / Int(1_000_000)
     # Adjust APR to rate over the given length
-    return (length.get() * Int(1_000_000)) / Int(365) * rate / Int(1_000_000)
+    return (length * Int(1_000_000)) / Int(365) * rate / Int(1_000_000)
+
+@Subroutine(TealType.none)
+def build_curve() -> Expr:
+    """Precompute the rate of every lock length from ls to le into the curve box"""
+    ss = ScratchVar(TealType.uint64)
+    se = ScratchVar(TealType.uint64)
+    ls = ScratchVar(TealType.uint64)
+    le = ScratchVar(TealType.uint64)
+    return Seq(
+        ss.store(get_setting(slope_start)),
+        se.store(get_setting(slope_end)),
+        ls.store(get_setting(length_start)),
+        le.store(get_setting(length_end)),
+        fill_curve(curve, ss, se, ls, le),
+    )
+
+
+def fill_curve(box: Expr, ss: ScratchVar, se: ScratchVar, ls: ScratchVar, le: ScratchVar) -> Expr:
+    # Recreate box sized for the length range, one uint64 rate per length, requesting the budget
+    i = ScratchVar(TealType.uint64)
+    return Seq(
+        OpUp(OpUpMode.OnCall).ensure_budget(
+            (le.load() - ls.load() + Int(1)) * Int(CURVE_ENTRY_COST), OpUpFeeSource.GroupCredit
+        ),
+        Pop(App.box_delete(box)),
+        Assert(App.box_create(box, (le.load() - ls.load() + Int(1)) * Int(8))),
+        For(i.store(ls.load()), i.load() <= le.load(), i.store(i.load() + Int(1))).Do(
+            App.box_replace(box, (i.load() - ls.load()) * Int(8),
+                            Itob(interest_rate(i.load(), ss.load(), se.load(), ls.load(), le.load())))
+        ),
+    )
+
+
+def curve_rate(length: Expr, ls: Expr, box: Expr = curve) -> Expr:
+    # Rate over the lock length, precomputed by build_curve or set_curve
+    return Btoi(App.box_extract(box, (length - ls) * Int(8), Int(8)))
+
 
 @Subroutine(TealType.uint64)
-def get_asset_price(folks_feed_oracle: abi.Application, asa_id: abi.Asset):
-    asa_info = App.globalGetEx(folks_feed_oracle.application_id(), Itob(asa_id.asset_id()))
+def get_asset_price(folks_feed_oracle: Expr, asa_id: Expr):
+    asa_info = App.globalGetEx(folks_feed_oracle, Itob(asa_id))
     return Seq(asa_info, Assert(asa_info.hasValue()), ExtractUint64(asa_info.value(), Int(0)))
 
 
+@Subroutine(TealType.none)
+def load_prices(asa_id: Expr, refresh: Expr) -> Expr:
+    """
+    Load stake and reward token prices, from the cache while it is younger than the max age
+    Prices read from the oracle are cached if refresh is set, read-only methods leave it unset
+    """
+    return If(
+        Global.latest_timestamp() < App.globalGet(price_time) + get_setting(price_max_age),
+    ).Then(
+        scratch_stakePrice.store(App.globalGet(stake_price)),
+        scratch_rewardPrice.store(App.globalGet(reward_price)),
+    ).Else(
+        scratch_stakePrice.store(get_asset_price(get_setting(oracle), asa_id)),
+        scratch_rewardPrice.store(get_asset_price(get_setting(oracle), pool_reward.load())),
+        # Refresh cache
+        If(refresh).Then(
+            App.globalPut(stake_price, scratch_stakePrice.load()),
+            App.globalPut(reward_price, scratch_rewardPrice.load()),
+            App.globalPut(price_time, Global.latest_timestamp()),
+        ),
+    )
+
+
+def event_signature(name: str, events=EVENTS) -> str:
+    return f"{name}({','.join(arg_type for arg_type, _ in events[name])})"
 
-optin = Seq(
-    # Staked
-    App.localPut(Txn.sender(), staked, Int(0)),
-    # Total reward
-    App.localPut(Txn.sender(), total_reward, Int(0)),
-    # Stake unlock
-    App.localPut(Txn.sender(), stake_unlock, Int(0)),
-    Approve()
-)
+
+def emit(name: str, *values: Expr, events=EVENTS) -> Expr:
+    # ARC-28: the event selector followed by its ABI encoded (all static) arguments
+    return Log(Concat(MethodSignature(event_signature(name, events)), *values))
+
+
+def stake_reward(amount: Expr) -> Expr:
+    # Output in reward tokens at the loaded prices and scratch_rate, less the staked amount
+    return (
+        ((amount * scratch_stakePrice.load() * (Int(1_000_000) + scratch_rate.load())) / scratch_rewardPrice.load()) / Int(1_000_000)
+        - amount
+    )
+
+
+def compound_reward(amount: Expr) -> Expr:
+    # Output of restaking amount at scratch_rate, less the compounded amount
+    return WideRatio([amount, Int(1_000_000) + scratch_rate.load()], [Int(1_000_000)]) - amount
+
+
+def valid_length(length: Expr) -> Expr:
+    # Expects scratch_ls and scratch_le loaded
+    return And(length >= scratch_ls.load(), length <= scratch_le.load())
+
+
+def price_stake(amount: Expr, length: Expr, asa_id: Expr, refresh: Expr) -> Expr:
+    # Store the rate for the lock length in scratch_rate and the reward for staking amount in scratch_reward
+    return Seq(
+        # Look up the interest rate for the length on the precomputed curve
+        scratch_rate.store(curve_rate(length, scratch_ls.load())),
+        load_prices(asa_id, refresh),
+        # Calculate reward as output less the staked amount
+        scratch_reward.store(stake_reward(amount)),
+    )
+
+
+def price_restake(length: Expr, box: Expr = curve) -> Expr:
+    # Compound scratch_staked and scratch_reward into scratch_amount, with the new reward in scratch_out
+    return Seq(
+        # Look up the interest rate for the length on the precomputed curve
+        scratch_rate.store(curve_rate(length, scratch_ls.load(), box)),
+        # Compound reward into the staked amount
+        scratch_amount.store(scratch_staked.load() + scratch_reward.load()),
+        # Calculate new reward as output less the compounded amount
+        scratch_out.store(compound_reward(scratch_amount.load())),
+    )
+
+
+def position_key(pid: Expr) -> Expr:
+    return Concat(Txn.sender(), Itob(pid))
+
+
+def position_value(staked: Expr, reward: Expr, unlock: Expr) -> Expr:
+    return Concat(Itob(staked), Itob(reward), Itob(unlock))
+
+
+@Subroutine(TealType.none)
+def load_position(key: Expr) -> Expr:
+    """Load a position box into scratch_staked, scratch_reward and scratch_unlock"""
+    position = App.box_get(key)
+    return Seq(
+        position,
+        Assert(position.hasValue()),
+        scratch_staked.store(ExtractUint64(position.value(), Int(0))),
+        scratch_reward.store(ExtractUint64(position.value(), Int(8))),
+        scratch_unlock.store(ExtractUint64(position.value(), Int(16))),
+    )
+
+
+@Subroutine(TealType.none)
+def update_stream() -> Expr:
+    """Accrue the reward streamed since the last update into the reward per share index"""
+    now = ScratchVar(TealType.uint64)
+    return Seq(
+        # Nothing streams past the end of the period
+        now.store(If(Global.latest_timestamp() < App.globalGet(period_end))
+                  .Then(Global.latest_timestamp()).Else(App.globalGet(period_end))),
+        If(now.load() > App.globalGet(last_update)).Then(
+            If(App.globalGet(total_shares) > Int(0)).Then(
+                App.globalPut(reward_per_share, App.globalGet(reward_per_share) + WideRatio(
+                    [now.load() - App.globalGet(last_update), App.globalGet(reward_rate), Int(SHARE_SCALE)],
+                    [App.globalGet(total_shares)],
+                )),
+            ).Else(
+                # Streamed to nobody, so it is no longer owed
+                App.globalPut(total_liability, App.globalGet(total_liability)
+                              - (now.load() - App.globalGet(last_update)) * App.globalGet(reward_rate)),
+            ),
+            App.globalPut(last_update, now.load()),
+        ),
+    )
+
+
+def stream_key() -> Expr:
+    return Concat(Bytes(STREAM_PREFIX), Txn.sender())
+
+
+@Subroutine(TealType.none)
+def settle_stream() -> Expr:
+    """
+    Update the stream and load the sender's stream position into scratch_staked, with the reward
+    settled up to the current index in scratch_reward. A missing position loads as empty
+    """
+    position = App.box_get(stream_key())
+    return Seq(
+        update_stream(),
+        position,
+        If(position.hasValue()).Then(
+            scratch_staked.store(ExtractUint64(position.value(), Int(0))),
+            scratch_reward.store(ExtractUint64(position.value(), Int(16)) + WideRatio(
+                [scratch_staked.load(), App.globalGet(reward_per_share) - ExtractUint64(position.value(), Int(8))],
+                [Int(SHARE_SCALE)],
+            )),
+        ).Else(
+            scratch_staked.store(Int(0)),
+            scratch_reward.store(Int(0)),
+        ),
+    )
+
+
+def put_stream() -> Expr:
+    # Write scratch_staked and scratch_reward back, settled at the current index
+    return App.box_put(
+        stream_key(),
+        position_value(scratch_staked.load(), App.globalGet(reward_per_share), scratch_reward.load()),
+    )
+
+
+def pay_reward(asa_id: Expr, amount: Expr) -> Expr:
+    # Inner transfer of claimed stream reward to the sender, in an open inner group
+    return InnerTxnBuilder.SetFields({
+        TxnField.type_enum: TxnType.AssetTransfer,
+        TxnField.xfer_asset: asa_id,
+        TxnField.asset_receiver: Txn.sender(),
+        TxnField.asset_amount: amount,
+        TxnField.fee: Int(0),
+    })
+
+
+@Subroutine(TealType.none)
+def settle_owner(asa_id: Expr, reward_id: Expr) -> Expr:
+    """Pay scratch_owner its accumulated stake and reward, and refund its position MBRs"""
+    return Seq(
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: asa_id,
+            TxnField.asset_receiver: scratch_owner.load(),
+            TxnField.asset_amount: scratch_owner_amount.load(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: reward_id,
+            TxnField.asset_receiver: scratch_owner.load(),
+            TxnField.asset_amount: scratch_owner_reward.load(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.Payment,
+            TxnField.receiver: scratch_owner.load(),
+            TxnField.amount: scratch_owner_positions.load() * Int(POSITION_MBR),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Submit(),
+        scratch_owner_amount.store(Int(0)),
+        scratch_owner_reward.store(Int(0)),
+        scratch_owner_positions.store(Int(0)),
+    )
+
+
+def optin() -> Expr:
+    return Seq(
+        # Staked, total reward and stake unlock
+        put_local_position(Txn.sender(), Int(0), Int(0), Int(0)),
+        Approve()
+    )
 
 router = Router(
     name="Staking",
     bare_calls=BareCallActions(
-        opt_in=OnCompleteAction(action=optin, call_config=CallConfig.CALL),
+        opt_in=OnCompleteAction(action=Subroutine(TealType.none, "optin")(optin), call_config=CallConfig.CALL),
         update_application=OnCompleteAction(action=admin_check, call_config=CallConfig.CALL),
+        # Approves, so groups can add calls to pool more opcode budget
+        no_op=OnCompleteAction.call_only(Approve()),
     )
 )
 
 
 # Router methods
 @router.method(no_op=CallConfig.CREATE)
-def create(token: abi.Asset, ss: abi.Uint64, se: abi.Uint64, ls: abi.Uint64, le: abi.Uint64, reward: abi.Asset) -> Expr:
+def create(token: abi.Asset, ss: abi.Uint64, se: abi.Uint64, ls: abi.Uint64, le: abi.Uint64, reward: abi.Asset, price_oracle: abi.Application) -> Expr:
     logic = Seq(
+        # Token ids are fixed by the program template, the arguments must match them
+        Assert(pool_token.load() == token.asset_id()),
+        Assert(pool_reward.load() == reward.asset_id()),
         # Set admin
         App.globalPut(Bytes("a"), Txn.sender()),
-        # Staking Token
-        App.globalPut(token_id, token.asset_id()),
-        # Reward Token
-        App.globalPut(reward_id, reward.asset_id()),
-        # Freeze flag | if set to 1 then the contract is frozen
-        App.globalPut(freeze_flag, Int(1)),
-        # Slope start
-        App.globalPut(slope_start, ss.get()),
-        # Slope end
-        App.globalPut(slope_end, se.get()),
-        # Length start
-        App.globalPut(length_start, ls.get()),
-        # Length end
-        App.globalPut(length_end, le.get()),
+        put_settings(
+            # Staking Token
+            (token_id, token.asset_id()),
+            # Reward Token
+            (reward_id, reward.asset_id()),
+            # Freeze flag | if set to 1 then the contract is frozen
+            (freeze_flag, Int(1)),
+            # Slope start
+            (slope_start, ss.get()),
+            # Slope end
+            (slope_end, se.get()),
+            # Length start
+            (length_start, ls.get()),
+            # Length end
+            (length_end, le.get()),
+            # Price oracle app
+            (oracle, price_oracle.application_id()),
+            # Price cache max age | cache disabled until config sets it
+            (price_max_age, Int(0)),
+        ),
         # Locked | How much of the ASA is locked (owned by user)
         App.globalPut(locked, Int(1)),
         # Total liability | How much the contract owes to stakers
         App.globalPut(total_liability, Int(0)),
+        # Price cache
+        App.globalPut(stake_price, Int(0)),
+        App.globalPut(reward_price, Int(0)),
+        App.globalPut(price_time, Int(0)),
+        # Reward stream | idle until funded
+        App.globalPut(reward_per_share, Int(0)),
+        App.globalPut(reward_rate, Int(0)),
+        App.globalPut(last_update, Int(0)),
+        App.globalPut(period_end, Int(0)),
+        App.globalPut(total_shares, Int(0)),
         # Approve
         Approve()
     )
@@ -95,23 +530,26 @@ def create(token: abi.Asset, ss: abi.Uint64, se: abi.Uint64, ls: abi.Uint64, le:
 
 
 @router.method(no_op=CallConfig.CALL)
-def config(token: abi.Asset, reward: abi.Asset):
+def config(token: abi.Asset, reward: abi.Asset, price_oracle: abi.Application, max_age: abi.Uint64):
     """
     ADMIN Function
-    Used to configure params in contract and do opt-ins
-    Fee: 2
+    Used to configure params in contract, do opt-ins and build the rate curve
+    Sets the price oracle and how many seconds oracle prices are cached for, 0 disables the cache
+    Payment must also cover the curve box minimum balance
+    Fee: 3 + curve OpUp calls
     """
     validation = And(
         Gtxn[Txn.group_index() - Int(1)].type_enum() == TxnType.Payment,
         Gtxn[Txn.group_index() - Int(1)].sender() == Txn.sender(),
         Gtxn[Txn.group_index() - Int(1)].receiver() == Global.current_application_address(),
-        Gtxn[Txn.group_index() - Int(1)].amount() == Int(200_000),
+        Gtxn[Txn.group_index() - Int(1)].amount() >= Int(200_000),
         # Verify correct token id
-        App.globalGet(token_id) == token.asset_id(),
-        App.globalGet(reward_id) == reward.asset_id(),
+        pool_token.load() == token.asset_id(),
+        pool_reward.load() == reward.asset_id(),
     )
 
     logic = Seq(
+        load_settings(),
         # Opt-in to token
         InnerTxnBuilder.Begin(),
         InnerTxnBuilder.SetFields({
@@ -133,8 +571,17 @@ def config(token: abi.Asset, reward: abi.Asset):
         }),
         InnerTxnBuilder.Submit(),
 
-        # Unfreeze contract
-        App.globalPut(freeze_flag, Int(0)),
+        # Rate curve
+        build_curve(),
+
+        # Price oracle and cache max age, and unfreeze contract
+        put_settings(
+            (oracle, price_oracle.application_id()),
+            (price_max_age, max_age.get()),
+            (freeze_flag, Int(0)),
+        ),
+        # Drop prices cached from a previous oracle
+        App.globalPut(price_time, Int(0)),
     )
 
     return Seq(
@@ -167,15 +614,21 @@ def update_admin(addr: abi.Account) -> Expr:
 def update_settings(ss: abi.Uint64, se: abi.Uint64, ls: abi.Uint64, le: abi.Uint64) -> Expr:
     """
     ADMIN Function
-    Update staking variables
+    Update staking variables and rebuild the rate curve
+    Fee: 1 + curve OpUp calls
     """
 
     logic = Seq(
+        load_settings(),
         # Update ss, se, ls and le
-        App.globalPut(slope_start, ss.get()),
-        App.globalPut(slope_end, se.get()),
-        App.globalPut(length_start, ls.get()),
-        App.globalPut(length_end, le.get()),
+        put_settings(
+            (slope_start, ss.get()),
+            (slope_end, se.get()),
+            (length_start, ls.get()),
+            (length_end, le.get()),
+        ),
+        # Precompute the linear curve
+        build_curve(),
     )
 
     return Seq(
@@ -237,53 +690,49 @@ def stake(asset: abi.Asset, length: abi.Uint64) -> Expr:
     Used to stake tokens
     Fee: 1
     """
+    load = Seq(
+        # Cache the asset transfer index, amount, settings and length bounds
+        scratch_index.store(Txn.group_index() - Int(1)),
+        scratch_amount.store(Gtxn[scratch_index.load()].asset_amount()),
+        load_settings(),
+        scratch_ls.store(get_setting(length_start)),
+        scratch_le.store(get_setting(length_end)),
+    )
+
     validation = And(
         # Verify ASA Tx
-        Gtxn[Txn.group_index() - Int(1)].type_enum() == TxnType.AssetTransfer,
-        Gtxn[Txn.group_index() - Int(1)].sender() == Txn.sender(),
-        Gtxn[Txn.group_index() - Int(1)].asset_receiver() == Global.current_application_address(),
-        Gtxn[Txn.group_index() - Int(1)].asset_amount() > Int(0),
-        Gtxn[Txn.group_index() - Int(1)].xfer_asset() == asset.asset_id(),
+        Gtxn[scratch_index.load()].type_enum() == TxnType.AssetTransfer,
+        Gtxn[scratch_index.load()].sender() == Txn.sender(),
+        Gtxn[scratch_index.load()].asset_receiver() == Global.current_application_address(),
+        scratch_amount.load() > Int(0),
+        Gtxn[scratch_index.load()].xfer_asset() == asset.asset_id(),
         # Verify correct token id
-        App.globalGet(token_id) == asset.asset_id(),
+        pool_token.load() == asset.asset_id(),
         # Verify correct length
-        And(
-            length.get() >= App.globalGet(length_start),
-            length.get() <= App.globalGet(length_end),
-        ),
+        valid_length(length.get()),
         # Verify there is no current stake
-        App.localGet(Txn.sender(), staked) == Int(0),
+        get_local_staked(Txn.sender()) == Int(0),
         # Frozen check
-        App.globalGet(freeze_flag) == Int(0),
+        get_setting(freeze_flag) == Int(0),
     )
 
     logic = Seq(
-        # Calculate interest rate using linear slope from start to end
-        scratch_rate.store(
-            interest_rate(length)
-        ),
-        scratch_stakePrice.store(get_asset_price(159512493, asset)),
-        scratch_rewardPrice.store(get_asset_price(159512493, App.globalGet(reward_id))),
-        # DEBUG store scratch_rate
-        App.globalPut(Bytes("RATE"), scratch_rate.load()), #DEBUGDEBUGDEBUGDEBUGDEBUGDEBUGDEBUG
-        # Calculate output
-        scratch_out.store(
-            ((Gtxn[Txn.group_index() - Int(1)].asset_amount() * scratch_stakePrice.load() * (Int(1_000_000) + scratch_rate.load())) / scratch_rewardPrice.load()) / Int(1_000_000)
-        ),# (stakedAmount * staked_asset_price)  * rate 
-        # Set staked amount
-        App.localPut(Txn.sender(), staked, Gtxn[Txn.group_index() - Int(1)].asset_amount()),
-        # Set reward
-        App.localPut(Txn.sender(), total_reward, scratch_out.load() - Gtxn[Txn.group_index() - Int(1)].asset_amount()),
-        # Set stake_unlock
-        App.localPut(Txn.sender(), stake_unlock, Global.latest_timestamp() + (length.get() * Int(86400))), 
+        price_stake(scratch_amount.load(), length.get(), asset.asset_id(), Int(1)),
+        # Store scratch_rate for inspection
+        debug_only(App.globalPut(Bytes("RATE"), scratch_rate.load())),
+        # Set staked amount, reward and stake_unlock
+        scratch_unlock.store(Global.latest_timestamp() + (length.get() * Int(86400))),
+        put_local_position(Txn.sender(), scratch_amount.load(), scratch_reward.load(), scratch_unlock.load()),
         # Update global locked
-        App.globalPut(locked, App.globalGet(locked) + App.localGet(Txn.sender(), staked)),
+        App.globalPut(locked, App.globalGet(locked) + scratch_amount.load()),
         # Update global liability
-        App.globalPut(total_liability, App.globalGet(total_liability) + App.localGet(Txn.sender(), total_reward)),
-
+        App.globalPut(total_liability, App.globalGet(total_liability) + scratch_reward.load()),
+        emit("Stake", Txn.sender(), Itob(scratch_amount.load()), Itob(scratch_reward.load()), Itob(scratch_rate.load()),
+             Itob(scratch_unlock.load()), Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
     )
 
     return Seq(
+        load,
         Assert(validation),
         logic,
         Approve()
@@ -294,17 +743,20 @@ def stake(asset: abi.Asset, length: abi.Uint64) -> Expr:
 def unstake(asset: abi.Asset, reward: abi.Asset) -> Expr:
     """
     Used to unstake tokens
-    Fee: 2
+    Fee: 3
     """
+    # Cache the current position
+    load = load_local_position(Txn.sender())
+
     validation = And(
         # Verify correct token id
-        App.globalGet(token_id) == asset.asset_id(),
+        pool_token.load() == asset.asset_id(),
         # Verify correct reward id
-        App.globalGet(reward_id) == reward.asset_id(),
+        pool_reward.load() == reward.asset_id(),
         # Verify there is a current stake
-        App.localGet(Txn.sender(), staked) > Int(0),
+        scratch_staked.load() > Int(0),
         # Verify time is up
-        Global.latest_timestamp() > App.localGet(Txn.sender(), stake_unlock),
+        Global.latest_timestamp() > scratch_unlock.load(),
     )
 
     logic = Seq(
@@ -315,7 +767,7 @@ def unstake(asset: abi.Asset, reward: abi.Asset) -> Expr:
             TxnField.type_enum: TxnType.AssetTransfer,
             TxnField.xfer_asset: asset.asset_id(),
             TxnField.asset_receiver: Txn.sender(),
-            TxnField.asset_amount: App.localGet(Txn.sender(), staked),
+            TxnField.asset_amount: scratch_staked.load(),
             TxnField.fee: Int(0),
         }),
     
@@ -323,27 +775,26 @@ def unstake(asset: abi.Asset, reward: abi.Asset) -> Expr:
         
         InnerTxnBuilder.SetFields({
             TxnField.type_enum: TxnType.AssetTransfer,
-            TxnField.xfer_asset: asset.asset_id(),
+            TxnField.xfer_asset: reward.asset_id(),
             TxnField.asset_receiver: Txn.sender(),
-            TxnField.asset_amount: App.localGet(Txn.sender(), total_reward),
+            TxnField.asset_amount: scratch_reward.load(),
             TxnField.fee: Int(0),
         }),
         
         InnerTxnBuilder.Submit(),
         
         # Subtract staked amount from global locked
-        App.globalPut(locked, App.globalGet(locked) - App.localGet(Txn.sender(), staked)),
+        App.globalPut(locked, App.globalGet(locked) - scratch_staked.load()),
         # Subtract reward from global liability
-        App.globalPut(total_liability, App.globalGet(total_liability) - App.localGet(Txn.sender(), staked)),
-        # Set staked amount to 0
-        App.localPut(Txn.sender(), staked, Int(0)),
-        # Set reward to 0
-        App.localPut(Txn.sender(), total_reward, Int(0)),
-        # Set stake_unlock to 0
-        App.localPut(Txn.sender(), stake_unlock, Int(0)),
+        App.globalPut(total_liability, App.globalGet(total_liability) - scratch_reward.load()),
+        emit("Unstake", Txn.sender(), Itob(scratch_staked.load()), Itob(scratch_reward.load()),
+             Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
+        # Set staked amount, reward and stake_unlock to 0
+        put_local_position(Txn.sender(), Int(0), Int(0), Int(0)),
     )
 
     return Seq(
+        load,
         Assert(validation),
         logic,
         Approve()
@@ -356,81 +807,809 @@ def restake(asset: abi.Asset, length: abi.Uint64) -> Expr:
     Used to restake tokens
     Fee: 1
     """
+    load = Seq(
+        # Cache the current position, settings and length bounds
+        load_local_position(Txn.sender()),
+        load_settings(),
+        scratch_ls.store(get_setting(length_start)),
+        scratch_le.store(get_setting(length_end)),
+    )
+
     validation = And(
         # Verify correct token id
-        App.globalGet(token_id) == asset.asset_id(),
+        pool_token.load() == asset.asset_id(),
         # Verify correct length
-        And(
-            length.get() >= App.globalGet(length_start),
-            length.get() <= App.globalGet(length_end),
-        ),
+        valid_length(length.get()),
         # Verify there is a current stake
-        App.localGet(Txn.sender(), staked) > Int(0),
+        scratch_staked.load() > Int(0),
         # Verify time is up
-        Global.latest_timestamp() > App.localGet(Txn.sender(), stake_unlock),
+        Global.latest_timestamp() > scratch_unlock.load(),
         # Frozen check
-        App.globalGet(freeze_flag) == Int(0),
+        get_setting(freeze_flag) == Int(0),
     )
 
     logic = Seq(
-        # Calculate interest rate using linear slope from start to end
-        scratch_rate.store(
-            interest_rate(length)
-        ),
-        # DEBUG store scratch_rate
-        App.globalPut(Bytes("RATE"), scratch_rate.load()), #DEBUGDEBUGDEBUGDEBUGDEBUGDEBUGDEBUG
-        # Calculate output
-        scratch_out.store(
-            WideRatio(
-                [App.localGet(Txn.sender(), staked) + App.localGet(Txn.sender(), total_reward), Int(1_000_000) + scratch_rate.load()],
-                [Int(1_000_000)]
-            )
+        price_restake(length.get()),
+        # Store scratch_rate for inspection
+        debug_only(App.globalPut(Bytes("RATE"), scratch_rate.load())),
+        # Replace the old position in global locked
+        App.globalPut(locked, App.globalGet(locked) - scratch_staked.load() + scratch_amount.load()),
+        # Replace the old reward in global liability
+        App.globalPut(total_liability, App.globalGet(total_liability) - scratch_reward.load() + scratch_out.load()),
+        # Set staked amount, reward and stake_unlock
+        # Debug builds unlock restaked positions at once
+        scratch_unlock.store(Global.latest_timestamp() + debug_only(Int(0), length.get() * Int(86400))),
+        put_local_position(Txn.sender(), scratch_amount.load(), scratch_out.load(), scratch_unlock.load()),
+        emit("Restake", Txn.sender(), Itob(scratch_amount.load()), Itob(scratch_out.load()), Itob(scratch_rate.load()),
+             Itob(scratch_unlock.load()), Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def stake_position(asset: abi.Asset, length: abi.Uint64, pid: abi.Uint64) -> Expr:
+    """
+    Used to stake tokens into a new position box, keyed by sender and position id
+    Group: payment of POSITION_MBR to the app, asset transfer, app call
+    Fee: 1
+    """
+    load = Seq(
+        # Cache the asset transfer index, amount, settings and length bounds
+        scratch_index.store(Txn.group_index() - Int(1)),
+        scratch_amount.store(Gtxn[scratch_index.load()].asset_amount()),
+        load_settings(),
+        scratch_ls.store(get_setting(length_start)),
+        scratch_le.store(get_setting(length_end)),
+    )
+
+    validation = And(
+        # Verify MBR payment
+        Gtxn[scratch_index.load() - Int(1)].type_enum() == TxnType.Payment,
+        Gtxn[scratch_index.load() - Int(1)].sender() == Txn.sender(),
+        Gtxn[scratch_index.load() - Int(1)].receiver() == Global.current_application_address(),
+        Gtxn[scratch_index.load() - Int(1)].amount() >= Int(POSITION_MBR),
+        # Verify ASA Tx
+        Gtxn[scratch_index.load()].type_enum() == TxnType.AssetTransfer,
+        Gtxn[scratch_index.load()].sender() == Txn.sender(),
+        Gtxn[scratch_index.load()].asset_receiver() == Global.current_application_address(),
+        scratch_amount.load() > Int(0),
+        Gtxn[scratch_index.load()].xfer_asset() == asset.asset_id(),
+        # Verify correct token id
+        pool_token.load() == asset.asset_id(),
+        # Verify correct length
+        valid_length(length.get()),
+        # The migrated position id is reserved for migrate_positions
+        pid.get() != Int(MIGRATED_POSITION),
+        # Frozen check
+        get_setting(freeze_flag) == Int(0),
+    )
+
+    logic = Seq(
+        # Fails if the position id is already in use
+        Assert(App.box_create(position_key(pid.get()), Int(POSITION_SIZE))),
+        price_stake(scratch_amount.load(), length.get(), asset.asset_id(), Int(1)),
+        # Set position
+        scratch_unlock.store(Global.latest_timestamp() + (length.get() * Int(86400))),
+        App.box_put(
+            position_key(pid.get()),
+            position_value(scratch_amount.load(), scratch_reward.load(), scratch_unlock.load()),
         ),
-        # Reduce global locked
-        App.globalPut(locked, App.globalGet(locked) - App.localGet(Txn.sender(), staked)),
-        # Reduce global liability
-        App.globalPut(total_liability, App.globalGet(total_liability) - App.localGet(Txn.sender(), total_reward)),
-        # Set staked amount
-        App.localPut(Txn.sender(), staked, App.localGet(Txn.sender(), staked) + App.localGet(Txn.sender(), total_reward)),
-        # Set reward
-        App.localPut(Txn.sender(), total_reward, scratch_out.load() - App.localGet(Txn.sender(), staked)),
-        # Set stake_unlock
-        App.localPut(Txn.sender(), stake_unlock, Global.latest_timestamp() + (length.get() * Int(86400) * Int(0))), #DEBUGDEBUGDEBUGDEBUGDEBUGDEBUGDEBUG
         # Update global locked
-        App.globalPut(locked, App.globalGet(locked) + App.localGet(Txn.sender(), staked)),
+        App.globalPut(locked, App.globalGet(locked) + scratch_amount.load()),
         # Update global liability
-        App.globalPut(total_liability, App.globalGet(total_liability) + App.localGet(Txn.sender(), total_reward)),
+        App.globalPut(total_liability, App.globalGet(total_liability) + scratch_reward.load()),
+        emit("PositionStake", Txn.sender(), Itob(pid.get()), Itob(scratch_amount.load()), Itob(scratch_reward.load()),
+             Itob(scratch_rate.load()), Itob(scratch_unlock.load()),
+             Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def unstake_position(asset: abi.Asset, reward: abi.Asset, pid: abi.Uint64) -> Expr:
+    """
+    Used to unstake a position, deleting its box and refunding its MBR. Migrated positions had
+    their MBR paid by the admin, so it stays in the app for withdraw
+    Fee: 4
+    """
+    validation = And(
+        # Verify correct token id
+        pool_token.load() == asset.asset_id(),
+        # Verify correct reward id
+        pool_reward.load() == reward.asset_id(),
+        # Verify time is up
+        Global.latest_timestamp() > scratch_unlock.load(),
+    )
+
+    logic = Seq(
+        # Send tokens and the box MBR to user
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: asset.asset_id(),
+            TxnField.asset_receiver: Txn.sender(),
+            TxnField.asset_amount: scratch_staked.load(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: reward.asset_id(),
+            TxnField.asset_receiver: Txn.sender(),
+            TxnField.asset_amount: scratch_reward.load(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.Payment,
+            TxnField.receiver: Txn.sender(),
+            TxnField.amount: If(pid.get() == Int(MIGRATED_POSITION)).Then(Int(0)).Else(Int(POSITION_MBR)),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Submit(),
+        # Subtract staked amount from global locked
+        App.globalPut(locked, App.globalGet(locked) - scratch_staked.load()),
+        # Subtract reward from global liability
+        App.globalPut(total_liability, App.globalGet(total_liability) - scratch_reward.load()),
+        Pop(App.box_delete(position_key(pid.get()))),
+        emit("PositionUnstake", Txn.sender(), Itob(pid.get()), Itob(scratch_staked.load()), Itob(scratch_reward.load()),
+             Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
+    )
+
+    return Seq(
+        # Fails if the position does not exist
+        load_position(position_key(pid.get())),
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def restake_position(asset: abi.Asset, length: abi.Uint64, pid: abi.Uint64) -> Expr:
+    """
+    Used to restake a position in place
+    Fee: 1
+    """
+    load = Seq(
+        # Fails if the position does not exist
+        load_position(position_key(pid.get())),
+        load_settings(),
+        scratch_ls.store(get_setting(length_start)),
+        scratch_le.store(get_setting(length_end)),
+    )
+
+    validation = And(
+        # Verify correct token id
+        pool_token.load() == asset.asset_id(),
+        # Verify correct length
+        valid_length(length.get()),
+        # Verify time is up
+        Global.latest_timestamp() > scratch_unlock.load(),
+        # Frozen check
+        get_setting(freeze_flag) == Int(0),
+    )
+
+    logic = Seq(
+        price_restake(length.get()),
+        # Replace the old position in global locked
+        App.globalPut(locked, App.globalGet(locked) - scratch_staked.load() + scratch_amount.load()),
+        # Replace the old reward in global liability
+        App.globalPut(total_liability, App.globalGet(total_liability) - scratch_reward.load() + scratch_out.load()),
+        # Set position
+        scratch_unlock.store(Global.latest_timestamp() + (length.get() * Int(86400))),
+        App.box_put(
+            position_key(pid.get()),
+            position_value(scratch_amount.load(), scratch_out.load(), scratch_unlock.load()),
+        ),
+        emit("PositionRestake", Txn.sender(), Itob(pid.get()), Itob(scratch_amount.load()), Itob(scratch_out.load()),
+             Itob(scratch_rate.load()), Itob(scratch_unlock.load()),
+             Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
+    )
 
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def unstake_positions(asset: abi.Asset, reward: abi.Asset, positions: abi.DynamicArray[abi.Tuple2[abi.Address, abi.Uint64]]) -> Expr:
+    """
+    Used to unstake many matured positions in one call, each given as (owner, position id)
+    Consecutive positions of the same owner are paid out together: a stake transfer,
+    a reward transfer and an MBR refund (nothing for migrated positions), 3 inner transactions per run
+    Every owner must be the sender, unless the sender is the admin
+    Owners other than the sender must be in the accounts array
+    At most MAX_UNSTAKE_POSITIONS (13) positions, as each logs a PositionUnstake event
+    Fee: 1 + 3 per run of owner positions, plus 1 per 700 opcode budget requested
+    """
+    i = ScratchVar(TealType.uint64)
+    is_admin = ScratchVar(TealType.uint64)
+    sum_staked = ScratchVar(TealType.uint64)
+    sum_reward = ScratchVar(TealType.uint64)
+    entry = abi.make(abi.Tuple2[abi.Address, abi.Uint64])
+    owner = abi.Address()
+    pid = abi.Uint64()
+
+    validation = And(
+        # Verify correct token id
+        pool_token.load() == asset.asset_id(),
+        # Verify correct reward id
+        pool_reward.load() == reward.asset_id(),
+        positions.length() > Int(0),
+        # The events of more positions would exceed the log limit
+        positions.length() <= Int(MAX_UNSTAKE_POSITIONS),
+    )
+
+    logic = Seq(
+        OpUp(OpUpMode.OnCall).ensure_budget(
+            positions.length() * Int(UNSTAKE_ENTRY_COST), OpUpFeeSource.GroupCredit
+        ),
+        is_admin.store(Txn.sender() == App.globalGet(Bytes("a"))),
+        sum_staked.store(Int(0)),
+        sum_reward.store(Int(0)),
+        scratch_owner_amount.store(Int(0)),
+        scratch_owner_reward.store(Int(0)),
+        scratch_owner_positions.store(Int(0)),
+        # Compared with the first owner too, as And evaluates both sides
+        scratch_owner.store(Global.zero_address()),
+        For(i.store(Int(0)), i.load() < positions.length(), i.store(i.load() + Int(1))).Do(
+            positions[i.load()].store_into(entry),
+            entry[0].store_into(owner),
+            entry[1].store_into(pid),
+            # Only the admin settles other owners' positions
+            Assert(Or(is_admin.load(), owner.get() == Txn.sender())),
+            # Pay out the previous owner once its run of positions ends
+            If(And(i.load() > Int(0), owner.get() != scratch_owner.load())).Then(settle_owner(asset.asset_id(), reward.asset_id())),
+            scratch_owner.store(owner.get()),
+            # Fails if the position does not exist
+            load_position(Concat(owner.get(), Itob(pid.get()))),
+            # Verify time is up
+            Assert(Global.latest_timestamp() > scratch_unlock.load()),
+            Pop(App.box_delete(Concat(owner.get(), Itob(pid.get())))),
+            scratch_owner_amount.store(scratch_owner_amount.load() + scratch_staked.load()),
+            scratch_owner_reward.store(scratch_owner_reward.load() + scratch_reward.load()),
+            # Migrated positions' MBR was paid by the admin and is not refunded
+            scratch_owner_positions.store(scratch_owner_positions.load() + (pid.get() != Int(MIGRATED_POSITION))),
+            sum_staked.store(sum_staked.load() + scratch_staked.load()),
+            sum_reward.store(sum_reward.load() + scratch_reward.load()),
+            # Globals are written once after the loop, so log their running values
+            emit("PositionUnstake", owner.get(), Itob(pid.get()), Itob(scratch_staked.load()), Itob(scratch_reward.load()),
+                 Itob(App.globalGet(locked) - sum_staked.load()),
+                 Itob(App.globalGet(total_liability) - sum_reward.load())),
+        ),
+        settle_owner(asset.asset_id(), reward.asset_id()),
+        # Subtract staked amounts from global locked
+        App.globalPut(locked, App.globalGet(locked) - sum_staked.load()),
+        # Subtract rewards from global liability
+        App.globalPut(total_liability, App.globalGet(total_liability) - sum_reward.load()),
+    )
+
+    return Seq(
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def set_curve(offset: abi.Uint64, rates: abi.DynamicArray[abi.Uint64]) -> Expr:
+    """
+    ADMIN Function
+    Overwrite curve rates from lock length ls + offset onwards, for non-linear or piecewise curves
+    Rates are over the whole lock length, as computed by interest_rate
+    """
+
+    logic = Seq(
+        # Copy the encoded array without its length prefix
+        App.box_replace(curve, offset.get() * Int(8), Suffix(rates.encode(), Int(2))),
+    )
+
+    return Seq(
+        admin_check(),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def fund_stream(reward: abi.Asset, duration: abi.Uint64) -> Expr:
+    """
+    ADMIN Function
+    Stream the reward tokens transferred in the previous transaction, plus what is left of the
+    current period, evenly over the next duration seconds
+    """
+    leftover = ScratchVar(TealType.uint64)
+
+    load = Seq(
+        scratch_index.store(Txn.group_index() - Int(1)),
+        scratch_amount.store(Gtxn[scratch_index.load()].asset_amount()),
+    )
+
+    validation = And(
+        # Verify ASA Tx
+        Gtxn[scratch_index.load()].type_enum() == TxnType.AssetTransfer,
+        Gtxn[scratch_index.load()].asset_receiver() == Global.current_application_address(),
+        Gtxn[scratch_index.load()].xfer_asset() == reward.asset_id(),
+        # Verify correct reward id
+        pool_reward.load() == reward.asset_id(),
+        duration.get() > Int(0),
+    )
+
+    logic = Seq(
+        update_stream(),
+        leftover.store(If(Global.latest_timestamp() < App.globalGet(period_end))
+                       .Then((App.globalGet(period_end) - Global.latest_timestamp()) * App.globalGet(reward_rate))
+                       .Else(Int(0))),
+        App.globalPut(reward_rate, (scratch_amount.load() + leftover.load()) / duration.get()),
+        # Only what the new rate streams is owed, the rounding remainder stays free
+        App.globalPut(total_liability, App.globalGet(total_liability) - leftover.load()
+                      + App.globalGet(reward_rate) * duration.get()),
+        App.globalPut(last_update, Global.latest_timestamp()),
+        App.globalPut(period_end, Global.latest_timestamp() + duration.get()),
+        emit("StreamFund", Itob(scratch_amount.load()), Itob(App.globalGet(reward_rate)),
+             Itob(App.globalGet(period_end)), Itob(App.globalGet(total_liability))),
+    )
+
+    return Seq(
+        admin_check(),
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def stream_stake(asset: abi.Asset) -> Expr:
+    """
+    Used to stake tokens into the reward stream, adding to the sender's stream position
+    Group: payment of STREAM_MBR to the app when opening the position, asset transfer, app call
+    Fee: 1
+    """
+    exists = App.box_length(stream_key())
+
+    load = Seq(
+        scratch_index.store(Txn.group_index() - Int(1)),
+        scratch_amount.store(Gtxn[scratch_index.load()].asset_amount()),
+        load_settings(),
+        exists,
+    )
+
+    validation = And(
+        # Verify MBR payment for a new position, branching as Or evaluates both sides and there is
+        # no transaction before the asset transfer when topping up
+        If(exists.hasValue()).Then(Int(1)).Else(
+            And(
+                Gtxn[scratch_index.load() - Int(1)].type_enum() == TxnType.Payment,
+                Gtxn[scratch_index.load() - Int(1)].sender() == Txn.sender(),
+                Gtxn[scratch_index.load() - Int(1)].receiver() == Global.current_application_address(),
+                Gtxn[scratch_index.load() - Int(1)].amount() >= Int(STREAM_MBR),
+            ),
+        ),
+        # Verify ASA Tx
+        Gtxn[scratch_index.load()].type_enum() == TxnType.AssetTransfer,
+        Gtxn[scratch_index.load()].sender() == Txn.sender(),
+        Gtxn[scratch_index.load()].asset_receiver() == Global.current_application_address(),
+        scratch_amount.load() > Int(0),
+        Gtxn[scratch_index.load()].xfer_asset() == asset.asset_id(),
+        # Verify correct token id
+        pool_token.load() == asset.asset_id(),
+        # Frozen check
+        get_setting(freeze_flag) == Int(0),
+    )
+
+    logic = Seq(
+        settle_stream(),
+        scratch_staked.store(scratch_staked.load() + scratch_amount.load()),
+        put_stream(),
+        App.globalPut(total_shares, App.globalGet(total_shares) + scratch_amount.load()),
+        App.globalPut(locked, App.globalGet(locked) + scratch_amount.load()),
+        emit("StreamStake", Txn.sender(), Itob(scratch_amount.load()), Itob(scratch_staked.load()),
+             Itob(App.globalGet(reward_per_share)), Itob(App.globalGet(locked))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def stream_unstake(asset: abi.Asset, reward: abi.Asset, amount: abi.Uint64) -> Expr:
+    """
+    Used to unstake amount from the sender's stream position, claiming its reward
+    Unstaking everything deletes the position box and refunds its MBR
+    Fee: 3 (2 unless the position is closed)
+    """
+    validation = And(
+        # Verify correct token id
+        pool_token.load() == asset.asset_id(),
+        # Verify correct reward id
+        pool_reward.load() == reward.asset_id(),
+        # Verify there is a position, which a missing box loads as empty, and enough staked
+        scratch_staked.load() > Int(0),
+        amount.get() > Int(0),
+        amount.get() <= scratch_staked.load(),
+    )
+
+    logic = Seq(
+        # Claimed reward
+        scratch_out.store(scratch_reward.load()),
+        scratch_staked.store(scratch_staked.load() - amount.get()),
+        App.globalPut(total_shares, App.globalGet(total_shares) - amount.get()),
+        App.globalPut(locked, App.globalGet(locked) - amount.get()),
+        App.globalPut(total_liability, App.globalGet(total_liability) - scratch_reward.load()),
+        # Send tokens and reward to user
+        InnerTxnBuilder.Begin(),
+        InnerTxnBuilder.SetFields({
+            TxnField.type_enum: TxnType.AssetTransfer,
+            TxnField.xfer_asset: asset.asset_id(),
+            TxnField.asset_receiver: Txn.sender(),
+            TxnField.asset_amount: amount.get(),
+            TxnField.fee: Int(0),
+        }),
+        InnerTxnBuilder.Next(),
+        pay_reward(reward.asset_id(), scratch_reward.load()),
+        If(scratch_staked.load() == Int(0)).Then(
+            InnerTxnBuilder.Next(),
+            InnerTxnBuilder.SetFields({
+                TxnField.type_enum: TxnType.Payment,
+                TxnField.receiver: Txn.sender(),
+                TxnField.amount: Int(STREAM_MBR),
+                TxnField.fee: Int(0),
+            }),
+            # Only the MBR of a deleted box is refunded
+            Assert(App.box_delete(stream_key())),
+        ).Else(
+            scratch_reward.store(Int(0)),
+            put_stream(),
+        ),
+        InnerTxnBuilder.Submit(),
+        emit("StreamUnstake", Txn.sender(), Itob(amount.get()), Itob(scratch_staked.load()),
+             Itob(scratch_out.load()), Itob(App.globalGet(reward_per_share)),
+             Itob(App.globalGet(locked)), Itob(App.globalGet(total_liability))),
+    )
+
+    return Seq(
+        settle_stream(),
+        Assert(validation),
+        logic,
+        Approve()
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def stream_claim(reward: abi.Asset) -> Expr:
+    """
+    Used to claim the reward streamed to the sender's stream position so far
+    Fee: 2
+    """
+    validation = And(
+        # Verify correct reward id
+        pool_reward.load() == reward.asset_id(),
+        scratch_staked.load() > Int(0),
+    )
+
+    logic = Seq(
+        App.globalPut(total_liability, App.globalGet(total_liability) - scratch_reward.load()),
+        InnerTxnBuilder.Begin(),
+        pay_reward(reward.asset_id(), scratch_reward.load()),
+        InnerTxnBuilder.Submit(),
+        emit("StreamClaim", Txn.sender(), Itob(scratch_reward.load()), Itob(App.globalGet(reward_per_share)),
+             Itob(App.globalGet(total_liability))),
+        scratch_reward.store(Int(0)),
+        put_stream(),
     )
 
     return Seq(
+        settle_stream(),
         Assert(validation),
         logic,
         Approve()
     )
 
 
+@router.method(no_op=CallConfig.CALL)
+def migrate_positions(owners: abi.DynamicArray[abi.Address]) -> Expr:
+    """
+    ADMIN Function
+    Used to move the local state positions of owners into position boxes with id MIGRATED_POSITION,
+    clearing them in local state. Global locked and liability count both and stay as they are
+    Owners without a stake are skipped, so a batch can be sent again, and so are owners that already
+    have a migrated position, who keep their local position
+    Owners must be in the accounts array and their boxes referenced. The app must hold POSITION_MBR
+    per migrated position, which stays in the app when the position is unstaked
+    Fee: 1
+    """
+    i = ScratchVar(TealType.uint64)
+    owner = abi.Address()
+
+    logic = For(i.store(Int(0)), i.load() < owners.length(), i.store(i.load() + Int(1))).Do(
+        owners[i.load()].store_into(owner),
+        load_local_position(owner.get()),
+        If(scratch_staked.load() > Int(0)).Then(
+            # box_create returns 0 if the owner already has a migrated position
+            If(App.box_create(Concat(owner.get(), Itob(Int(MIGRATED_POSITION))), Int(POSITION_SIZE))).Then(
+                App.box_put(
+                    Concat(owner.get(), Itob(Int(MIGRATED_POSITION))),
+                    position_value(scratch_staked.load(), scratch_reward.load(), scratch_unlock.load()),
+                ),
+                put_local_position(owner.get(), Int(0), Int(0), Int(0)),
+                emit("PositionMigrate", owner.get(), Itob(Int(MIGRATED_POSITION)), Itob(scratch_staked.load()),
+                     Itob(scratch_reward.load()), Itob(scratch_unlock.load())),
+            ),
+        ),
+    )
+
+    return Seq(
+        admin_check(),
+        logic,
+        Approve()
+    )
+
+
+# Read-only methods, marked readonly in the built ABI and meant to be called with simulate
+READ_ONLY = ("quote_stake", "quote_restake", "get_position")
+
+
+class Quote(abi.NamedTuple):
+    staked: abi.Field[abi.Uint64]
+    total_reward: abi.Field[abi.Uint64]
+    rate: abi.Field[abi.Uint64]
+    stake_unlock: abi.Field[abi.Uint64]
+
+
+class Position(abi.NamedTuple):
+    staked: abi.Field[abi.Uint64]
+    total_reward: abi.Field[abi.Uint64]
+    stake_unlock: abi.Field[abi.Uint64]
+
+
+def set_uint64s(output: abi.NamedTuple, *values: Expr) -> Expr:
+    fields = [abi.Uint64() for _ in values]
+    return Seq(*[field.set(value) for field, value in zip(fields, values)], output.set(*fields))
+
+
+@router.method(no_op=CallConfig.CALL)
+def quote_stake(amount: abi.Uint64, length: abi.Uint64, *, output: Quote) -> Expr:
+    """
+    READ-ONLY
+    Position stake would open now for amount over length, at the cached or oracle prices
+    Needs the curve box and the oracle app referenced, as stake does
+    """
+    load = Seq(
+        load_settings(),
+        scratch_ls.store(get_setting(length_start)),
+        scratch_le.store(get_setting(length_end)),
+    )
+
+    validation = And(
+        # Verify correct length
+        valid_length(length.get()),
+        # Frozen check
+        get_setting(freeze_flag) == Int(0),
+    )
+
+    logic = Seq(
+        price_stake(amount.get(), length.get(), pool_token.load(), Int(0)),
+        set_uint64s(output, amount.get(), scratch_reward.load(), scratch_rate.load(),
+                    Global.latest_timestamp() + (length.get() * Int(86400))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def quote_restake(account: abi.Account, length: abi.Uint64, *, output: Quote) -> Expr:
+    """
+    READ-ONLY
+    Position restake would give account now for length, compounding its current stake
+    """
+    load = Seq(
+        load_local_position(account.address()),
+        load_settings(),
+        scratch_ls.store(get_setting(length_start)),
+        scratch_le.store(get_setting(length_end)),
+    )
+
+    validation = And(
+        # Verify correct length
+        valid_length(length.get()),
+        # Verify there is a current stake
+        scratch_staked.load() > Int(0),
+    )
+
+    logic = Seq(
+        price_restake(length.get()),
+        set_uint64s(output, scratch_amount.load(), scratch_out.load(), scratch_rate.load(),
+                    Global.latest_timestamp() + (length.get() * Int(86400))),
+    )
+
+    return Seq(
+        load,
+        Assert(validation),
+        logic,
+    )
+
+
+@router.method(no_op=CallConfig.CALL)
+def get_position(account: abi.Account, *, output: Position) -> Expr:
+    """
+    READ-ONLY
+    Local state position of account
+    """
+    return Seq(
+        load_local_position(account.address()),
+        set_uint64s(output, scratch_staked.load(), scratch_reward.load(), scratch_unlock.load()),
+    )
+
+
+
 # Compile
-if __name__ == "__main__":
-    approval_program, clear_state_program, contract = router.compile_program(
-        version=7, optimize=OptimizeOptions(scratch_slots=True)
+BUILD_OPTIONS = {
+    "version": 8,
+    "optimize": {"scratch_slots": True, "frame_pointers": False},
+}
+
+# Build profiles, selected with --build. Debug builds write the RATE global on stake and restake
+# and unlock restaked positions at once
+PROFILES = {
+    "production": {"debug": False},
+    "debug": {"debug": True},
+}
+# Global TEAL that only debug builds may contain
+DEBUG_TEAL = (f"// {DEBUG_MARKER}", 'byte "RATE"')
+
+# State layouts, selected with --layout. The packed layout keeps the settings in one global byte
+# slice and the local position in one record, for a smaller schema and opt-in minimum balance
+LAYOUTS = {
+    "keys": {},
+    "packed": {"layout": "packed"},
+}
+
+GLOBAL_SCHEMA = {"num_uints": 19, "num_byte_slices": 1}
+LOCAL_SCHEMA = {"num_uints": 3, "num_byte_slices": 0}
+EXTRA_PAGES = 2
+
+
+def state_schema(options):
+    """(global, local) state schema of a build"""
+    global_schema = dict(GLOBAL_SCHEMA)
+    local_schema = dict(LOCAL_SCHEMA)
+    if options.get("layout") == "packed":
+        global_schema["num_uints"] -= len(SETTINGS)
+        global_schema["num_byte_slices"] += 1
+        local_schema = {"num_uints": 0, "num_byte_slices": 1}
+    if options.get("debug"):
+        # The RATE global
+        global_schema["num_uints"] += 1
+    return global_schema, local_schema
+
+
+def artifact_name(options):
+    """Name a build's artifacts go under, e.g. Staking-packed-debug"""
+    suffixes = [options["layout"]] if options.get("layout") else []
+    if options.get("debug"):
+        suffixes.append("debug")
+    return "-".join([router.name, *suffixes])
+
+
+def template_prelude():
+    # Template values are pushed inline rather than with `int`, so algod never packs them into
+    # the constant blocks and they sit right after them in the bytecode
+    return "".join(f"pushint {name}\nstore {var.slot.id}\n" for name, var in TEMPLATE_VARS.items())
+
+
+# ABI methods in the order they were declared, which is the default dispatch order
+DECLARED_DISPATCH = [m.method_sig.split("(")[0] for m in router.approval_ast.methods_with_conds]
+
+
+def dispatch_order(profile):
+    """
+    Method names ordered for dispatch by a call-frequency profile ({"method": calls}, e.g. from
+    analytics.indexer.call_profile). The router compares selectors in this order, so the most
+    called methods are matched first; ties and methods missing from the profile keep their
+    declaration order.
+    """
+    return sorted(DECLARED_DISPATCH, key=lambda name: -profile.get(name, 0))
+
+
+def set_dispatch(order):
+    by_name = {m.method_sig.split("(")[0]: m for m in router.approval_ast.methods_with_conds}
+    router.approval_ast.methods_with_conds = [by_name[name] for name in order]
+
+
+def check_production(teal):
+    """Raise if production TEAL contains debug code"""
+    found = [marker for marker in DEBUG_TEAL if marker in teal]
+    if found:
+        raise RuntimeError(f"Production build contains debug code: {', '.join(found)}")
+
+
+def build(options=BUILD_OPTIONS):
+    debug = options.get("debug", False)
+    layout = options.get("layout", "keys")
+    if build_profile["debug"] not in (None, debug) or build_profile["layout"] not in (None, layout):
+        raise RuntimeError("Method bodies are already built for another profile, build it in a new process")
+    build_profile["debug"] = debug
+    build_profile["layout"] = layout
+    set_dispatch(options.get("dispatch", DECLARED_DISPATCH))
+    approval, clear, contract = router.compile_program(
+        version=options["version"], optimize=OptimizeOptions(**options["optimize"])
     )
+    if not debug:
+        check_production(approval)
+    pragma, body = approval.split("\n", 1)
+    return f"{pragma}\n{template_prelude()}{body}", clear, contract
+
 
-    approval_path = f"../build2/{router.name}/approval.teal"
-    clear_path = f"../build2/{router.name}/clear.teal"
-    abi_path = f"../build2/{router.name}/abi.json"
+def abi_json(contract, events=EVENTS, read_only=READ_ONLY):
+    """ABI JSON dict of `contract` carrying its ARC-28 events and marking its read-only methods"""
+    result = contract.dictify()
+    for method in result["methods"]:
+        if method["name"] in read_only:
+            method["readonly"] = True
+    result["events"] = [
+        {"name": name, "args": [{"type": arg_type, "name": arg} for arg_type, arg in args]}
+        for name, args in events.items()
+    ]
+    return result
 
-    if os.path.exists(approval_path):
-        os.remove(approval_path)
 
-    if os.path.exists(clear_path):
-        os.remove(clear_path)
+def build_artifacts(options=BUILD_OPTIONS):
+    """build(), with the ABI as a JSON dict carrying the ARC-28 events and read-only methods"""
+    approval, clear, contract = build(options)
+    return approval, clear, abi_json(contract)
 
-    with open(approval_path, "w") as f:
-        f.write(approval_program)
 
-    with open(clear_path, "w") as f:
-        f.write(clear_state_program)
+def build_options(profile_path=None, build_name="production", layout="keys"):
+    """
+    BUILD_OPTIONS for build profile `build_name` and state `layout`, with the dispatch order of
+    the call-frequency profile at `profile_path` if given
+    """
+    options = {**BUILD_OPTIONS, **PROFILES[build_name], **LAYOUTS[layout]}
+    if profile_path is None:
+        return options
+    with open(profile_path) as f:
+        return {**options, "dispatch": dispatch_order(json.load(f))}
 
-    with open(abi_path, "w") as f:
-        f.write(json.dumps(contract.dictify(), indent=4))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", help="JSON call-frequency profile to order method dispatch by")
+    parser.add_argument("--build", choices=PROFILES, default="production",
+                        help="build profile, debug artifacts go to build/<name>-debug/")
+    parser.add_argument("--layout", choices=LAYOUTS, default="keys",
+                        help="state layout, packed artifacts go to build/<name>-packed/")
+    args = parser.parse_args()
+    options = build_options(args.profile, args.build, args.layout)
+    global_schema, local_schema = state_schema(options)
+    artifacts.build_cached(
+        artifact_name(options), options, lambda: build_artifacts(options),
+        global_schema=global_schema,
+        local_schema=local_schema,
+        extra_pages=EXTRA_PAGES,
+        template=list(TEMPLATE_VARS),
+    )
@@ -0,0 +1,159 @@
+"""
+Deploys a StakingFactory app and adds pools to it from the same JSON manifest as deploy.fleet.
+
+Pools are added one at a time, as each takes the next pool id, with the create call, the payment
+and add_pool call groups simulated for their fees and opcode budget. Progress, the factory app ID
+and every pool's ID, is written to a state file after every step, so a rerun skips pools already
+added.
+
+Stakers reach a pool with the pool id: stake, unstake and restake reference the pool record box,
+their position box (`position_box(address, pool_id)`) and the ledger boxes of the token and the
+reward asset.
+
+Usage: python -m deploy.factory pools.json [state.json]
+"""
+import json
+import os
+import sys
+
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner
+from algosdk.logic import get_application_address
+from algosdk.transaction import OnComplete, PaymentTxn
+
+from deploy.fleet import load_pools
+from deploy.utils import ASSET_MIN_BALANCE, CURVE_BOX, MIN_BALANCE, curve_boxes, curve_mbr
+
+NAME = "StakingFactory"
+# Box key prefixes followed by a uint64 id, as in contracts/factory.py
+POOL_BOX = b"p"
+LEDGER_BOX = b"t"
+POOL_MBR = 2500 + 400 * (len(POOL_BOX) + 8 + 96)
+LEDGER_MBR = 2500 + 400 * (len(LEDGER_BOX) + 8 + 16)
+# Paid with add_pool for the app's two asset opt-ins, the pool record and the ledgers of both assets
+POOL_FUNDING = 2 * ASSET_MIN_BALANCE + POOL_MBR + 2 * LEDGER_MBR
+# Paid on top with the first add_pool, for the app account's own minimum balance
+APP_FUNDING = MIN_BALANCE
+
+
+def pool_box(pool_id):
+    return (0, POOL_BOX + pool_id.to_bytes(8, "big"))
+
+
+def ledger_box(asset_id):
+    return (0, LEDGER_BOX + asset_id.to_bytes(8, "big"))
+
+
+def curve_key(pool_id):
+    return CURVE_BOX + pool_id.to_bytes(8, "big")
+
+
+class Factory:
+    """Creates a StakingFactory from `sender`, signing with `signer`, and adds pools to it."""
+
+    def __init__(self, interface, sender, signer, state_path=None):
+        self.interface = interface
+        self.sender = sender
+        self.signer = signer
+        self.state_path = state_path
+        self.contract = interface.contract(NAME)
+        self.state = {"pools": {}}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def _record(self):
+        if self.state_path:
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(self.state, f, indent=4)
+            os.replace(self.state_path + ".tmp", self.state_path)
+
+    def create(self):
+        approval, clear = self.interface.program(NAME)
+        global_schema, local_schema = self.interface.schema(NAME)
+        gtx = AtomicTransactionComposer()
+        gtx.add_method_call(
+            app_id=0,
+            on_complete=OnComplete.NoOpOC,
+            method=self.contract.get_method_by_name("create"),
+            sender=self.sender,
+            sp=self.interface.get_suggested_params(),
+            signer=self.signer,
+            approval_program=approval,
+            clear_program=clear,
+            global_schema=global_schema,
+            local_schema=local_schema,
+            extra_pages=self.interface.extra_pages(NAME),
+        )
+        result = gtx.execute(self.interface.algod, 4)
+        app_id = self.interface.algod.pending_transaction_info(result.tx_ids[0])["application-index"]
+        self.state["app_id"] = app_id
+        self._record()
+        print(f"{NAME}: created app {app_id}")
+        return app_id
+
+    def add_pool(self, pool):
+        app_id = self.state["app_id"]
+        pool_id = self.interface.global_state(app_id)["n"]
+        sp = self.interface.get_suggested_params()
+        gtx = AtomicTransactionComposer()
+        gtx.add_transaction(
+            TransactionWithSigner(
+                PaymentTxn(
+                    sender=self.sender,
+                    sp=sp,
+                    receiver=get_application_address(app_id),
+                    amt=POOL_FUNDING + curve_mbr(pool.ls, pool.le, curve_key(pool_id)) + (APP_FUNDING if pool_id == 0 else 0),
+                ),
+                self.signer)
+        )
+        gtx.add_method_call(
+            app_id=app_id,
+            on_complete=OnComplete.NoOpOC,
+            method=self.contract.get_method_by_name("add_pool"),
+            sender=self.sender,
+            sp=sp,
+            signer=self.signer,
+            method_args=[pool.token, pool.reward, pool.ss, pool.se, pool.ls, pool.le, pool.oracle, pool.price_max_age],
+            boxes=[pool_box(pool_id), ledger_box(pool.token), ledger_box(pool.reward), *curve_boxes(pool.ls, pool.le, curve_key(pool_id))],
+            # Identical pools would otherwise be identical transactions
+            note=pool.name.encode(),
+        )
+        result = self.interface.with_fees(gtx).execute(self.interface.algod, 4)
+        pool_id = result.abi_results[0].return_value
+        self.state["pools"][pool.name] = pool_id
+        self._record()
+        print(f"{pool.name}: added pool {pool_id}")
+        return pool_id
+
+    def deploy(self, pools):
+        """Create the factory if needed and add every pool not yet added, returning pool name to ID."""
+        if "app_id" not in self.state:
+            self.create()
+        for pool in pools:
+            if pool.name not in self.state["pools"]:
+                self.add_pool(pool)
+        return dict(self.state["pools"])
+
+
+def main(argv):
+    from algosdk import account, mnemonic
+    from algosdk.atomic_transaction_composer import AccountTransactionSigner
+    from dotenv import dotenv_values
+
+    from deploy.utils import Interface
+
+    pools_path = argv[1]
+    state_path = argv[2] if len(argv) > 2 else os.path.splitext(pools_path)[0] + ".factory.json"
+
+    env_vars = dotenv_values("../.env")
+    creator_sk = mnemonic.to_private_key(env_vars["creator"])
+    creator = account.address_from_private_key(creator_sk)
+    print(f"Creator: {creator}")
+
+    interface = Interface("", "https://testnet-api.algonode.cloud")
+    factory = Factory(interface, creator, AccountTransactionSigner(creator_sk), state_path)
+    return factory.deploy(load_pools(pools_path))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
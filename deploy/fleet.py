@@ -0,0 +1,263 @@
+"""
+Deploys a fleet of Staking pools from a JSON manifest:
+
+    {
+        "oracle": 159512493,
+        "price_max_age": 60,
+        "pools": [
+            {"name": "XUSD-PRIV", "token": 212014591, "reward": 212014630,
+             "ss": 50000, "se": 150000, "ls": 15, "le": 60}
+        ]
+    }
+
+`oracle` and `price_max_age` can also be set per pool. Each pool is a create step followed by a
+config step (funding payment + config call in one group, as the contract requires). Steps run as
+a dependency graph on a pool of workers, so independent pools proceed concurrently and their
+confirmations, resolved from the same blocks by one ConfirmationTracker, overlap.
+
+Progress is written to a state file after every step, so a rerun skips pools and steps already
+done.
+
+Usage: python -m deploy.fleet pools.json [state.json]
+"""
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner
+from algosdk.logic import get_application_address
+from algosdk.transaction import OnComplete, PaymentTxn
+
+from deploy.tracker import ConfirmationTracker
+from deploy.utils import ASSET_MIN_BALANCE, MIN_BALANCE, curve_boxes, curve_mbr
+
+
+class Pool(NamedTuple):
+    name: str
+    token: int
+    reward: int
+    ss: int
+    se: int
+    ls: int
+    le: int
+    oracle: int
+    price_max_age: int
+
+
+def config_payment(pool):
+    """Paid with config: the app account and its opt-in to each distinct asset, plus the curve box"""
+    return MIN_BALANCE + ASSET_MIN_BALANCE * len({pool.token, pool.reward}) + curve_mbr(pool.ls, pool.le)
+
+
+def load_pools(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    defaults = {key: manifest[key] for key in ("oracle", "price_max_age") if key in manifest}
+    return [Pool(**{**defaults, **pool}) for pool in manifest["pools"]]
+
+
+def run_graph(steps, execute, workers=8):
+    """
+    Run `steps`, a dict of step key to the keys it depends on, calling `execute(key)` on a pool of
+    `workers` threads as soon as every dependency of a step has succeeded. Steps depending on a
+    failed step are not run. Returns a dict of key to result or raised exception.
+    """
+    results = {}
+    remaining = {key: set(depends) for key, depends in steps.items()}
+    dependents = {key: [] for key in steps}
+    for key, depends in steps.items():
+        for depend in depends:
+            dependents[depend].append(key)
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def skip(key, failed):
+        # Called with the lock held
+        for dependent in dependents[key]:
+            if dependent in remaining:
+                del remaining[dependent]
+                results[dependent] = RuntimeError(f"{failed} failed")
+                skip(dependent, failed)
+
+    def finish(key, future):
+        error = future.exception()
+        ready = []
+        with lock:
+            results[key] = error if error is not None else future.result()
+            if error is not None:
+                skip(key, key)
+            else:
+                for dependent in dependents[key]:
+                    remaining[dependent].discard(key)
+                    if not remaining[dependent]:
+                        del remaining[dependent]
+                        ready.append(dependent)
+            if len(results) == len(steps):
+                done.set()
+        for dependent in ready:
+            submit(dependent)
+
+    def submit(key):
+        pool.submit(execute, key).add_done_callback(lambda f: finish(key, f))
+
+    if not steps:
+        return results
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with lock:
+            ready = [key for key, depends in remaining.items() if not depends]
+            for key in ready:
+                del remaining[key]
+        for key in ready:
+            submit(key)
+        done.wait()
+    return results
+
+
+class Fleet:
+    """
+    Creates and configures Staking pools from `sender`, signing with `signer`. The approval
+    program is compiled once and patched with each pool's token ids, and suggested params are
+    fetched once per deploy. `name` selects the build, e.g. "Staking-packed" for the packed state
+    layout.
+    """
+
+    def __init__(self, interface, sender, signer, state_path=None, workers=8, name="Staking"):
+        self.interface = interface
+        self.name = name
+        self.sender = sender
+        self.signer = signer
+        self.state_path = state_path
+        self.workers = workers
+        self.contract = interface.contract(name)
+        self.state = {}
+        self.state_lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def _record(self, pool, **values):
+        with self.state_lock:
+            self.state.setdefault(pool.name, {}).update(values)
+            if self.state_path:
+                with open(self.state_path + ".tmp", "w") as f:
+                    json.dump(self.state, f, indent=4)
+                os.replace(self.state_path + ".tmp", self.state_path)
+
+    def create(self, pool, tracker):
+        # Patched locally from the one compiled program
+        approval, clear = self.interface.program(
+            self.name, TMPL_TOKEN_ID=pool.token, TMPL_REWARD_ID=pool.reward
+        )
+        global_schema, local_schema = self.schema
+        gtx = AtomicTransactionComposer()
+        gtx.add_method_call(
+            app_id=0,
+            on_complete=OnComplete.NoOpOC,
+            method=self.contract.get_method_by_name("create"),
+            sender=self.sender,
+            sp=self.sp,
+            signer=self.signer,
+            method_args=[pool.token, pool.ss, pool.se, pool.ls, pool.le, pool.reward, pool.oracle],
+            approval_program=approval,
+            clear_program=clear,
+            global_schema=global_schema,
+            local_schema=local_schema,
+            extra_pages=self.extra_pages,
+            # Identical pools would otherwise be identical transactions
+            note=pool.name.encode(),
+        )
+        signed = gtx.gather_signatures()
+        self.interface.algod.send_transactions(signed)
+        info = tracker.track(signed[-1].get_txid()).result()
+        app_id = info["application-index"]
+        self._record(pool, app_id=app_id)
+        print(f"{pool.name}: created app {app_id}")
+        return app_id
+
+    def config(self, pool, tracker):
+        app_id = self.state[pool.name]["app_id"]
+        gtx = AtomicTransactionComposer()
+        gtx.add_transaction(
+            TransactionWithSigner(
+                PaymentTxn(
+                    sender=self.sender,
+                    sp=self.sp,
+                    receiver=get_application_address(app_id),
+                    amt=config_payment(pool),
+                ),
+                self.signer)
+        )
+        gtx.add_method_call(
+            app_id=app_id,
+            on_complete=OnComplete.NoOpOC,
+            method=self.contract.get_method_by_name("config"),
+            sender=self.sender,
+            sp=self.sp,
+            signer=self.signer,
+            method_args=[pool.token, pool.reward, pool.oracle, pool.price_max_age],
+            boxes=curve_boxes(pool.ls, pool.le),
+        )
+        signed = self.interface.with_fees(gtx).gather_signatures()
+        self.interface.algod.send_transactions(signed)
+        tracker.track(signed[-1].get_txid()).result()
+        self._record(pool, configured=True)
+        print(f"{pool.name}: configured")
+        return app_id
+
+    def deploy(self, pools):
+        """Deploy every pool not yet done, returning a dict of pool name to app ID or exception."""
+        self.schema = self.interface.schema(self.name)
+        self.extra_pages = self.interface.extra_pages(self.name)
+        self.sp = self.interface.get_suggested_params()
+        by_name = {pool.name: pool for pool in pools}
+
+        steps = {}
+        for pool in pools:
+            done = self.state.get(pool.name, {})
+            if done.get("configured"):
+                continue
+            create = ("create", pool.name)
+            if "app_id" not in done:
+                steps[create] = []
+            steps[("config", pool.name)] = [create] if create in steps else []
+
+        with ConfirmationTracker(self.interface.algod) as tracker:
+            results = run_graph(
+                steps,
+                lambda key: getattr(self, key[0])(by_name[key[1]], tracker),
+                workers=self.workers,
+            )
+
+        deployed = {name: self.state.get(name, {}).get("app_id") for name in by_name}
+        for (step, name), result in results.items():
+            if isinstance(result, Exception):
+                print(f"{name}: {step} failed: {result}")
+                deployed[name] = result
+        return deployed
+
+
+def main(argv):
+    from algosdk import account, mnemonic
+    from algosdk.atomic_transaction_composer import AccountTransactionSigner
+    from dotenv import dotenv_values
+
+    from deploy.utils import Interface
+
+    pools_path = argv[1]
+    state_path = argv[2] if len(argv) > 2 else os.path.splitext(pools_path)[0] + ".deployed.json"
+
+    env_vars = dotenv_values("../.env")
+    creator_sk = mnemonic.to_private_key(env_vars["creator"])
+    creator = account.address_from_private_key(creator_sk)
+    print(f"Creator: {creator}")
+
+    interface = Interface("", "https://testnet-api.algonode.cloud")
+    fleet = Fleet(interface, creator, AccountTransactionSigner(creator_sk), state_path)
+    return fleet.deploy(load_pools(pools_path))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,249 @@
+"""
+Migrates every local state position of a Staking app into a position box.
+
+The staker set is taken once from an indexer snapshot and split into chunks of one group each: a
+payment covering the chunk's box MBR followed by migrate_positions calls of MAX_ACCOUNTS owners
+each, so a group moves up to OWNERS_PER_GROUP positions. Groups are sent from a pool of workers
+and their confirmations tracked from the same blocks, so many are in flight at once.
+
+The plan and the chunks done are checkpointed to a state file after every group, so a rerun
+resumes where the last one stopped; the contract skips owners with nothing staked, so a chunk sent
+twice is harmless. It also skips owners that already have a migrated position box; they keep
+their local position and `verify` reports them as mismatched.
+
+Once every chunk is done, `verify` reads back each staker's box and local state and checks the
+migrated totals against the snapshot and the global locked and liability against their values
+before the migration. Freeze the app for the migration to keep those exact.
+
+Migrated positions have position id MIGRATED_POSITION and are unstaked with unstake_position.
+The admin pays POSITION_MBR per migrated position here. Owners never paid it, so it is not refunded
+to them on unstake; it returns to the app's free Algo balance, which the admin can withdraw.
+
+Usage: python -m deploy.migrate APP_ID [state.json]
+"""
+import base64
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from algosdk import encoding, error
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner
+from algosdk.logic import get_application_address
+from algosdk.transaction import OnComplete, PaymentTxn
+
+from deploy.pipeline import MAX_ACCOUNTS
+from deploy.tracker import ConfirmationTracker
+from deploy.utils import MAX_GROUP_SIZE, MIGRATED_POSITION, POSITION_MBR, position_box
+
+# One group: the MBR payment and migrate_positions calls filling the rest
+CALLS_PER_GROUP = MAX_GROUP_SIZE - 1
+OWNERS_PER_GROUP = CALLS_PER_GROUP * MAX_ACCOUNTS
+
+
+def local_position(info):
+    """(staked, total reward, stake unlock) of an account_application_info response, either layout"""
+    state = {}
+    for kv in info.get("app-local-state", {}).get("key-value", []):
+        value = kv["value"]
+        state[base64.b64decode(kv["key"]).decode()] = (
+            base64.b64decode(value["bytes"]) if value["type"] == 1 else value.get("uint", 0)
+        )
+    if "p" in state:
+        record = state["p"] or bytes(24)
+        return tuple(int.from_bytes(record[8 * i:8 * i + 8], "big") for i in range(3))
+    return state.get("s", 0), state.get("tr", 0), state.get("su", 0)
+
+
+class Migration:
+    """
+    Migrates the local positions of `app_id` into boxes from the app's admin `sender`, signing
+    with `signer`. Progress is kept in `state_path`.
+    """
+
+    def __init__(self, interface, app_id, sender, signer, state_path=None, workers=8):
+        self.interface = interface
+        self.app_id = app_id
+        self.sender = sender
+        self.signer = signer
+        self.state_path = state_path
+        self.workers = workers
+        self.method = interface.contract("Staking").get_method_by_name("migrate_positions")
+        self.state = {}
+        self.state_lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def _write(self):
+        # Expects state_lock held
+        if self.state_path:
+            with open(self.state_path + ".tmp", "w") as f:
+                json.dump(self.state, f, indent=4)
+            os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _record(self, **values):
+        with self.state_lock:
+            self.state.update(values)
+            self._write()
+
+    def _done(self, chunk):
+        # Workers finish chunks concurrently, so the append and the write share one lock hold
+        with self.state_lock:
+            self.state["done"].append(chunk)
+            self._write()
+
+    def plan(self, store):
+        """
+        Chunk the stakers of PositionStore `store` (an analytics.indexer.snapshot) and record them
+        with the snapshot totals and global counters the migration is verified against, and the
+        box MBR the admin pays for them, in microAlgos.
+        """
+        view = store.view()
+        stakers = {
+            encoding.encode_address(bytes(address)): [int(s), int(tr), int(su)]
+            for address, s, tr, su in zip(view["addresses"], view["staked"], view["total_reward"], view["stake_unlock"])
+            if s > 0
+        }
+        addresses = sorted(stakers)
+        self._record(
+            round=store.round,
+            stakers=stakers,
+            chunks=[addresses[i:i + OWNERS_PER_GROUP] for i in range(0, len(addresses), OWNERS_PER_GROUP)],
+            done=[],
+            locked=store.locked,
+            total_liability=store.total_liability,
+            mbr=POSITION_MBR * len(addresses),
+        )
+
+    def compose(self, owners):
+        sp = self.interface.get_suggested_params()
+        gtx = AtomicTransactionComposer()
+        gtx.add_transaction(
+            TransactionWithSigner(
+                PaymentTxn(
+                    sender=self.sender,
+                    sp=sp,
+                    receiver=get_application_address(self.app_id),
+                    amt=POSITION_MBR * len(owners),
+                ),
+                self.signer)
+        )
+        for i in range(0, len(owners), MAX_ACCOUNTS):
+            batch = owners[i:i + MAX_ACCOUNTS]
+            gtx.add_method_call(
+                app_id=self.app_id,
+                on_complete=OnComplete.NoOpOC,
+                method=self.method,
+                sender=self.sender,
+                sp=sp,
+                signer=self.signer,
+                method_args=[[encoding.decode_address(owner) for owner in batch]],
+                accounts=batch,
+                boxes=[position_box(owner, MIGRATED_POSITION) for owner in batch],
+            )
+        return gtx
+
+    def migrate_chunk(self, index, tracker):
+        signed = self.compose(self.state["chunks"][index]).gather_signatures()
+        self.interface.algod.send_transactions(signed)
+        tracker.track(signed[-1].get_txid()).result()
+        self._done(index)
+        print(f"chunk {index + 1}/{len(self.state['chunks'])}: migrated")
+        return index
+
+    def run(self):
+        """Send every chunk not yet done. Returns a dict of chunk index to exception for those that failed."""
+        pending = [i for i in range(len(self.state["chunks"])) if i not in set(self.state["done"])]
+        failed = {}
+        with ConfirmationTracker(self.interface.algod) as tracker:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {i: pool.submit(self.migrate_chunk, i, tracker) for i in pending}
+                for i, future in futures.items():
+                    if future.exception() is not None:
+                        print(f"chunk {i + 1}: failed: {future.exception()}")
+                        failed[i] = future.exception()
+        return failed
+
+    def _read(self, address):
+        info = self.interface.algod.account_application_info(address, self.app_id)
+        try:
+            name = position_box(address, MIGRATED_POSITION)[1]
+            value = base64.b64decode(self.interface.algod.application_box_by_name(self.app_id, name)["value"])
+            box = [int.from_bytes(value[8 * i:8 * i + 8], "big") for i in range(3)]
+        except error.AlgodHTTPError as e:
+            if e.code != 404:
+                raise
+            box = None
+        return address, local_position(info), box
+
+    def verify(self):
+        """
+        Read back every staker of the plan. Returns a dict of the stakers whose box does not hold
+        their snapshot position or whose local position is not cleared, the migrated and snapshot
+        totals, and the global counters before and now.
+        """
+        stakers = self.state["stakers"]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._read, stakers))
+
+        mismatched = {}
+        migrated = [0, 0]
+        for address, local, box in results:
+            if box is not None:
+                migrated[0] += box[0]
+                migrated[1] += box[1]
+            if box != stakers[address] or any(local):
+                mismatched[address] = {"snapshot": stakers[address], "box": box, "local": list(local)}
+        now = self.interface.global_state(self.app_id)
+        return {
+            "mismatched": mismatched,
+            "staked": {"snapshot": sum(s for s, _, _ in stakers.values()), "migrated": migrated[0]},
+            "total_reward": {"snapshot": sum(tr for _, tr, _ in stakers.values()), "migrated": migrated[1]},
+            "locked": {"before": self.state["locked"], "now": now.get("l")},
+            "total_liability": {"before": self.state["total_liability"], "now": now.get("tl")},
+        }
+
+
+def main(argv):
+    from algosdk import account, mnemonic
+    from algosdk.atomic_transaction_composer import AccountTransactionSigner
+    from algosdk.v2client.indexer import IndexerClient
+    from dotenv import dotenv_values
+
+    from analytics.indexer import snapshot
+    from deploy.utils import Interface
+
+    app_id = int(argv[1])
+    state_path = argv[2] if len(argv) > 2 else f"migration-{app_id}.json"
+
+    env_vars = dotenv_values("../.env")
+    admin_sk = mnemonic.to_private_key(env_vars["creator"])
+    admin = account.address_from_private_key(admin_sk)
+    print(f"Admin: {admin}")
+
+    interface = Interface("", "https://testnet-api.algonode.cloud")
+    migration = Migration(interface, app_id, admin, AccountTransactionSigner(admin_sk), state_path)
+    if "chunks" not in migration.state:
+        indexer = IndexerClient("", "https://testnet-idx.algonode.cloud")
+        migration.plan(snapshot(indexer, interface.algod, app_id))
+    print(f"{len(migration.state['stakers'])} stakers in {len(migration.state['chunks'])} chunks, "
+          f"{migration.state['mbr']} microAlgos of box MBR paid by the admin and not refunded")
+
+    if migration.run():
+        return 1
+    report = migration.verify()
+    print(json.dumps(report, indent=4))
+    consistent = (
+        not report["mismatched"]
+        and report["staked"]["snapshot"] == report["staked"]["migrated"]
+        and report["total_reward"]["snapshot"] == report["total_reward"]["migrated"]
+        and report["locked"]["before"] == report["locked"]["now"]
+        and report["total_liability"]["before"] == report["total_liability"]["now"]
+    )
+    return 0 if consistent else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,256 @@
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner
+from algosdk.logic import get_application_address
+from algosdk.transaction import AssetTransferTxn, OnComplete, PaymentTxn
+
+from deploy.tracker import ConfirmationTracker
+from deploy.utils import POSITION_MBR, curve_boxes, position_box
+
+# Fee multiplier of the app call for each action, covering its inner transactions
+FEES = {
+    "stake": 1,
+    "unstake": 3,
+    "restake": 1,
+    "stake_position": 1,
+    "unstake_position": 4,
+    "restake_position": 1,
+}
+
+# Foreign references (accounts, assets, apps and boxes) allowed on one app call, of which at most
+# MAX_ACCOUNTS accounts
+MAX_REFERENCES = 8
+MAX_ACCOUNTS = 4
+# Opcode budget unstake_positions requests per position, and the positions it settles at most, as
+# in the contract
+UNSTAKE_ENTRY_COST = 120
+MAX_UNSTAKE_POSITIONS = 13
+OPCODE_BUDGET = 700
+
+
+def unstake_batches(sender, positions):
+    """
+    Split (owner, position id) pairs into unstake_positions calls that fit the reference limits
+    and MAX_UNSTAKE_POSITIONS.
+    Pairs are sorted by owner so each owner is paid once per call.
+    """
+    batch, owners = [], set()
+    for owner, pid in sorted(positions):
+        new_owner = owner != sender and owner not in owners
+        # The stake and reward assets take two references
+        refs = 2 + len(batch) + 1 + len(owners) + new_owner
+        if batch and (
+            refs > MAX_REFERENCES or len(owners) + new_owner > MAX_ACCOUNTS or len(batch) == MAX_UNSTAKE_POSITIONS
+        ):
+            yield batch
+            batch, owners = [], set()
+        batch.append((owner, pid))
+        if owner != sender:
+            owners.add(owner)
+    if batch:
+        yield batch
+
+
+class StakeRecord(NamedTuple):
+    account: str
+    action: str
+    amount: int = 0
+    length: int = 0
+    # Position id for box-backed positions, None for the single local state stake
+    position: Optional[int] = None
+
+
+class Result(NamedTuple):
+    record: StakeRecord
+    txid: Optional[str]
+    info: Optional[dict]
+    error: Optional[Exception]
+
+
+class StakingPipeline:
+    """
+    Builds, signs and submits stake/unstake/restake groups for a stream of StakeRecords.
+
+    Groups are built and signed on a pool of `workers` threads and submitted as soon as they are
+    signed. At most `in_flight` groups are outstanding at any time; a slot frees up when the
+    group confirms (or fails). Confirmations are resolved from blocks by a ConfirmationTracker.
+
+    `signers` maps each record account to its TransactionSigner. The lock length range, needed
+    for the curve box references, and the price oracle are read from the app's global state once.
+    Records with a `position` go to the box-backed *_position methods; staking one also pays the
+    position box MBR.
+    """
+
+    def __init__(self, interface, app_id, contract, signers, token, reward,
+                 workers=8, in_flight=16, params_ttl=30):
+        self.interface = interface
+        self.app_id = app_id
+        self.app_addr = get_application_address(app_id)
+        self.contract = contract
+        self.signers = signers
+        self.token = token
+        self.reward = reward
+        self.workers = workers
+        self.in_flight = in_flight
+        self.params_ttl = params_ttl
+        self._params = None
+        self._params_time = 0
+        self._params_lock = threading.Lock()
+        state = interface.global_state(app_id)
+        self.boxes = curve_boxes(state["ls"], state["le"])
+        self.oracle = state["o"]
+
+    def suggested_params(self, fee=1):
+        # One suggested params call serves every group built within `params_ttl` seconds
+        with self._params_lock:
+            if self._params is None or time.monotonic() - self._params_time > self.params_ttl:
+                self._params = self.interface.get_suggested_params()
+                self._params_time = time.monotonic()
+            sp = copy.copy(self._params)
+        sp.fee = sp.min_fee * fee
+        return sp
+
+    def compose(self, record):
+        signer = self.signers[record.account]
+        name = record.action if record.position is None else f"{record.action}_position"
+        method = self.contract.get_method_by_name(name)
+        sp = self.suggested_params(FEES[name])
+
+        gtx = AtomicTransactionComposer()
+        if record.action == "stake" and record.position is not None:
+            gtx.add_transaction(
+                TransactionWithSigner(
+                    PaymentTxn(
+                        sender=record.account,
+                        sp=self.suggested_params(),
+                        receiver=self.app_addr,
+                        amt=POSITION_MBR,
+                    ),
+                    signer)
+            )
+        if record.action == "stake":
+            gtx.add_transaction(
+                TransactionWithSigner(
+                    AssetTransferTxn(
+                        sender=record.account,
+                        sp=self.suggested_params(),
+                        receiver=self.app_addr,
+                        amt=record.amount,
+                        index=self.token,
+                    ),
+                    signer)
+            )
+            method_args = [self.token, record.length]
+            foreign_assets, foreign_apps = [self.reward], [self.oracle]
+        elif record.action == "restake":
+            method_args = [self.token, record.length]
+            foreign_assets, foreign_apps = None, None
+        elif record.action == "unstake":
+            method_args = [self.token, self.reward]
+            foreign_assets, foreign_apps = None, None
+        else:
+            raise ValueError(f"Unknown action {record.action}")
+        boxes = self.boxes if record.action != "unstake" else []
+        if record.position is not None:
+            method_args.append(record.position)
+            boxes = boxes + [position_box(record.account, record.position)]
+
+        gtx.add_method_call(
+            app_id=self.app_id,
+            on_complete=OnComplete.NoOpOC,
+            method=method,
+            sender=record.account,
+            sp=sp,
+            signer=signer,
+            method_args=method_args,
+            foreign_assets=foreign_assets,
+            foreign_apps=foreign_apps,
+            boxes=boxes or None,
+        )
+        return gtx
+
+    def compose_unstake_batch(self, sender, batch):
+        """Compose one unstake_positions call settling `batch` of (owner, position id) pairs."""
+        owners = list(dict.fromkeys(owner for owner, _ in batch))
+        opups = -(-len(batch) * UNSTAKE_ENTRY_COST // OPCODE_BUDGET)
+        gtx = AtomicTransactionComposer()
+        gtx.add_method_call(
+            app_id=self.app_id,
+            on_complete=OnComplete.NoOpOC,
+            method=self.contract.get_method_by_name("unstake_positions"),
+            sender=sender,
+            sp=self.suggested_params(1 + 3 * len(owners) + opups),
+            signer=self.signers[sender],
+            method_args=[self.token, self.reward, [list(p) for p in batch]],
+            accounts=[owner for owner in owners if owner != sender] or None,
+            boxes=[position_box(owner, pid) for owner, pid in batch],
+        )
+        return gtx
+
+    def unstake_matured(self, sender, positions):
+        """
+        Settle matured (owner, position id) pairs with as few unstake_positions calls as the
+        reference limits allow, signed by `sender`, which must be the app's admin unless it owns
+        every position. Returns the confirmation info of each call.
+        """
+        with ConfirmationTracker(self.interface.algod) as tracker:
+            futures = []
+            for batch in unstake_batches(sender, positions):
+                signed = self.compose_unstake_batch(sender, batch).gather_signatures()
+                self.interface.algod.send_transactions(signed)
+                futures.append(tracker.track(signed[-1].get_txid()))
+            return [future.result() for future in futures]
+
+    def _submit(self, record):
+        gtx = self.compose(record)
+        signed = gtx.gather_signatures()
+        self.interface.algod.send_transactions(signed)
+        return signed[-1].get_txid()
+
+    def run(self, records, callback=None):
+        """
+        Process every record and return a Result per record in completion order.
+        `callback`, if given, is called with each Result as soon as it is known.
+        """
+        results = []
+        results_lock = threading.Lock()
+        slots = threading.BoundedSemaphore(self.in_flight)
+
+        def finish(result):
+            with results_lock:
+                results.append(result)
+            slots.release()
+            if callback is not None:
+                callback(result)
+
+        def submitted(record, future):
+            try:
+                txid = future.result()
+            except Exception as e:
+                finish(Result(record, None, None, e))
+                return
+            tracker.track(txid, callback=lambda f: confirmed(record, txid, f))
+
+        def confirmed(record, txid, future):
+            if future.cancelled():
+                finish(Result(record, txid, None, RuntimeError("Tracking stopped")))
+            elif future.exception() is not None:
+                finish(Result(record, txid, None, future.exception()))
+            else:
+                finish(Result(record, txid, future.result(), None))
+
+        with ConfirmationTracker(self.interface.algod) as tracker, \
+                ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for record in records:
+                slots.acquire()
+                pool.submit(self._submit, record).add_done_callback(
+                    lambda f, record=record: submitted(record, f)
+                )
+            # Wait for every outstanding group to settle
+            for _ in range(self.in_flight):
+                slots.acquire()
+        return results
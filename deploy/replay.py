@@ -0,0 +1,311 @@
+"""
+Replays recorded calls against the deployed program and a new build, before update_application.
+
+Every top level group in blocks `first` to `last` that calls a selected method of `app_id` is
+simulated twice at the round before its block, on the state the chain had then:
+
+* old: after the admin's update_application call carrying the deployed programs, so the rest of the
+  group runs the program the app has now;
+* new: after the admin's update_application call carrying the new build, so the rest of the group
+  runs the new program.
+
+Both leading calls run the same update handler, so the opcode budget they pool into the group, and
+with it the OpUp calls the program makes, match. A group whose leading call fails, in either run,
+raises SimulationError rather than being reported. Signatures are not checked, so no keys are
+needed. Groups are spread over worker processes, each with its own pooled algod client.
+
+For each app call of the group the report gives the opcode cost under both programs, and any
+divergence between them in logs (events), asset and payment transfers, global, local and box state
+writes, or failure. A call is `faithful` when its old replay logs what the block recorded; groups
+earlier in the same block are not replayed first, so calls depending on them can differ.
+
+Simulating at a past round needs a node that still holds that state: an archival node, or a
+recent round, or a local node loaded with the recorded blocks as a stand-in.
+
+Usage:
+    python -m deploy.replay APP_ID FIRST LAST [--blocks recorded.msgpack] [--name Staking]
+        [--methods stake unstake restake] [--workers 8] [--algod URL] [--json report.json]
+"""
+import argparse
+import base64
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+from algosdk import encoding
+from algosdk.transaction import (
+    ApplicationUpdateTxn, SignedTransaction, SuggestedParams, Transaction, assign_group_id,
+)
+from algosdk.v2client.models import SimulateRequest, SimulateRequestTransactionGroup, SimulateTraceConfig
+
+from deploy.tracker import block_txids
+from deploy.transport import PooledAlgodClient
+from deploy.utils import MAX_GROUP_SIZE, SimulationError
+
+DEFAULT_METHODS = ("stake", "unstake", "restake")
+# Inner transactions compared between runs; OpUp's app calls vary with the budget a build needs
+TRANSFER_TYPES = ("pay", "axfer")
+
+
+class Group(NamedTuple):
+    round: int
+    txids: list
+    # Signed transactions as found in the block, genesis restored, signatures dropped
+    txns: list
+    # Recorded logs of each transaction, for the faithfulness check
+    logs: list
+
+
+class CallDiff(NamedTuple):
+    round: int
+    txid: str
+    method: str
+    old_cost: Optional[int]
+    new_cost: Optional[int]
+    divergences: list
+    # None when the old replay failed
+    faithful: Optional[bool]
+
+
+def block_groups(round, block, app_id, selectors):
+    """Yield the Group of every top level group of `block` calling one of `selectors` on `app_id`."""
+    current = []
+
+    def flush():
+        calls = [
+            stib for _, stib in current
+            if stib["txn"].get("type") == "appl" and stib["txn"].get("apid") == app_id
+            and stib["txn"].get("apaa") and stib["txn"]["apaa"][0] in selectors
+        ]
+        if calls:
+            txns = []
+            for _, stib in current:
+                txn = dict(stib["txn"])
+                txn["gh"] = block["gh"]
+                if stib.get("hgi"):
+                    txn["gen"] = block["gen"]
+                signer = encoding.encode_address(stib["sgnr"]) if "sgnr" in stib else None
+                txns.append(SignedTransaction(Transaction.undictify(txn), None, authorizing_address=signer))
+            return Group(round, [txid for txid, _ in current], txns,
+                         [stib.get("dt", {}).get("lg", []) for _, stib in current])
+
+    for txid, stib in block_txids(block):
+        group_id = stib["txn"].get("grp")
+        if current and (group_id is None or current[-1][1]["txn"].get("grp") != group_id):
+            group = flush()
+            if group:
+                yield group
+            current = []
+        current.append((txid, stib))
+    if current:
+        group = flush()
+        if group:
+            yield group
+
+
+def state_changes(trace, changes):
+    """Collect the last write to every (state type, account, key) of an exec trace into `changes`."""
+    for step in trace.get("approval-program-trace", []) + trace.get("clear-state-program-trace", []):
+        for change in step.get("state-changes", []):
+            key = (change["app-state-type"], change.get("account", ""), change["key"])
+            changes[key] = change.get("new-value") if change["operation"] == "w" else None
+    for inner in trace.get("inner-trace", []):
+        state_changes(inner, changes)
+    return changes
+
+
+def outcome(result, trace):
+    """Comparable outcome of one transaction of a simulate response"""
+    txn_result = result["txn-result"]
+    return {
+        "cost": result.get("app-budget-consumed"),
+        "logs": txn_result.get("logs", []),
+        "transfers": [
+            inner["txn"]["txn"] for inner in txn_result.get("inner-txns", [])
+            if inner["txn"]["txn"].get("type") in TRANSFER_TYPES
+        ],
+        "state": state_changes(trace or {}, {}),
+    }
+
+
+def diff(old, new):
+    """Names of the outcome fields that differ, with the differing state keys"""
+    divergences = [field for field in ("logs", "transfers") if old[field] != new[field]]
+    for key in sorted(set(old["state"]) | set(new["state"])):
+        if old["state"].get(key) != new["state"].get(key):
+            kind, account, name = key
+            divergences.append(" ".join(filter(None, ("state", kind, account, repr(base64.b64decode(name))))))
+    return divergences
+
+
+# Per worker process: algod client and the update to replay, set by _init_worker
+_worker = {}
+
+
+def _init_worker(algod_token, algod_address, app_id, admin, deployed, build):
+    _worker.update(
+        algod=PooledAlgodClient(algod_token, algod_address),
+        app_id=app_id, admin=admin, deployed=deployed, build=build,
+    )
+
+
+def _simulate(first_txn, group):
+    txns = [first_txn] + [stxn.transaction for stxn in group.txns]
+    for txn in txns:
+        txn.group = None
+    assign_group_id(txns)
+    signed = [SignedTransaction(first_txn, None)] + [
+        SignedTransaction(txn, None, authorizing_address=stxn.authorizing_address)
+        for txn, stxn in zip(txns[1:], group.txns)
+    ]
+    request = SimulateRequest(
+        txn_groups=[SimulateRequestTransactionGroup(txns=signed)],
+        round=group.round - 1,
+        allow_empty_signatures=True,
+        exec_trace_config=SimulateTraceConfig(enable=True, state_change=True),
+    )
+    response = _worker["algod"].simulate_transactions(request)["txn-groups"][0]
+    # The leading call is not part of the recorded group
+    results = response["txn-results"][1:]
+    failed_at = response.get("failed-at")
+    failed = failed_at[0] - 1 if response.get("failure-message") and failed_at else None
+    if failed is not None and failed < 0:
+        # Nothing of the recorded group ran, which must not read as no divergence
+        raise SimulationError(f"round {group.round}: update_application failed: {response['failure-message']}",
+                              failed_at)
+    # Transactions from the failed one on have no outcome
+    return [
+        None if (failed is not None and i >= failed) or i >= len(results)
+        else outcome(results[i], results[i].get("exec-trace"))
+        for i in range(len(group.txns))
+    ], response.get("failure-message")
+
+
+def _replay(job):
+    group, methods = job
+    first = group.txns[0].transaction
+    sp = SuggestedParams(1000, first.first_valid_round, first.last_valid_round, first.genesis_hash,
+                         first.genesis_id, flat_fee=True)
+    old, old_failure = _simulate(ApplicationUpdateTxn(_worker["admin"], sp, _worker["app_id"], *_worker["deployed"]), group)
+    new, new_failure = _simulate(ApplicationUpdateTxn(_worker["admin"], sp, _worker["app_id"], *_worker["build"]), group)
+
+    diffs = []
+    for i, stxn in enumerate(group.txns):
+        txn = stxn.transaction
+        if txn.type != "appl" or txn.index != _worker["app_id"] or not txn.app_args:
+            continue
+        method = methods.get(bytes(txn.app_args[0]))
+        if method is None:
+            continue
+        if old[i] is None or new[i] is None:
+            divergences = [] if (old[i] is None) == (new[i] is None) else [
+                f"new fails: {new_failure}" if new[i] is None else f"old fails: {old_failure}"
+            ]
+        else:
+            divergences = diff(old[i], new[i])
+        recorded = [base64.b64encode(log).decode() for log in group.logs[i]]
+        diffs.append(CallDiff(
+            group.round, group.txids[i], method,
+            old[i] and old[i]["cost"], new[i] and new[i]["cost"], divergences,
+            None if old[i] is None else old[i]["logs"] == recorded,
+        ))
+    return diffs
+
+
+def replay(interface, app_id, source, first, last, name="Staking", methods=DEFAULT_METHODS, workers=8):
+    """
+    Replay the calls to `methods` of `app_id` in blocks `first` to `last` of block `source` against
+    the deployed program and build `name`. Returns a list of CallDiff in chain order.
+    """
+    contract = interface.contract(name)
+    selectors = {method.get_selector(): method.name for method in contract.methods if method.name in methods}
+    state = interface.global_state(app_id)
+    admin = encoding.encode_address(state["a"])
+    params = interface.algod.application_info(app_id)["params"]
+    deployed = (base64.b64decode(params["approval-program"]), base64.b64decode(params["clear-state-program"]))
+    # Template values are those the app was created with
+    template = {"TMPL_TOKEN_ID": state.get("tid", 0), "TMPL_REWARD_ID": state.get("rid", 0)}
+    approval, clear = interface.program(name, **template)
+
+    groups = []
+    skipped = 0
+    for round in range(first, last + 1):
+        for group in block_groups(round, source.block(round), app_id, selectors):
+            if len(group.txns) == MAX_GROUP_SIZE:
+                # No room for the leading call
+                skipped += 1
+                continue
+            groups.append(group)
+    if skipped:
+        print(f"Skipped {skipped} full groups")
+
+    algod = interface.algod
+    address = [endpoint.address for endpoint in algod.endpoints]
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(algod.algod_token, address, app_id, admin, deployed, (approval, clear)),
+    ) as pool:
+        return [d for diffs in pool.map(_replay, [(group, selectors) for group in groups]) for d in diffs]
+
+
+def summary(diffs):
+    """Per method call count, mean old and new cost and the largest cost increase"""
+    methods = {}
+    for d in diffs:
+        entry = methods.setdefault(d.method, {"calls": 0, "old": 0, "new": 0, "max_delta": None, "divergent": 0})
+        entry["calls"] += 1
+        entry["divergent"] += bool(d.divergences)
+        if d.old_cost is not None and d.new_cost is not None:
+            entry["old"] += d.old_cost
+            entry["new"] += d.new_cost
+            delta = d.new_cost - d.old_cost
+            entry["max_delta"] = delta if entry["max_delta"] is None else max(entry["max_delta"], delta)
+    for entry in methods.values():
+        entry["old"] /= entry["calls"]
+        entry["new"] /= entry["calls"]
+    return methods
+
+
+def report(diffs):
+    print(f"{'Method':<20} {'calls':>6} {'old':>8} {'new':>8} {'max +':>6} {'divergent':>10}")
+    for method, entry in summary(diffs).items():
+        max_delta = "" if entry["max_delta"] is None else entry["max_delta"]
+        print(f"{method:<20} {entry['calls']:>6} {entry['old']:>8.1f} {entry['new']:>8.1f} {max_delta:>6} "
+              f"{entry['divergent']:>10}")
+    for d in diffs:
+        if d.divergences:
+            print(f"{d.round} {d.txid} {d.method}: {'; '.join(d.divergences)}")
+    unfaithful = sum(d.faithful is False for d in diffs)
+    if unfaithful:
+        print(f"{unfaithful} call(s) replayed differently from the block, see `faithful`")
+
+
+def main(argv):
+    from analytics.indexer import AlgodBlocks, FileBlocks
+    from deploy.utils import Interface
+
+    parser = argparse.ArgumentParser(description="Replay recorded calls against the deployed program and a new build")
+    parser.add_argument("app_id", type=int)
+    parser.add_argument("first", type=int)
+    parser.add_argument("last", type=int)
+    parser.add_argument("--blocks", help="blocks recorded with analytics.indexer.record, instead of reading algod")
+    parser.add_argument("--name", default="Staking", help="build to replay, from build/manifest.json")
+    parser.add_argument("--methods", nargs="+", default=list(DEFAULT_METHODS))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--algod", default="https://testnet-api.algonode.cloud")
+    parser.add_argument("--json", help="write every call's CallDiff here")
+    args = parser.parse_args(argv[1:])
+
+    interface = Interface("", args.algod)
+    source = FileBlocks(args.blocks) if args.blocks else AlgodBlocks(interface.algod)
+    diffs = replay(interface, args.app_id, source, args.first, args.last, args.name, args.methods, args.workers)
+    report(diffs)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([d._asdict() for d in diffs], f, indent=4)
+    return 1 if any(d.divergences for d in diffs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -3,7 +3,6 @@ from dotenv import dotenv_values
 from algosdk import account, encoding, mnemonic
 from algosdk.logic import get_application_address
 from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner, AccountTransactionSigner
-from algosdk.abi import Contract
 from algosdk.error import AlgodHTTPError
 from algosdk.transaction import (StateSchema, ApplicationOptInTxn, ApplicationCallTxn, ApplicationCreateTxn, PaymentTxn,
                                         AssetCreateTxn, OnComplete)
@@ -36,11 +35,8 @@ if not ENABLED:
     print("Script is disabled")
     exit()
 
-# IDO Contract
-approval, clear = interface.program("Staking")
-with open("../../build/Staking/abi.json") as f:
-    abi = f.read()
-staking_contract = Contract.from_json(abi)
+# Staking Contract
+staking_contract = interface.contract("Staking")
 
 gtx = AtomicTransactionComposer()
 gtx.add_method_call(
@@ -1,22 +1,26 @@
-from deploy.utils import Interface
+from deploy.utils import Interface, curve_boxes
 from dotenv import dotenv_values
 from algosdk import account, encoding, mnemonic
 from algosdk.logic import get_application_address
 from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner, AccountTransactionSigner
-from algosdk.abi import Contract
 from algosdk.error import AlgodHTTPError
 from algosdk.transaction import (StateSchema, ApplicationOptInTxn, ApplicationCallTxn, ApplicationCreateTxn, PaymentTxn,
                                         AssetCreateTxn, OnComplete)
 
 ENABLED = False
 
-contract = {}
+contract = {
+    "Staking": 0
+}
 
 assets = {
     "XUSD": 0000,
     "PRIV": 0000,
 }
 
+# ss, se, ls, le
+settings = [50_000, 150_000, 15, 60]
+
 # Load wallets
 env_vars = dotenv_values("../.env")
 creator_sk = mnemonic.to_private_key(env_vars["creator"])
@@ -35,27 +39,25 @@ if not ENABLED:
     print("Script is disabled")
     exit()
 
-# IDO Contract
-approval, clear = interface.program("IDO")
-with open("../../build/IDO/abi.json") as f:
-    abi = f.read()
-ido_contract = Contract.from_json(abi)
+# Staking Contract
+staking_contract = interface.contract("Staking")
 
 gtx = AtomicTransactionComposer()
 gtx.add_method_call(
-    app_id=contract['IDO'],
+    app_id=contract['Staking'],
     on_complete=OnComplete.NoOpOC,
-    method=ido_contract.get_method_by_name("update_settings"),
+    method=staking_contract.get_method_by_name("update_settings"),
     sender=creator,
     sp=interface.get_suggested_params(),
     signer=creator_signer,
-    method_args=[
-        15, 60, 50_000, 150_000
-    ]
+    method_args=settings,
+    boxes=curve_boxes(settings[2], settings[3]),
 )
+# Fees cover the curve's OpUp calls
+gtx = interface.with_fees(gtx)
 tx_id = gtx.submit(interface.algod)
 resp = interface.wait_for_confirmation(tx_id[0])
-print("Updated admin address")
+print("Updated settings")
 
 
 
@@ -3,7 +3,6 @@ from dotenv import dotenv_values
 from algosdk import account, encoding, mnemonic
 from algosdk.logic import get_application_address
 from algosdk.atomic_transaction_composer import AtomicTransactionComposer, TransactionWithSigner, AccountTransactionSigner
-from algosdk.abi import Contract
 from algosdk.error import AlgodHTTPError
 from algosdk.transaction import (StateSchema, ApplicationOptInTxn, ApplicationCallTxn, ApplicationCreateTxn, PaymentTxn,
                                         AssetCreateTxn, AssetTransferTxn, OnComplete)
@@ -37,12 +36,9 @@ if not ENABLED:
     print("Script is disabled")
     exit()
 
-# IDO Contract
-approval, clear = interface.program("IDO")
-with open("../../build/Staking/abi.json") as f:
-    abi = f.read()
-staking_contract = Contract.from_json(abi)
-staking_addr = get_application_address(contract['IDO'])
+# Staking Contract
+staking_contract = interface.contract("Staking")
+staking_addr = get_application_address(contract['Staking'])
 
 # Withdraw
 gtx = AtomicTransactionComposer()
@@ -58,6 +54,7 @@ gtx.add_method_call(
         0,
     ]
 )
+gtx = interface.with_fees(gtx)
 tx_id = gtx.submit(interface.algod)
 print("Withdraw Staking")
 
@@ -0,0 +1,169 @@
+import base64
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import msgpack
+from algosdk import constants, encoding
+
+
+class ConfirmationTimeout(Exception):
+    def __init__(self, txid, last_round):
+        super().__init__(f"Transaction {txid} not confirmed by round {last_round}")
+        self.txid = txid
+        self.last_round = last_round
+
+
+def block_txids(block):
+    """
+    Yield (txid, signed txn in block) for every top level transaction of a msgpack decoded block.
+    Blocks strip the genesis hash and, unless `hgi` is set, the genesis ID from each transaction,
+    so both are put back before hashing.
+    """
+    for stib in block.get("txns", []):
+        txn = dict(stib["txn"])
+        txn["gh"] = block["gh"]
+        if stib.get("hgi"):
+            txn["gen"] = block["gen"]
+        to_sign = constants.txid_prefix + base64.b64decode(encoding.msgpack_encode(txn))
+        txid = base64.b32encode(encoding.checksum(to_sign)).decode()
+        yield encoding._undo_padding(txid), stib
+
+
+def confirmation(txid, confirmed_round, stib):
+    """Build the subset of a pending transaction response that a block carries."""
+    info = {"txid": txid, "confirmed-round": confirmed_round}
+    if "apid" in stib:
+        info["application-index"] = stib["apid"]
+    if "caid" in stib:
+        info["asset-index"] = stib["caid"]
+    logs = stib.get("dt", {}).get("lg")
+    if logs:
+        info["logs"] = [base64.b64encode(log).decode() for log in logs]
+    return info
+
+
+class ConfirmationTracker:
+    """
+    Follows the chain one block at a time and resolves every tracked transaction from the block
+    it lands in. Costs two algod calls per round however many transactions are pending.
+
+    Usage:
+        with ConfirmationTracker(interface.algod) as tracker:
+            futures = [tracker.track(txid) for txid in txids]
+            results = [f.result() for f in futures]
+
+    The tracker starts `history` rounds back and keeps the transactions of the last `history` rounds
+    it has read, so transactions confirmed shortly before the tracker started, or before they were
+    tracked, still resolve: it is safe to track right after submitting.
+    """
+
+    def __init__(self, algod, timeout=1000, history=16):
+        self.algod = algod
+        self.timeout = timeout
+        self.history = history
+        self.pending = {}
+        self.recent = {}
+        self.recent_rounds = deque()
+        self.error = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last_round = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        # Read back over recent rounds first, which may hold transactions submitted before start
+        self.last_round = max(self.algod.status()["last-round"] - self.history, 0)
+        self.error = None
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._follow, name="confirmation-tracker", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for txid, (future, _) in pending.items():
+            future.cancel()
+
+    def track(self, txid, callback=None, timeout=None):
+        """
+        Return a Future resolved with the confirmation info of `txid`, or failed with
+        ConfirmationTimeout if it is not confirmed within `timeout` rounds.
+        """
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        with self.lock:
+            if self.error is not None:
+                future.set_exception(self.error)
+                return future
+            if txid in self.recent:
+                future.set_result(self.recent[txid])
+                return future
+            if txid in self.pending:
+                return self.pending[txid][0]
+            deadline = self.last_round + (timeout or self.timeout)
+            self.pending[txid] = (future, deadline)
+        return future
+
+    def wait(self, txids, timeout=None):
+        """Block until every txid is confirmed and return their infos in order."""
+        return [f.result() for f in [self.track(txid, timeout=timeout) for txid in txids]]
+
+    def _follow(self):
+        while not self.stopped.is_set():
+            try:
+                status = self.algod.status_after_block(self.last_round)
+                for current in range(self.last_round + 1, status["last-round"] + 1):
+                    self._process(current)
+            except Exception as e:
+                self._fail_all(e)
+                return
+
+    def _process(self, current):
+        raw = self.algod.block_info(current, response_format="msgpack")
+        block = msgpack.unpackb(raw, raw=False, strict_map_key=False)["block"]
+
+        resolved, expired = [], []
+        with self.lock:
+            txids = []
+            for txid, stib in block_txids(block):
+                info = confirmation(txid, current, stib)
+                self.recent[txid] = info
+                txids.append(txid)
+                if txid in self.pending:
+                    resolved.append((self.pending.pop(txid)[0], info))
+
+            self.recent_rounds.append(txids)
+            while len(self.recent_rounds) > self.history:
+                for txid in self.recent_rounds.popleft():
+                    self.recent.pop(txid, None)
+
+            for txid, (future, deadline) in list(self.pending.items()):
+                if deadline <= current:
+                    expired.append((self.pending.pop(txid)[0], txid))
+            self.last_round = current
+
+        for future, info in resolved:
+            future.set_result(info)
+        for future, txid in expired:
+            future.set_exception(ConfirmationTimeout(txid, current))
+
+    def _fail_all(self, error):
+        with self.lock:
+            self.error = error
+            pending, self.pending = self.pending, {}
+        for future, _ in pending.values():
+            future.set_exception(error)
@@ -0,0 +1,284 @@
+"""
+Pooled, instrumented algod transport.
+
+`PooledAlgodClient` is an AlgodClient whose requests go over keep-alive HTTP connections pooled
+per endpoint, instead of a new connection per request. Requests that fail with a connection error,
+a 5xx or a 429 are retried with exponential backoff, moving on to the next endpoint when one keeps
+failing; the last endpoint that answered is tried first from then on.
+
+Sending transactions is not idempotent: a request that failed mid-flight may still have reached the
+pool, and sending it again answers with an error. It is only retried when it certainly was not
+processed, i.e. the connection was refused or the node answered 429; other failures are raised at
+once, and the caller looks the transaction up before sending it again.
+
+`suggested_params` is cached for the round it was fetched at: it is fetched again once a status
+response shows a later round, or after `round_time` seconds, so building many transactions in one
+round costs one call.
+
+Every endpoint keeps a latency histogram and error counts (`EndpointStats`), exported with
+`stats()` as a dict or `prometheus()` as Prometheus text. Long-polling waits for a block are
+counted but left out of the latency histogram.
+
+Usage:
+    algod = PooledAlgodClient("", ["https://testnet-api.algonode.cloud", "http://localhost:4001"])
+"""
+import copy
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+from urllib import parse
+
+from algosdk import constants, error
+from algosdk.v2client.algod import AlgodClient, api_version_path_prefix
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf"))
+# Status codes worth retrying; anything else is the request's fault and raised at once
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Socket, timeout and protocol errors, including those of idle connections the server closed
+CONNECTION_ERRORS = (OSError, http.client.HTTPException)
+
+WAIT_FOR_BLOCK = "/status/wait-for-block-after/"
+# POST paths that must not be repeated once they may have been processed (send_raw_transaction)
+NON_IDEMPOTENT = ("/transactions",)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = {}
+        self.latency = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+
+    def observe(self, elapsed_ms=None):
+        """Count a request, and its latency unless None."""
+        with self.lock:
+            self.requests += 1
+            if elapsed_ms is None:
+                return
+            self.latency_sum += elapsed_ms
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed_ms <= bound:
+                    self.latency[i] += 1
+                    break
+
+    def retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def fail(self, kind):
+        with self.lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "latency_ms": {str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.latency)},
+                "latency_sum_ms": self.latency_sum,
+            }
+
+
+class Endpoint:
+    """Pool of keep-alive connections to one algod address."""
+
+    def __init__(self, address, pool_size):
+        url = parse.urlsplit(address)
+        self.address = address
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.host = url.netloc
+        self.base_path = url.path.rstrip("/")
+        self.idle = queue.LifoQueue(maxsize=pool_size)
+        self.stats = EndpointStats()
+
+    def acquire(self, timeout):
+        try:
+            connection = self.idle.get_nowait()
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            return connection, True
+        except queue.Empty:
+            return self.connection_class(self.host, timeout=timeout), False
+
+    def release(self, connection):
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class PooledAlgodClient(AlgodClient):
+    """
+    AlgodClient over pooled connections to `addresses` (one address or a list, in order of
+    preference). Each request is tried up to `retries` + 1 times per endpoint, waiting `backoff`
+    seconds doubled on every retry, before failing over to the next endpoint.
+    """
+
+    def __init__(self, algod_token, addresses, headers=None, pool_size=8, retries=2, backoff=0.25,
+                 round_time=3.0):
+        addresses = [addresses] if isinstance(addresses, str) else list(addresses)
+        super().__init__(algod_token, addresses[0], headers)
+        self.endpoints = [Endpoint(address, pool_size) for address in addresses]
+        self.preferred = 0
+        self.retries = retries
+        self.backoff = backoff
+        self.round_time = round_time
+        self._params = None
+        self._params_round = 0
+        self._params_time = 0.0
+        self._params_lock = threading.Lock()
+
+    def algod_request(self, method, requrl, params=None, data=None, headers=None, response_format="json",
+                      timeout=30):
+        header = {"User-Agent": "py-algorand-sdk"}
+        if self.headers:
+            header.update(self.headers)
+        if headers:
+            header.update(headers)
+        if requrl not in constants.no_auth:
+            header.update({constants.algod_auth_header: self.algod_token})
+        path = requrl
+        if requrl not in constants.unversioned_paths:
+            path = api_version_path_prefix + requrl
+        if params:
+            path = path + "?" + parse.urlencode(params)
+
+        idempotent = method != "POST" or requrl not in NON_IDEMPOTENT
+        last_error = None
+        start = self.preferred
+        for offset in range(len(self.endpoints)):
+            index = (start + offset) % len(self.endpoints)
+            endpoint = self.endpoints[index]
+            delay = self.backoff
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    endpoint.stats.retry()
+                    # Jittered so clients sharing a node do not retry in lockstep
+                    time.sleep(delay * (0.5 + random.random()))
+                    delay *= 2
+                try:
+                    status, body = self._send(endpoint, method, path, data, header, timeout,
+                                              observe=not requrl.startswith(WAIT_FOR_BLOCK))
+                except CONNECTION_ERRORS as e:
+                    endpoint.stats.observe()
+                    endpoint.stats.fail(type(e).__name__)
+                    if not idempotent and not isinstance(e, ConnectionRefusedError):
+                        raise error.AlgodHTTPError(f"{requrl} failed and may have been applied: {e}") from e
+                    last_error = e
+                    continue
+                if status in RETRY_STATUS:
+                    endpoint.stats.fail(str(status))
+                    if not idempotent and status != 429:
+                        raise self._http_error(status, body)
+                    last_error = self._http_error(status, body)
+                    continue
+                self.preferred = index
+                if status >= 400:
+                    endpoint.stats.fail(str(status))
+                    raise self._http_error(status, body)
+                return self._decode(requrl, status, body, response_format)
+        if isinstance(last_error, error.AlgodHTTPError):
+            raise last_error
+        raise error.AlgodHTTPError(f"No algod endpoint reachable: {last_error}")
+
+    def _send(self, endpoint, method, path, data, header, timeout, observe):
+        connection, reused = endpoint.acquire(timeout)
+        began = time.monotonic()
+        try:
+            try:
+                connection.request(method, endpoint.base_path + path, body=data, headers=header)
+                response = connection.getresponse()
+            except CONNECTION_ERRORS:
+                connection.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection, which is not a failure of the endpoint
+                connection = endpoint.connection_class(endpoint.host, timeout=timeout)
+                connection.request(method, endpoint.base_path + path, body=data, headers=header)
+                response = connection.getresponse()
+            body = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        endpoint.stats.observe((time.monotonic() - began) * 1000 if observe else None)
+        if response.will_close:
+            connection.close()
+        else:
+            endpoint.release(connection)
+        return response.status, body
+
+    @staticmethod
+    def _http_error(status, body):
+        data = {}
+        message = body.decode("utf-8", errors="replace")
+        try:
+            data = json.loads(message)
+            message = data["message"]
+        except (ValueError, KeyError, TypeError):
+            pass
+        return error.AlgodHTTPError(message, status, data.get("data") if isinstance(data, dict) else None)
+
+    def _decode(self, requrl, status, body, response_format):
+        if response_format != "json":
+            return body
+        if not body and status == 200:
+            # Some algod responses are an empty 200 OK
+            return {}
+        try:
+            result = json.loads(body)
+        except ValueError as e:
+            raise error.AlgodResponseError("Failed to parse JSON response from algod") from e
+        if requrl == "/status" or requrl.startswith(WAIT_FOR_BLOCK):
+            self._observe_round(result.get("last-round", 0))
+        return result
+
+    def _observe_round(self, round):
+        with self._params_lock:
+            if self._params is not None and round > self._params_round:
+                self._params = None
+
+    def suggested_params(self, **kwargs):
+        """Suggested params, cached for the round they were fetched at. Returns a copy."""
+        if kwargs:
+            return super().suggested_params(**kwargs)
+        with self._params_lock:
+            if self._params is None or time.monotonic() - self._params_time > self.round_time:
+                self._params = super().suggested_params()
+                self._params_round = self._params.first
+                self._params_time = time.monotonic()
+            return copy.copy(self._params)
+
+    def stats(self):
+        """Per endpoint request, retry, error and latency counts."""
+        return {endpoint.address: endpoint.stats.snapshot() for endpoint in self.endpoints}
+
+    def prometheus(self, prefix="algod"):
+        """Stats in the Prometheus text exposition format."""
+        lines = [
+            f"# TYPE {prefix}_request_latency_ms histogram",
+            f"# TYPE {prefix}_requests_total counter",
+            f"# TYPE {prefix}_retries_total counter",
+            f"# TYPE {prefix}_errors_total counter",
+        ]
+        for address, stats in self.stats().items():
+            label = f'endpoint="{address}"'
+            cumulative = 0
+            for bound, n in stats["latency_ms"].items():
+                cumulative += n
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'{prefix}_request_latency_ms_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{prefix}_request_latency_ms_sum{{{label}}} {stats['latency_sum_ms']}")
+            lines.append(f"{prefix}_request_latency_ms_count{{{label}}} {cumulative}")
+            lines.append(f"{prefix}_requests_total{{{label}}} {stats['requests']}")
+            lines.append(f"{prefix}_retries_total{{{label}}} {stats['retries']}")
+            for kind, n in stats["errors"].items():
+                lines.append(f'{prefix}_errors_total{{{label},kind="{kind}"}} {n}')
+        return "\n".join(lines) + "\n"
@@ -1,28 +1,296 @@
 import os
+import re
+import copy
+import json
+import hashlib
 from base64 import b64decode
-from algosdk.v2client.algod import AlgodClient
-from algosdk import account, mnemonic
+from algosdk.v2client.models import SimulateRequest, SimulateRequestTransactionGroup
+from algosdk.atomic_transaction_composer import AtomicTransactionComposer, EmptySigner, TransactionWithSigner
+from algosdk.transaction import (ApplicationCallTxn, ApplicationNoOpTxn, SignedTransaction, StateSchema,
+                                 assign_group_id)
+from algosdk.abi import Contract
+from algosdk import account, encoding, mnemonic
+from deploy.tracker import ConfirmationTracker
+from deploy.transport import PooledAlgodClient
+
+BUILD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "build")
+BYTECODE_CACHE_DIR = os.path.join(BUILD_DIR, ".cache", "bytecode")
+
+# Opcode budget each app call adds to the group pool
+OPCODE_BUDGET = 700
+MAX_GROUP_SIZE = 16
+# Fee multiplier given to every app call while simulating, so the estimate never fails on fees
+SIMULATE_FEE = 32
+# Extra budget simulated with when measuring how much budget a group is short of
+SIMULATE_EXTRA_BUDGET = OPCODE_BUDGET * MAX_GROUP_SIZE
+
+
+# Opcodes of the template prelude and the constant blocks before it
+INTCBLOCK = 0x20
+BYTECBLOCK = 0x26
+PUSHINT = 0x81
+STORE = 0x35
+
+
+def varuint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def read_varuint(data, i):
+    value = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, i
+
+
+def fill_template(teal, names):
+    """TEAL with every template variable in `names` set to 0, as compiled once for patching."""
+    for name in names:
+        teal = re.sub(rf"\b{name}\b", "0", teal)
+    return teal
+
+
+def patch_template(bytecode, names, values):
+    """
+    Patch template values into a program compiled from `fill_template`. The program must start
+    with one `pushint <name>; store <slot>` pair per name, in order, right after its constant
+    blocks. Only that prelude changes length and branch offsets are relative, so nothing after it
+    moves.
+    """
+    _, i = read_varuint(bytecode, 0)
+    if bytecode[i] == INTCBLOCK:
+        count, i = read_varuint(bytecode, i + 1)
+        for _ in range(count):
+            _, i = read_varuint(bytecode, i)
+    if bytecode[i] == BYTECBLOCK:
+        count, i = read_varuint(bytecode, i + 1)
+        for _ in range(count):
+            length, i = read_varuint(bytecode, i)
+            i += length
+
+    patched = bytearray(bytecode[:i])
+    for name in names:
+        if bytecode[i:i + 2] != bytes([PUSHINT, 0]) or bytecode[i + 2] != STORE:
+            raise ValueError(f"Template prelude not found for {name} at byte {i}")
+        patched += bytes([PUSHINT]) + varuint(values[name]) + bytecode[i + 2:i + 4]
+        i += 4
+    return bytes(patched + bytecode[i:])
+
+
+class SimulationError(Exception):
+    def __init__(self, message, failed_at):
+        super().__init__(f"Simulation failed at {failed_at}: {message}")
+        self.message = message
+        self.failed_at = failed_at
+
+    def __reduce__(self):
+        # Raised in worker processes too, so it must unpickle with both arguments
+        return SimulationError, (self.message, self.failed_at)
+
+
+def count_inner(result):
+    """Number of inner transactions issued by a simulated transaction, at any depth."""
+    return sum(1 + count_inner(inner) for inner in result.get("inner-txns", []))
+
+
+def load_manifest():
+    with open(os.path.join(BUILD_DIR, "manifest.json")) as f:
+        return json.load(f)
+
+
+def read_artifact(name, artifact):
+    with open(os.path.join(BUILD_DIR, load_manifest()[name][artifact]["path"])) as f:
+        return f.read()
+
+
+# Minimum balance of an account, and what each asset opt-in adds to it
+MIN_BALANCE = 100_000
+ASSET_MIN_BALANCE = 100_000
+
+# Staking rate curve box, one uint64 per lock length from ls to le. StakingFactory keys one per pool
+CURVE_BOX = b"c"
+
+
+def curve_mbr(ls, le, key=CURVE_BOX):
+    return 2500 + 400 * (len(key) + 8 * (le - ls + 1))
+
+
+def curve_boxes(ls, le, key=CURVE_BOX):
+    # Each box reference grants 1KB of box I/O, so large curves need extra (empty) references
+    refs = -(-8 * (le - ls + 1) // 1024)
+    return [(0, key)] + [(0, b"")] * (refs - 1)
+
+
+# Minimum balance of a position box (32 byte address + uint64 id -> 3 uint64s), paid by the staker
+POSITION_MBR = 2500 + 400 * (32 + 8 + 24)
+
+
+# Position id of the boxes migrate_positions moves local state positions into
+MIGRATED_POSITION = 2**64 - 1
+
+
+def position_box(address, pid):
+    # Position boxes are keyed by the owner's public key followed by the uint64 position id
+    return (0, encoding.decode_address(address) + pid.to_bytes(8, "big"))
+
+
+# Settings the packed state layout keeps in the "cfg" global, in order, as uint64s
+PACKED_SETTINGS = ("tid", "rid", "ss", "se", "ls", "le", "f", "o", "pa")
 
 
 class Interface:
-    def __init__(self, token, address):
-        self.algod = AlgodClient(token, address)
+    """
+    Deploy helpers over a PooledAlgodClient. `address` is an algod address or a list of them to
+    fail over across, and other keyword arguments configure the transport.
+    """
 
-        print(self.algod.status())
+    def __init__(self, token, address, **transport):
+        self.algod = PooledAlgodClient(token, address, **transport)
 
     def get_suggested_params(self, fee=1):
+        # A copy of the params cached by the transport for the current round
         suggested_params = self.algod.suggested_params()
         suggested_params.flat_fee = True
         suggested_params.fee = suggested_params.min_fee * fee
         return suggested_params
 
-    def program(self, name):
-        with open(f"../../build/{name}/approval.teal", "r") as file:
-            approval = self.algod.compile(file.read())["result"]
-        with open(f"../../build/{name}/clear.teal", "r") as file:
-            clear = self.algod.compile(file.read())["result"]
+    def simulate(self, txns, extra_budget=0):
+        """Simulate unsigned `txns` as a group and return the simulate response for the group."""
+        txns = [copy.copy(txn) for txn in txns]
+        for txn in txns:
+            txn.group = None
+        if len(txns) > 1:
+            assign_group_id(txns)
+        request = SimulateRequest(
+            txn_groups=[SimulateRequestTransactionGroup(txns=[SignedTransaction(txn, None) for txn in txns])],
+            allow_empty_signatures=True,
+            extra_opcode_budget=extra_budget,
+        )
+        return self.algod.simulate_transactions(request)["txn-groups"][0]
+
+    def with_fees(self, atc):
+        """
+        Simulate the group composed in `atc` and return a copy of it carrying the minimum fees it
+        needs: every transaction pays the min fee, and each app call also pays for the inner
+        transactions its txn-results show it issued. If the group runs out of opcode budget, bare
+        no-op calls to the first app called are appended to pool enough budget, sized from
+        app-budget-consumed, up to the group size limit.
 
-        return b64decode(approval), b64decode(clear)
+        The copy is unsigned, so `atc` can have been built or signed already.
+        """
+        sp = self.get_suggested_params()
+        atc = atc.clone()
+        entries = atc.txn_list
+        app_calls = [e.txn for e in entries if isinstance(e.txn, ApplicationCallTxn)]
+        for txn in app_calls:
+            txn.fee = sp.min_fee * SIMULATE_FEE
+
+        group = self.simulate([e.txn for e in entries])
+        if group.get("failure-message") and "budget" in group["failure-message"] and app_calls:
+            # Measure the shortfall with extra budget and pad the group with budget calls
+            group = self.simulate([e.txn for e in entries], extra_budget=SIMULATE_EXTRA_BUDGET)
+            available = group.get("app-budget-added", 0) - SIMULATE_EXTRA_BUDGET
+            missing = group.get("app-budget-consumed", 0) - available
+            padding = -(-missing // OPCODE_BUDGET)
+            if len(entries) + padding > MAX_GROUP_SIZE:
+                raise SimulationError(f"needs {padding} budget calls, more than the group fits", group.get("failed-at"))
+            first = app_calls[0]
+            signer = next(e.signer for e in entries if e.txn is first)
+            for i in range(padding):
+                atc.add_transaction(TransactionWithSigner(
+                    ApplicationNoOpTxn(first.sender, sp, first.index, note=i.to_bytes(8, "big")), signer
+                ))
+            entries = atc.txn_list
+            group = self.simulate([e.txn for e in entries])
+        if group.get("failure-message"):
+            raise SimulationError(group["failure-message"], group.get("failed-at"))
+
+        for entry, result in zip(entries, group["txn-results"]):
+            entry.txn.fee = sp.min_fee * (1 + count_inner(result["txn-result"]))
+        return atc
+
+    def call_readonly(self, app_id, method, method_args, sender, **kwargs):
+        """
+        Return value of the read-only ABI `method` of `app_id`, from a single simulate call.
+        Nothing is signed, and unnamed resources are allowed, so boxes, accounts and apps the
+        method reads need not be referenced. Other keyword arguments go to add_method_call.
+        """
+        atc = AtomicTransactionComposer()
+        atc.add_method_call(
+            app_id=app_id,
+            method=method,
+            sender=sender,
+            sp=self.get_suggested_params(),
+            signer=EmptySigner(),
+            method_args=method_args,
+            **kwargs,
+        )
+        response = atc.simulate(
+            self.algod, SimulateRequest(txn_groups=[], allow_empty_signatures=True, allow_unnamed_resources=True)
+        )
+        if response.failure_message:
+            raise SimulationError(response.failure_message, response.failed_at)
+        return response.abi_results[0].return_value
+
+    def compile(self, teal):
+        # Bytecode is cached by TEAL hash, so unchanged programs are never sent to algod twice
+        path = os.path.join(BYTECODE_CACHE_DIR, hashlib.sha256(teal.encode()).hexdigest())
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                return file.read()
+
+        bytecode = b64decode(self.algod.compile(teal)["result"])
+        os.makedirs(BYTECODE_CACHE_DIR, exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as file:
+            file.write(bytecode)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        return bytecode
+
+    def program(self, name, **template):
+        """
+        Approval and clear bytecode of contract `name`. Template variables are given as keyword
+        arguments, e.g. TMPL_TOKEN_ID=...; the program is compiled once with them all 0 and
+        patched locally for each set of values.
+        """
+        names = load_manifest()[name].get("template", [])
+        approval = self.compile(fill_template(read_artifact(name, "approval"), names))
+        clear = self.compile(read_artifact(name, "clear"))
+        if names:
+            approval = patch_template(approval, names, template)
+
+        return approval, clear
+
+    def contract(self, name):
+        return Contract.from_json(read_artifact(name, "abi"))
+
+    def schema(self, name):
+        artifact = load_manifest()[name]
+        return StateSchema(**artifact["global_schema"]), StateSchema(**artifact["local_schema"])
+
+    def extra_pages(self, name):
+        return load_manifest()[name].get("extra_pages", 0)
+
+    def global_state(self, app_id):
+        state = {}
+        for kv in self.algod.application_info(app_id)["params"].get("global-state", []):
+            key = b64decode(kv["key"]).decode()
+            value = kv["value"]
+            state[key] = value["uint"] if value["type"] == 2 else b64decode(value["bytes"])
+        # Apps with the packed layout read the same as the others
+        if "cfg" in state:
+            packed = state.pop("cfg")
+            for i, key in enumerate(PACKED_SETTINGS):
+                state[key] = int.from_bytes(packed[8 * i:8 * i + 8], "big")
+        return state
 
     def wait_for_confirmation(self, txid):
         last_round = self.algod.status().get("last-round")
@@ -35,6 +303,11 @@ class Interface:
         txinfo["txid"] = txid
         return txinfo
 
+    def wait_for_confirmations(self, txids, timeout=1000):
+        # Follows blocks once for the whole set instead of polling each txid
+        with ConfirmationTracker(self.algod, timeout=timeout) as tracker:
+            return tracker.wait(txids)
+
 
 # Generate 3 accounts(creator, user, vault) and store mnemonic in .env
 def generate_accounts():
@@ -53,4 +326,4 @@ def generate_accounts():
 
 
 if __name__ == "__main__":
-    generate_accounts()
\ No newline at end of file
+    generate_accounts()
@@ -0,0 +1,99 @@
+"""
+Minimal TEAL assembler and disassembler for the tests, covering the constant blocks, the template
+prelude and branches; anything else raises NotImplementedError. Branch offsets are 2-byte signed
+and relative to the end of the branch instruction, as the AVM's.
+"""
+from deploy.utils import read_varuint, varuint
+
+# Opcodes without immediates
+SIMPLE = {
+    "err": 0x00, "+": 0x08, "==": 0x12, "intc_0": 0x22, "intc_1": 0x23, "intc_2": 0x24, "intc_3": 0x25,
+    "bytec_0": 0x28, "bytec_1": 0x29, "bytec_2": 0x2A, "bytec_3": 0x2B, "return": 0x43, "pop": 0x48,
+    "retsub": 0x89,
+}
+# Opcodes with one uint8 immediate
+UINT8 = {"intc": 0x21, "bytec": 0x27, "load": 0x34, "store": 0x35}
+BRANCH = {"bnz": 0x40, "bz": 0x41, "b": 0x42, "callsub": 0x88}
+INTCBLOCK, BYTECBLOCK, PUSHBYTES, PUSHINT = 0x20, 0x26, 0x80, 0x81
+
+NAMES = {opcode: name for table in (SIMPLE, UINT8, BRANCH) for name, opcode in table.items()}
+NAMES.update({INTCBLOCK: "intcblock", BYTECBLOCK: "bytecblock", PUSHBYTES: "pushbytes", PUSHINT: "pushint"})
+
+
+def parse_bytes(token):
+    if not token.startswith("0x"):
+        raise NotImplementedError(f"byte constant {token}")
+    return bytes.fromhex(token[2:])
+
+
+def encode(op, args, pc, labels):
+    if op in SIMPLE:
+        return bytes([SIMPLE[op]])
+    if op in UINT8:
+        return bytes([UINT8[op], int(args[0])])
+    if op in BRANCH:
+        offset = labels.get(args[0], pc + 3) - (pc + 3)
+        return bytes([BRANCH[op]]) + offset.to_bytes(2, "big", signed=True)
+    if op == "intcblock":
+        return bytes([INTCBLOCK]) + varuint(len(args)) + b"".join(varuint(int(arg)) for arg in args)
+    if op == "bytecblock":
+        values = [parse_bytes(arg) for arg in args]
+        return bytes([BYTECBLOCK]) + varuint(len(values)) + b"".join(varuint(len(v)) + v for v in values)
+    if op == "pushint":
+        return bytes([PUSHINT]) + varuint(int(args[0]))
+    if op == "pushbytes":
+        value = parse_bytes(args[0])
+        return bytes([PUSHBYTES]) + varuint(len(value)) + value
+    raise NotImplementedError(op)
+
+
+def assemble(teal):
+    """Bytecode of `teal`, assembled in two passes: label positions, then branch offsets."""
+    lines = [line.split("//")[0].strip() for line in teal.splitlines()]
+    lines = [line for line in lines if line]
+    if not lines[0].startswith("#pragma version"):
+        raise ValueError("missing #pragma version")
+    version = varuint(int(lines[0].split()[-1]))
+
+    labels = {}
+    for labels_known in (False, True):
+        program = bytearray(version)
+        for line in lines[1:]:
+            if line.endswith(":"):
+                labels[line[:-1]] = len(program)
+                continue
+            op, *args = line.split()
+            program += encode(op, args, len(program), labels if labels_known else {})
+    return bytes(program)
+
+
+def disassemble(bytecode):
+    """Version and (pc, op, immediates) of every instruction; branch immediates are absolute targets."""
+    version, pc = read_varuint(bytecode, 0)
+    instructions = []
+    while pc < len(bytecode):
+        start, opcode = pc, bytecode[pc]
+        pc += 1
+        if opcode not in NAMES:
+            raise NotImplementedError(f"opcode {opcode:#x} at {start}")
+        op = NAMES[opcode]
+        args = []
+        if opcode in UINT8.values():
+            args, pc = [bytecode[pc]], pc + 1
+        elif opcode in BRANCH.values():
+            args, pc = [pc + 2 + int.from_bytes(bytecode[pc:pc + 2], "big", signed=True)], pc + 2
+        elif opcode in (INTCBLOCK, BYTECBLOCK):
+            count, pc = read_varuint(bytecode, pc)
+            for _ in range(count):
+                value, pc = read_varuint(bytecode, pc)
+                if opcode == BYTECBLOCK:
+                    value, pc = bytecode[pc:pc + value], pc + value
+                args.append(value)
+        elif opcode == PUSHINT:
+            value, pc = read_varuint(bytecode, pc)
+            args = [value]
+        elif opcode == PUSHBYTES:
+            length, pc = read_varuint(bytecode, pc)
+            args, pc = [bytecode[pc:pc + length]], pc + length
+        instructions.append((start, op, args))
+    return version, instructions
@@ -0,0 +1,471 @@
+"""
+Minimal AVM for the tests: runs an app's approval program from its TEAL source against an in-memory
+ledger of one app's globals, local states and boxes, asset holdings, Algo balances and other apps'
+globals. Template variables must be filled in beforehand.
+
+Only the opcodes and fields the built contracts use are implemented, with the AVM's uint64
+overflow and underflow checks; anything else raises NotImplementedError. Opcode budget is not
+counted and `global OpcodeBudget` reads as plenty, so OpUp never issues calls; the log limits are
+enforced. Inner transactions move assets and Algos between accounts, and an asset transfer of 0 to
+the app's own address opts it in.
+
+`AVM.group` applies a group atomically: payments and asset transfers move balances, app calls to the
+app run its program, and any failure restores the ledger as it was and raises Rejected.
+"""
+import ast
+import copy
+
+from algosdk import encoding
+from algosdk.logic import get_application_address
+
+UINT64 = 2**64
+# Logs one transaction may emit, in calls and in bytes
+MAX_LOGS = 32
+MAX_LOG_BYTES = 1024
+RETURN_PREFIX = bytes.fromhex("151f7c75")
+
+NAMED_INTS = {
+    "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3, "UpdateApplication": 4, "DeleteApplication": 5,
+    "pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5, "appl": 6,
+}
+TYPE_ENUMS = {"pay": 1, "axfer": 4, "appl": 6}
+
+
+class Rejected(Exception):
+    pass
+
+
+def uint(value):
+    if not isinstance(value, int):
+        raise Rejected(f"expected uint64, got {value!r}")
+    if not 0 <= value < UINT64:
+        raise Rejected(f"uint64 overflow: {value}")
+    return value
+
+
+def bstr(value):
+    if not isinstance(value, bytes):
+        raise Rejected(f"expected bytes, got {value!r}")
+    return value
+
+
+def parse(teal):
+    """(instructions, labels) of TEAL source, each instruction an (opcode, arguments) pair."""
+    program, labels = [], {}
+    for line in teal.splitlines():
+        line = line.strip()
+        if line.startswith("#pragma"):
+            continue
+        if line.startswith(("byte ", "method ")) and '"' in line:
+            op, _, literal = line.partition(" ")
+            value = ast.literal_eval(literal.split(" //")[0].strip())
+            program.append((op, [value.encode("latin-1") if op == "byte" else value]))
+            continue
+        line = line.split("//")[0].strip()
+        if not line:
+            continue
+        if line.endswith(":"):
+            labels[line[:-1]] = len(program)
+            continue
+        op, *args = line.split()
+        program.append((op, args))
+    return program, labels
+
+
+class AVM:
+    def __init__(self, teal, app_id):
+        self.program, self.labels = parse(teal)
+        self.app_id = app_id
+        self.address = encoding.decode_address(get_application_address(app_id))
+        self.globals = {}
+        # Local state by address, present once opted in
+        self.locals = {}
+        self.boxes = {}
+        # (address, asset id) -> amount, present once opted in
+        self.holdings = {}
+        self.algos = {}
+        # Globals of other apps, e.g. a price oracle, by app id
+        self.apps = {}
+        self.timestamp = 1_700_000_000
+        self.logs = []
+
+    # Ledger helpers
+
+    def opt_in(self, address, asset, amount=0):
+        self.holdings[(address, asset)] = self.holdings.get((address, asset), 0) + amount
+
+    def balance(self, address, asset):
+        return self.holdings.get((address, asset))
+
+    def _transfer_asset(self, sender, receiver, asset, amount):
+        if receiver == sender and amount == 0:
+            self.holdings.setdefault((receiver, asset), 0)
+            return
+        if (sender, asset) not in self.holdings or (receiver, asset) not in self.holdings:
+            raise Rejected(f"asset {asset} transfer between accounts not opted in")
+        if self.holdings[(sender, asset)] < amount:
+            raise Rejected(f"asset {asset} balance below {amount}")
+        self.holdings[(sender, asset)] -= amount
+        self.holdings[(receiver, asset)] += amount
+
+    def _pay(self, sender, receiver, amount):
+        if self.algos.get(sender, 0) < amount:
+            raise Rejected(f"Algo balance below {amount}")
+        self.algos[sender] = self.algos.get(sender, 0) - amount
+        self.algos[receiver] = self.algos.get(receiver, 0) + amount
+
+    # Transactions
+
+    def payment(self, sender, receiver, amount):
+        return {"TypeEnum": TYPE_ENUMS["pay"], "Sender": sender, "Receiver": receiver, "Amount": amount}
+
+    def asset_transfer(self, sender, receiver, asset, amount):
+        return {
+            "TypeEnum": TYPE_ENUMS["axfer"], "Sender": sender, "AssetReceiver": receiver,
+            "XferAsset": asset, "AssetAmount": amount,
+        }
+
+    def method_call(self, sender, method, args, app_id=None, on_completion=0):
+        """An ABI call of `method` (an algosdk Method); reference arguments are given by id or address."""
+        txn = {
+            "TypeEnum": TYPE_ENUMS["appl"], "Sender": sender,
+            "ApplicationID": self.app_id if app_id is None else app_id, "OnCompletion": on_completion,
+            "Accounts": [], "Assets": [], "Applications": [],
+        }
+        app_args = [method.get_selector()]
+        for arg, value in zip(method.args, args):
+            if arg.type == "asset":
+                txn["Assets"].append(value)
+                app_args.append(bytes([len(txn["Assets"]) - 1]))
+            elif arg.type == "account":
+                txn["Accounts"].append(value)
+                app_args.append(bytes([len(txn["Accounts"])]))
+            elif arg.type == "application":
+                txn["Applications"].append(value)
+                app_args.append(bytes([len(txn["Applications"])]))
+            else:
+                app_args.append(arg.type.encode(value))
+        txn["ApplicationArgs"] = app_args
+        return txn
+
+    def bare_call(self, sender, on_completion):
+        return {
+            "TypeEnum": TYPE_ENUMS["appl"], "Sender": sender, "ApplicationID": self.app_id,
+            "OnCompletion": on_completion, "Accounts": [], "Assets": [], "Applications": [],
+            "ApplicationArgs": [],
+        }
+
+    def group(self, *txns):
+        """Apply txns as one group. Returns the ABI return value bytes of each app call (or None)."""
+        saved = copy.deepcopy((self.globals, self.locals, self.boxes, self.holdings, self.algos, self.logs))
+        try:
+            returns = []
+            for index, txn in enumerate(txns):
+                txn = dict(txn, GroupIndex=index)
+                returns.append(self._apply(txn, txns))
+            return returns
+        except Exception:
+            self.globals, self.locals, self.boxes, self.holdings, self.algos, self.logs = saved
+            raise
+
+    def _apply(self, txn, group):
+        if txn["TypeEnum"] == TYPE_ENUMS["pay"]:
+            self._pay(txn["Sender"], txn["Receiver"], txn["Amount"])
+        elif txn["TypeEnum"] == TYPE_ENUMS["axfer"]:
+            self._transfer_asset(txn["Sender"], txn["AssetReceiver"], txn["XferAsset"], txn["AssetAmount"])
+        elif txn["TypeEnum"] == TYPE_ENUMS["appl"]:
+            if txn.get("OnCompletion") == NAMED_INTS["OptIn"]:
+                self.locals.setdefault(txn["Sender"], {})
+            logs = Eval(self, txn, group).run()
+            self.logs.extend(logs)
+            returned = [log for log in logs if log.startswith(RETURN_PREFIX)]
+            return returned[-1][len(RETURN_PREFIX):] if returned else None
+        else:
+            raise NotImplementedError(txn["TypeEnum"])
+
+
+class Eval:
+    """One run of the approval program for app call `txn` of `group`."""
+
+    def __init__(self, avm, txn, group):
+        self.avm = avm
+        self.txn = txn
+        self.group = group
+        self.stack = []
+        self.scratch = [0] * 256
+        self.frames = []
+        self.inner = None
+        self.logs = []
+
+    def push(self, value):
+        self.stack.append(value)
+
+    def pop(self):
+        if not self.stack:
+            raise Rejected("stack underflow")
+        return self.stack.pop()
+
+    def pop_uint(self):
+        return uint(self.pop())
+
+    def pop_bytes(self):
+        return bstr(self.pop())
+
+    def txn_field(self, txn, field, index=None):
+        if field == "NumAppArgs":
+            return len(txn.get("ApplicationArgs", []))
+        if field == "Accounts":
+            return ([txn["Sender"]] + txn["Accounts"])[index]
+        if field == "Applications":
+            return ([txn["ApplicationID"]] + txn["Applications"])[index]
+        if index is not None:
+            return txn[field][index]
+        return txn.get(field, b"" if field in ("Sender", "Receiver", "AssetReceiver") else 0)
+
+    def global_field(self, field):
+        if field == "CurrentApplicationAddress":
+            return self.avm.address
+        if field == "CurrentApplicationID":
+            return self.avm.app_id
+        if field == "LatestTimestamp":
+            return self.avm.timestamp
+        if field == "OpcodeBudget":
+            return 1_000_000
+        if field == "GroupSize":
+            return len(self.group)
+        if field == "ZeroAddress":
+            return bytes(32)
+        raise NotImplementedError(f"global {field}")
+
+    def account(self, value):
+        # Accounts are given as addresses or as indexes into the accounts array
+        if isinstance(value, int):
+            return self.txn_field(self.txn, "Accounts", value)
+        return value
+
+    def submit(self):
+        for fields in self.inner:
+            if fields["TypeEnum"] == TYPE_ENUMS["axfer"]:
+                self.avm._transfer_asset(self.avm.address, fields["AssetReceiver"], fields["XferAsset"], fields.get("AssetAmount", 0))
+            elif fields["TypeEnum"] == TYPE_ENUMS["pay"]:
+                self.avm._pay(self.avm.address, fields["Receiver"], fields.get("Amount", 0))
+            else:
+                raise NotImplementedError(f"inner transaction type {fields['TypeEnum']}")
+        self.inner = None
+
+    def run(self):
+        program, labels = self.avm.program, self.avm.labels
+        self.pc = 0
+        while self.pc < len(program):
+            op, args = program[self.pc]
+            self.pc += 1
+            jump = self.step(op, args)
+            if jump is not None:
+                if jump == "return":
+                    if self.pop_uint() == 0:
+                        raise Rejected("program returned 0")
+                    return self.logs
+                self.pc = labels[jump] if isinstance(jump, str) else jump
+        raise Rejected("program ended without return")
+
+    def step(self, op, args):
+        push, pop, pop_uint, pop_bytes = self.push, self.pop, self.pop_uint, self.pop_bytes
+        avm = self.avm
+
+        if op in ("int", "pushint"):
+            push(NAMED_INTS[args[0]] if args[0] in NAMED_INTS else int(args[0], 0))
+        elif op == "byte":
+            push(args[0] if isinstance(args[0], bytes) else bytes.fromhex(args[0][2:]))
+        elif op == "method":
+            push(encoding.checksum(args[0].encode())[:4])
+        elif op == "load":
+            push(self.scratch[int(args[0])])
+        elif op == "store":
+            self.scratch[int(args[0])] = pop()
+        elif op == "pop":
+            pop()
+        elif op == "swap":
+            b, a = pop(), pop()
+            push(b)
+            push(a)
+        elif op == "dig":
+            push(self.stack[-1 - int(args[0])])
+        elif op == "cover":
+            value = pop()
+            self.stack.insert(len(self.stack) - int(args[0]), value)
+        elif op == "uncover":
+            push(self.stack.pop(-1 - int(args[0])))
+        elif op in ("+", "-", "*", "/", "<", ">", "<=", ">=", "&&", "||"):
+            b, a = pop_uint(), pop_uint()
+            if op == "/" and b == 0:
+                raise Rejected("division by zero")
+            push(uint({
+                "+": lambda: a + b, "-": lambda: a - b, "*": lambda: a * b, "/": lambda: a // b,
+                "<": lambda: int(a < b), ">": lambda: int(a > b), "<=": lambda: int(a <= b),
+                ">=": lambda: int(a >= b), "&&": lambda: int(bool(a and b)), "||": lambda: int(bool(a or b)),
+            }[op]()))
+        elif op in ("==", "!="):
+            b, a = pop(), pop()
+            if type(a) is not type(b):
+                raise Rejected(f"{op} of mixed types")
+            push(int((a == b) == (op == "==")))
+        elif op == "!":
+            push(int(pop_uint() == 0))
+        elif op == "mulw":
+            b, a = pop_uint(), pop_uint()
+            push((a * b) >> 64)
+            push((a * b) % UINT64)
+        elif op == "divmodw":
+            d, c, b, a = pop_uint(), pop_uint(), pop_uint(), pop_uint()
+            divisor = (c << 64) + d
+            if divisor == 0:
+                raise Rejected("division by zero")
+            quotient, remainder = divmod((a << 64) + b, divisor)
+            push(quotient >> 64)
+            push(quotient % UINT64)
+            push(remainder >> 64)
+            push(remainder % UINT64)
+        elif op == "itob":
+            push(pop_uint().to_bytes(8, "big"))
+        elif op == "btoi":
+            value = pop_bytes()
+            if len(value) > 8:
+                raise Rejected("btoi of more than 8 bytes")
+            push(int.from_bytes(value, "big"))
+        elif op == "concat":
+            b, a = pop_bytes(), pop_bytes()
+            push(a + b)
+        elif op == "bzero":
+            push(bytes(pop_uint()))
+        elif op == "getbyte":
+            index, value = pop_uint(), pop_bytes()
+            if index >= len(value):
+                raise Rejected("getbyte out of range")
+            push(value[index])
+        elif op in ("extract", "extract3"):
+            if op == "extract":
+                start, length = int(args[0]), int(args[1])
+                value = pop_bytes()
+                length = length or len(value) - start
+            else:
+                length, start, value = pop_uint(), pop_uint(), pop_bytes()
+            if start + length > len(value):
+                raise Rejected(f"{op} out of range")
+            push(value[start:start + length])
+        elif op == "extract_uint16":
+            offset, value = pop_uint(), pop_bytes()
+            if offset + 2 > len(value):
+                raise Rejected("extract_uint16 out of range")
+            push(int.from_bytes(value[offset:offset + 2], "big"))
+        elif op == "extract_uint64":
+            offset, value = pop_uint(), pop_bytes()
+            if offset + 8 > len(value):
+                raise Rejected("extract_uint64 out of range")
+            push(int.from_bytes(value[offset:offset + 8], "big"))
+        elif op == "assert":
+            if pop_uint() == 0:
+                raise Rejected("assert failed")
+        elif op == "err":
+            raise Rejected("err")
+        elif op == "return":
+            return "return"
+        elif op == "b":
+            return args[0]
+        elif op in ("bz", "bnz"):
+            if (pop_uint() == 0) == (op == "bz"):
+                return args[0]
+        elif op == "callsub":
+            self.frames.append(self.pc)
+            return args[0]
+        elif op == "retsub":
+            return self.frames.pop()
+        elif op == "txn":
+            push(self.txn_field(self.txn, args[0]))
+        elif op == "txna":
+            push(self.txn_field(self.txn, args[0], int(args[1])))
+        elif op == "txnas":
+            push(self.txn_field(self.txn, args[0], pop_uint()))
+        elif op == "gtxns":
+            push(self.txn_field(self.group[pop_uint()], args[0]))
+        elif op == "global":
+            push(self.global_field(args[0]))
+        elif op == "app_global_get":
+            push(avm.globals.get(pop_bytes(), 0))
+        elif op == "app_global_put":
+            value, key = pop(), pop_bytes()
+            avm.globals[key] = value
+        elif op in ("app_local_get", "app_local_put"):
+            value = pop() if op == "app_local_put" else None
+            key, account = pop_bytes(), self.account(pop())
+            if account not in avm.locals:
+                raise Rejected("account not opted in")
+            if op == "app_local_get":
+                push(avm.locals[account].get(key, 0))
+            else:
+                avm.locals[account][key] = value
+        elif op == "app_global_get_ex":
+            key, app = pop_bytes(), pop_uint()
+            state = avm.globals if app in (0, avm.app_id) else avm.apps.get(app, {})
+            push(state.get(key, 0))
+            push(int(key in state))
+        elif op == "asset_holding_get":
+            asset, account = pop_uint(), self.account(pop())
+            holding = avm.holdings.get((account, asset))
+            push(holding or 0)
+            push(int(holding is not None))
+        elif op == "box_create":
+            size, name = pop_uint(), pop_bytes()
+            if name in avm.boxes:
+                if len(avm.boxes[name]) != size:
+                    raise Rejected("box_create of an existing box with another size")
+                push(0)
+            else:
+                avm.boxes[name] = bytes(size)
+                push(1)
+        elif op == "box_put":
+            value, name = pop_bytes(), pop_bytes()
+            if name in avm.boxes and len(avm.boxes[name]) != len(value):
+                raise Rejected("box_put of another size")
+            avm.boxes[name] = value
+        elif op == "box_get":
+            name = pop_bytes()
+            push(avm.boxes.get(name, b""))
+            push(int(name in avm.boxes))
+        elif op == "box_len":
+            name = pop_bytes()
+            push(len(avm.boxes.get(name, b"")))
+            push(int(name in avm.boxes))
+        elif op == "box_extract":
+            length, offset, name = pop_uint(), pop_uint(), pop_bytes()
+            box = self._box(name)
+            if offset + length > len(box):
+                raise Rejected("box_extract out of range")
+            push(box[offset:offset + length])
+        elif op == "box_replace":
+            value, offset, name = pop_bytes(), pop_uint(), pop_bytes()
+            box = self._box(name)
+            if offset + len(value) > len(box):
+                raise Rejected("box_replace out of range")
+            avm.boxes[name] = box[:offset] + value + box[offset + len(value):]
+        elif op == "box_del":
+            push(int(avm.boxes.pop(pop_bytes(), None) is not None))
+        elif op == "log":
+            self.logs.append(pop_bytes())
+            if len(self.logs) > MAX_LOGS or sum(map(len, self.logs)) > MAX_LOG_BYTES:
+                raise Rejected("log limit exceeded")
+        elif op == "itxn_begin":
+            self.inner = [{}]
+        elif op == "itxn_next":
+            self.inner.append({})
+        elif op == "itxn_field":
+            self.inner[-1][args[0]] = pop()
+        elif op == "itxn_submit":
+            self.submit()
+        else:
+            raise NotImplementedError(op)
+        return None
+
+    def _box(self, name):
+        if name not in self.avm.boxes:
+            raise Rejected(f"no box {name!r}")
+        return self.avm.boxes[name]
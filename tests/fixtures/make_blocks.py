@@ -0,0 +1,92 @@
+"""
+Writes blocks.msgpack, the blocks replayed by the indexer tests, in the form `analytics.indexer.record`
+writes them: a msgpack map of round to the decoded "block" of algod's msgpack block response.
+
+Round 11 creates the app, 12 opts in ALICE and BOB, 13 stakes for ALICE and, through an inner call
+from CALLER_APP, for BOB, 14 unstakes ALICE and 15 closes her out. Every round also carries a call
+to an unrelated app, which the indexer must skip.
+
+Usage: python -m tests.fixtures.make_blocks
+"""
+import os
+
+import msgpack
+
+APP_ID = 1001
+CALLER_APP = 2002
+OTHER_APP = 3003
+FIRST_ROUND = 11
+LAST_ROUND = 15
+
+ALICE = bytes([1]) * 32
+BOB = bytes([2]) * 32
+CAROL = bytes([3]) * 32
+CALLER_ADDRESS = bytes([4]) * 32
+
+PATH = os.path.join(os.path.dirname(__file__), "blocks.msgpack")
+
+SET_UINT = 2
+
+
+def uint(value):
+    return {"at": SET_UINT, "ui": value} if value else {"at": SET_UINT}
+
+
+def position(staked, total_reward, stake_unlock):
+    return {"s": uint(staked), "tr": uint(total_reward), "su": uint(stake_unlock)}
+
+
+def counters(locked, total_liability):
+    return {"l": uint(locked), "tl": uint(total_liability)}
+
+
+def call(sender, app_id, on_completion=0, accounts=None, delta=None):
+    txn = {"type": "appl", "snd": sender, "apid": app_id}
+    if on_completion:
+        txn["apan"] = on_completion
+    if accounts:
+        txn["apat"] = accounts
+    stib = {"txn": txn}
+    if delta:
+        stib["dt"] = delta
+    return stib
+
+
+def noise():
+    return call(CAROL, OTHER_APP, delta={"gd": counters(999, 999), "ld": {0: position(5, 5, 5)}})
+
+
+def blocks():
+    # The create call has no app id yet, the stib carries the id it was given
+    create = {"txn": {"type": "appl", "snd": ALICE}, "apid": APP_ID, "dt": {"gd": counters(1, 0)}}
+    stake_bob = call(
+        BOB, APP_ID, accounts=[BOB],
+        # Keys that are not valid UTF-8 decode as bytes, and some deltas come with them
+        delta={"ld": {1: {b"s": uint(200), b"tr": uint(30), b"su": uint(9000)}}, "gd": counters(301, 40)},
+    )
+    stake_bob["txn"]["snd"] = CALLER_ADDRESS
+    return {
+        11: {"rnd": 11, "txns": [create, noise()]},
+        12: {"rnd": 12, "txns": [
+            call(ALICE, APP_ID, on_completion=1, delta={"ld": {0: position(0, 0, 0)}}),
+            call(BOB, APP_ID, on_completion=1, delta={"ld": {0: position(0, 0, 0)}}),
+        ]},
+        13: {"rnd": 13, "txns": [
+            call(ALICE, APP_ID, delta={"ld": {0: position(100, 10, 5000)}, "gd": counters(101, 10)}),
+            call(CAROL, CALLER_APP, delta={"itx": [stake_bob]}),
+            noise(),
+        ]},
+        14: {"rnd": 14, "txns": [
+            call(ALICE, APP_ID, delta={"ld": {0: position(0, 0, 0)}, "gd": counters(201, 30)}),
+        ]},
+        15: {"rnd": 15, "txns": [call(ALICE, APP_ID, on_completion=2), noise()]},
+    }
+
+
+def main():
+    with open(PATH, "wb") as f:
+        f.write(msgpack.packb(blocks(), use_bin_type=True))
+
+
+if __name__ == "__main__":
+    main()
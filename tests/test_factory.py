@@ -0,0 +1,98 @@
+import os
+
+import pytest
+from algosdk import abi
+
+from deploy.factory import APP_FUNDING, POOL_FUNDING, curve_key
+from deploy.utils import BUILD_DIR, POSITION_MBR, curve_mbr
+from tests.avm import AVM, Rejected
+
+APP_ID = 1234
+TOKEN = 10
+REWARD = 20
+ORACLE = 30
+ADMIN = bytes([1]) * 32
+STAKER = bytes([2]) * 32
+LS, LE = 1, 30
+STAKE_AMOUNT = 1_000_000
+REWARD_FUNDS = 10_000_000
+
+
+def read(name):
+    with open(os.path.join(BUILD_DIR, "StakingFactory", name)) as f:
+        return f.read()
+
+
+CONTRACT = abi.Contract.from_json(read("abi.json"))
+
+
+def call(avm, sender, name, *args, app_id=None):
+    return avm.method_call(sender, CONTRACT.get_method_by_name(name), args, app_id=app_id)
+
+
+def ledger(avm, asset):
+    value = avm.boxes[b"t" + asset.to_bytes(8, "big")]
+    return int.from_bytes(value[:8], "big"), int.from_bytes(value[8:], "big")
+
+
+@pytest.fixture
+def avm():
+    avm = AVM(read("approval.teal"), APP_ID)
+    avm.algos = {ADMIN: 10**9, STAKER: 10**9}
+    # Oracle prices: the reward token is worth half the stake token
+    avm.apps[ORACLE] = {TOKEN.to_bytes(8, "big"): (1_000_000).to_bytes(8, "big"),
+                        REWARD.to_bytes(8, "big"): (500_000).to_bytes(8, "big")}
+    for address in (ADMIN, STAKER):
+        avm.opt_in(address, TOKEN, STAKE_AMOUNT)
+        avm.opt_in(address, REWARD, REWARD_FUNDS)
+
+    avm.group(call(avm, ADMIN, "create", app_id=0))
+    avm.group(
+        avm.payment(ADMIN, avm.address, POOL_FUNDING + curve_mbr(LS, LE, curve_key(0)) + APP_FUNDING),
+        call(avm, ADMIN, "add_pool", TOKEN, REWARD, 100_000, 200_000, LS, LE, ORACLE, 0),
+    )
+    # Fund the rewards
+    avm.group(avm.asset_transfer(ADMIN, avm.address, REWARD, REWARD_FUNDS))
+    avm.group(
+        avm.payment(STAKER, avm.address, POSITION_MBR),
+        avm.asset_transfer(STAKER, avm.address, TOKEN, STAKE_AMOUNT),
+        call(avm, STAKER, "stake", 0, TOKEN, LE),
+    )
+    return avm
+
+
+def test_liability_in_reward_ledger(avm):
+    locked, liability = ledger(avm, TOKEN)
+    assert (locked, liability) == (STAKE_AMOUNT, 0)
+    locked, liability = ledger(avm, REWARD)
+    assert locked == 0
+    assert 0 < liability < REWARD_FUNDS
+
+
+def test_withdraw_reward_keeps_liability(avm):
+    _, liability = ledger(avm, REWARD)
+    free = REWARD_FUNDS - liability
+    with pytest.raises(Rejected):
+        avm.group(call(avm, ADMIN, "withdraw", REWARD, free))
+    avm.group(call(avm, ADMIN, "withdraw", REWARD, free - 1))
+    assert avm.balance(avm.address, REWARD) == liability + 1
+    with pytest.raises(Rejected):
+        avm.group(call(avm, ADMIN, "withdraw", REWARD, 1))
+
+
+def test_withdraw_stake_token_keeps_locked(avm):
+    # Surplus stake token is not held back by reward liability
+    avm.group(avm.asset_transfer(ADMIN, avm.address, TOKEN, 1_000))
+    avm.group(call(avm, ADMIN, "withdraw", TOKEN, 999))
+    with pytest.raises(Rejected):
+        avm.group(call(avm, ADMIN, "withdraw", TOKEN, 1))
+
+
+def test_unstake_pays_and_releases_reward(avm):
+    _, liability = ledger(avm, REWARD)
+    avm.timestamp += LE * 86400 + 1
+    avm.group(call(avm, STAKER, "unstake", 0, TOKEN, REWARD))
+    assert ledger(avm, TOKEN) == (0, 0)
+    assert ledger(avm, REWARD) == (0, 0)
+    assert avm.balance(STAKER, TOKEN) == STAKE_AMOUNT
+    assert avm.balance(STAKER, REWARD) == REWARD_FUNDS + liability
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from analytics.indexer import FileBlocks, PositionStore, StakingIndexer
+from tests.fixtures.make_blocks import ALICE, APP_ID, BOB, CAROL, FIRST_ROUND, LAST_ROUND, PATH
+
+
+def follow(until):
+    store = PositionStore(capacity=1)
+    store.round = FIRST_ROUND - 1
+    return StakingIndexer(APP_ID, store, FileBlocks(PATH)).follow(until=until)
+
+
+def position(store, address):
+    row = store.rows[address]
+    return int(store.staked[row]), int(store.total_reward[row]), int(store.stake_unlock[row])
+
+
+def test_create_sets_globals():
+    store = follow(FIRST_ROUND)
+    assert store.size == 0
+    assert (store.locked, store.total_liability) == (1, 0)
+    assert store.reconcile() == (-1, 0)
+
+
+def test_opt_in_adds_rows():
+    store = follow(12)
+    assert store.size == 2
+    assert position(store, ALICE) == (0, 0, 0)
+    assert position(store, BOB) == (0, 0, 0)
+    assert CAROL not in store.rows
+
+
+def test_stake_and_inner_call():
+    store = follow(13)
+    assert position(store, ALICE) == (100, 10, 5000)
+    # Staked for BOB by an inner call, with BOB as accounts[1] and bytes delta keys
+    assert position(store, BOB) == (200, 30, 9000)
+    assert (store.locked, store.total_liability) == (301, 40)
+    assert store.reconcile() == (-1, 0)
+
+
+def test_unstake_and_close_out():
+    store = follow(LAST_ROUND)
+    assert store.round == LAST_ROUND
+    assert list(store.rows) == [BOB]
+    assert bytes(store.addresses[0]) == BOB
+    assert position(store, BOB) == (200, 30, 9000)
+    assert (store.locked, store.total_liability) == (201, 30)
+    assert store.reconcile() == (-1, 0)
+
+
+def test_reconcile_reports_drift():
+    store = follow(LAST_ROUND)
+    store.total_reward[store.rows[BOB]] += 5
+    store.set_global("l", 150)
+    assert store.reconcile() == (50, 5)
+
+
+def test_packed_position():
+    store = PositionStore()
+    record = b"".join(value.to_bytes(8, "big") for value in (100, 10, 5000))
+    store.set_local(ALICE, "p", record)
+    assert position(store, ALICE) == (100, 10, 5000)
+    # Deleted record
+    store.set_local(ALICE, "p", 0)
+    assert position(store, ALICE) == (0, 0, 0)
+
+
+def test_save_and_load(tmp_path):
+    store = follow(13)
+    path = tmp_path / "store.npz"
+    store.save(path)
+    loaded = PositionStore.load(path)
+    assert loaded.round == 13
+    assert loaded.rows == store.rows
+    assert np.array_equal(loaded.view()["staked"], store.view()["staked"])
+    assert loaded.reconcile() == store.reconcile()
+
+
+def test_past_last_block():
+    with pytest.raises(KeyError):
+        follow(LAST_ROUND + 1)
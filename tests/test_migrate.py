@@ -0,0 +1,28 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from deploy.migrate import Migration
+
+CHUNKS = 200
+
+
+class Interface:
+    """Stand-in for deploy.utils.Interface, enough to construct a Migration"""
+
+    def contract(self, name):
+        return self
+
+    def get_method_by_name(self, name):
+        return name
+
+
+def test_concurrent_checkpoints(tmp_path):
+    path = str(tmp_path / "migration.json")
+    migration = Migration(Interface(), 1, "admin", None, path)
+    migration._record(chunks=[[] for _ in range(CHUNKS)], done=[])
+    # Workers finishing at once must not drop each other's checkpoint
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(migration._done, range(CHUNKS)))
+    with open(path) as f:
+        assert sorted(json.load(f)["done"]) == list(range(CHUNKS))
+    assert sorted(Migration(Interface(), 1, "admin", None, path).state["done"]) == list(range(CHUNKS))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from analytics.model import curve, interest_rate, liability, restake, stake
+
+# 10% APR at 1 day up to 20% at 30 days
+SS, SE, LS, LE = 100_000, 200_000, 1, 30
+AMOUNT = 1_000_000
+
+
+def test_interest_rate():
+    # 1 day: 10% APR, 1e6 // 365 = 2739 scaled days, 2739 * 100_000 // 1e6 = 273
+    # 30 days: 20% APR, 30e6 // 365 = 82191 scaled days, 82191 * 200_000 // 1e6 = 16438
+    rate, ok = interest_rate([1, 15, 30], SS, SE, LS, LE)
+    # 15 days: 100_000 + 14 * 1e11 // 29 // 1e6 = 148_275 APR, 15e6 // 365 = 41095, 6093
+    assert rate.tolist() == [273, 6093, 16438]
+    assert ok.all()
+    assert curve(SS, SE, LS, LE)[[0, 14, 29]].tolist() == [273, 6093, 16438]
+
+
+def test_stake():
+    # 1e6 * 1e6 * (1e6 + 16438) // 500_000 // 1e6 - 1e6: the reward token is worth half
+    result = stake(AMOUNT, 30, 1_000_000, 500_000, SS, SE, LS, LE, now=1000)
+    assert result.ok
+    assert result.total_reward == 1_032_876
+    assert result.stake_unlock == 1000 + 30 * 86400
+    assert result.rate == 16438
+
+
+def test_stake_custom_curve():
+    table = np.arange(LE - LS + 1) * 1000
+    result = stake(AMOUNT, [1, 2, 30], 1_000_000, 1_000_000, SS, SE, LS, LE, table=table)
+    assert result.ok.all()
+    assert result.total_reward.tolist() == [0, 1000, 29_000]
+
+
+def test_restake():
+    # Principal 2_032_876, 2_032_876 * 16438 // 1e6 = 33416
+    result = restake(AMOUNT, 1_032_876, 30, SS, SE, LS, LE, now=1000)
+    assert result.ok
+    assert result.staked == 2_032_876
+    assert result.total_reward == 33_416
+    assert result.stake_unlock == 1000 + 30 * 86400
+
+
+@pytest.mark.parametrize("amount, length, stake_price, reward_price", [
+    (0, 30, 1_000_000, 1_000_000),  # nothing staked
+    (AMOUNT, 0, 1_000_000, 1_000_000),  # below ls
+    (AMOUNT, 31, 1_000_000, 1_000_000),  # above le
+    (2**40, 30, 2**30, 1),  # amount * price overflows
+    (AMOUNT, 30, 1, 1_000_000),  # reward below zero
+    (AMOUNT, 30, 1_000_000, 0),  # division by zero
+])
+def test_stake_rejected(amount, length, stake_price, reward_price):
+    assert not stake(amount, length, stake_price, reward_price, SS, SE, LS, LE).ok
+
+
+def test_liability():
+    # 16438 + 273, and the rejected 31-day stake owes nothing
+    result = stake(AMOUNT, [30, 1, 31], 1_000_000, 1_000_000, SS, SE, LS, LE)
+    assert result.ok.tolist() == [True, True, False]
+    assert liability(result) == 16_711
+
+
+def test_liability_sweep():
+    # Starting APR against lock length, summed per starting APR
+    result = stake(AMOUNT, np.array([1, 30]), 1_000_000, 1_000_000, np.array([SS, SE])[:, None], SE, LS, LE)
+    # At 20% throughout, 1 day: 2739 * 200_000 // 1e6 = 547
+    assert liability(result, axis=1).tolist() == [273 + 16_438, 547 + 16_438]
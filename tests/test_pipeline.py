@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from deploy.pipeline import MAX_ACCOUNTS, MAX_REFERENCES, MAX_UNSTAKE_POSITIONS, unstake_batches
+
+SENDER = "SENDER"
+
+
+def check(batches, positions):
+    assert [pair for batch in batches for pair in batch] == sorted(positions)
+    for batch in batches:
+        owners = {owner for owner, _ in batch if owner != SENDER}
+        # Two assets, a box per position and the owners other than the sender
+        assert 2 + len(batch) + len(owners) <= MAX_REFERENCES
+        assert len(owners) <= MAX_ACCOUNTS
+        assert len(batch) <= MAX_UNSTAKE_POSITIONS
+
+
+def sizes(positions):
+    batches = list(unstake_batches(SENDER, positions))
+    check(batches, positions)
+    return [len(batch) for batch in batches]
+
+
+def test_sender_positions():
+    # Only the boxes and assets: 6 positions per call
+    assert sizes([(SENDER, pid) for pid in range(10)]) == [6, 4]
+
+
+def test_one_other_owner():
+    # The owner's account takes a reference too
+    assert sizes([("A", pid) for pid in range(7)]) == [5, 2]
+
+
+def test_distinct_owners():
+    # Every owner takes a box and an account reference: 3 per call
+    assert sizes([(owner, 0) for owner in "ABCDEFG"]) == [3, 3, 1]
+
+
+def test_account_and_position_limits(monkeypatch):
+    # Reached first only when more references are allowed
+    monkeypatch.setattr("deploy.pipeline.MAX_REFERENCES", 64)
+    batches = list(unstake_batches(SENDER, [(owner, 0) for owner in "ABCDEFG"]))
+    assert [len(batch) for batch in batches] == [MAX_ACCOUNTS, 3]
+    batches = list(unstake_batches(SENDER, [(SENDER, pid) for pid in range(20)]))
+    assert [len(batch) for batch in batches] == [MAX_UNSTAKE_POSITIONS, 7]
+
+
+def test_owners_sorted_together():
+    positions = [("B", 1), (SENDER, 0), ("A", 2), ("B", 0), ("A", 1)]
+    batches = list(unstake_batches(SENDER, positions))
+    check(batches, positions)
+    assert batches == [[("A", 1), ("A", 2), ("B", 0), ("B", 1)], [(SENDER, 0)]]
+
+
+def test_empty():
+    assert list(unstake_batches(SENDER, [])) == []
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random(seed):
+    rng = random.Random(seed)
+    positions = list({(rng.choice(["A", "B", "C", "D", "E", "F", SENDER]), rng.randrange(20)) for _ in range(60)})
+    check(list(unstake_batches(SENDER, positions)), positions)
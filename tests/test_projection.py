@@ -0,0 +1,35 @@
+import pytest
+
+from analytics.projection import SECONDS_PER_DAY, project, windows
+
+DAY = SECONDS_PER_DAY
+# Due now, in the second window, and beyond the horizon
+STAKED = [100, 200, 300]
+TOTAL_REWARD = [10, 20, 30]
+STAKE_UNLOCK = [0, DAY + 5, 3 * DAY]
+# The reward token is worth half the stake token
+STAKE_PRICE, REWARD_PRICE = 1_000_000, 500_000
+
+
+def test_windows():
+    projection = project(STAKED, TOTAL_REWARD, STAKE_UNLOCK, windows(0, DAY, 2))
+    assert projection.positions.tolist() == [1, 1]
+    assert projection.staked.tolist() == [100, 200]
+    assert projection.total_reward.tolist() == [10, 20]
+    assert projection.cumulative.tolist() == [100, 300]
+    assert projection.staked_value is None and projection.reward_value is None
+
+
+@pytest.mark.parametrize("value_in, staked_value, reward_value", [
+    ("reward", [200, 400], [10, 20]),
+    ("stake", [100, 200], [5, 10]),
+])
+def test_value_in(value_in, staked_value, reward_value):
+    projection = project(STAKED, TOTAL_REWARD, STAKE_UNLOCK, windows(0, DAY, 2), STAKE_PRICE, REWARD_PRICE, value_in)
+    assert projection.staked_value.tolist() == staked_value
+    assert projection.reward_value.tolist() == reward_value
+
+
+def test_value_in_unknown():
+    with pytest.raises(ValueError):
+        project(STAKED, TOTAL_REWARD, STAKE_UNLOCK, windows(0, DAY, 2), STAKE_PRICE, REWARD_PRICE, "usd")
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+from algosdk import abi
+
+from deploy.pipeline import MAX_UNSTAKE_POSITIONS
+from deploy.utils import BUILD_DIR, MIGRATED_POSITION, POSITION_MBR, curve_mbr
+from tests.avm import AVM, NAMED_INTS, Rejected
+
+APP_ID = 1234
+TOKEN = 10
+REWARD = 20
+ORACLE = 30
+ADMIN = bytes([1]) * 32
+STAKER = bytes([2]) * 32
+LS, LE = 1, 30
+STAKE_AMOUNT = 1_000_000
+REWARD_FUNDS = 10_000_000
+
+
+def read(name):
+    with open(os.path.join(BUILD_DIR, "Staking", name)) as f:
+        return f.read()
+
+
+CONTRACT = abi.Contract.from_json(read("abi.json"))
+
+
+def call(avm, sender, name, *args):
+    return avm.method_call(sender, CONTRACT.get_method_by_name(name), args)
+
+
+def position_key(address, pid):
+    return address + pid.to_bytes(8, "big")
+
+
+def position(avm, address, pid):
+    value = avm.boxes[position_key(address, pid)]
+    return tuple(int.from_bytes(value[i:i + 8], "big") for i in range(0, 24, 8))
+
+
+@pytest.fixture
+def avm():
+    teal = read("approval.teal").replace("TMPL_TOKEN_ID", str(TOKEN)).replace("TMPL_REWARD_ID", str(REWARD))
+    avm = AVM(teal, APP_ID)
+    avm.algos = {ADMIN: 10**9, STAKER: 10**9}
+    avm.apps[ORACLE] = {TOKEN.to_bytes(8, "big"): (1_000_000).to_bytes(8, "big"),
+                        REWARD.to_bytes(8, "big"): (500_000).to_bytes(8, "big")}
+    for address in (ADMIN, STAKER):
+        avm.opt_in(address, TOKEN, STAKE_AMOUNT)
+        avm.opt_in(address, REWARD, REWARD_FUNDS)
+
+    create = call(avm, ADMIN, "create", TOKEN, 100_000, 200_000, LS, LE, REWARD, ORACLE)
+    create["ApplicationID"] = 0
+    avm.group(create)
+    avm.group(
+        avm.payment(ADMIN, avm.address, 300_000 + curve_mbr(LS, LE)),
+        call(avm, ADMIN, "config", TOKEN, REWARD, ORACLE, 0),
+    )
+    avm.group(avm.asset_transfer(ADMIN, avm.address, REWARD, REWARD_FUNDS))
+    avm.group(avm.bare_call(STAKER, NAMED_INTS["OptIn"]))
+    return avm
+
+
+def stake(avm, amount=STAKE_AMOUNT // 2):
+    avm.group(
+        avm.asset_transfer(STAKER, avm.address, TOKEN, amount),
+        call(avm, STAKER, "stake", TOKEN, LE),
+    )
+
+
+def migrate(avm):
+    avm.group(
+        avm.payment(ADMIN, avm.address, POSITION_MBR),
+        call(avm, ADMIN, "migrate_positions", [STAKER]),
+    )
+
+
+def test_migrated_position_id_is_reserved(avm):
+    with pytest.raises(Rejected):
+        avm.group(
+            avm.payment(STAKER, avm.address, POSITION_MBR),
+            avm.asset_transfer(STAKER, avm.address, TOKEN, STAKE_AMOUNT),
+            call(avm, STAKER, "stake_position", TOKEN, LE, MIGRATED_POSITION),
+        )
+
+
+def test_migrate_skips_existing_box(avm):
+    stake(avm)
+    migrate(avm)
+    first = position(avm, STAKER, MIGRATED_POSITION)
+    # Staked again in local state: migrating again keeps both where they are
+    stake(avm)
+    local = dict(avm.locals[STAKER])
+    migrate(avm)
+    assert position(avm, STAKER, MIGRATED_POSITION) == first
+    assert avm.locals[STAKER] == local
+
+
+def test_migrated_unstake_keeps_mbr(avm):
+    stake(avm)
+    migrate(avm)
+    staked, reward, unlock = position(avm, STAKER, MIGRATED_POSITION)
+    algos = avm.algos[STAKER]
+    app_algos = avm.algos[avm.address]
+    avm.timestamp = unlock + 1
+    avm.group(call(avm, STAKER, "unstake_position", TOKEN, REWARD, MIGRATED_POSITION))
+    assert position_key(STAKER, MIGRATED_POSITION) not in avm.boxes
+    assert avm.algos[STAKER] == algos
+    assert avm.algos[avm.address] == app_algos
+    assert avm.balance(STAKER, TOKEN) == STAKE_AMOUNT
+    assert avm.balance(STAKER, REWARD) == REWARD_FUNDS + reward
+
+
+def test_unstake_positions_log_limit(avm):
+    positions = [(STAKER, pid) for pid in range(MAX_UNSTAKE_POSITIONS + 1)]
+    for _, pid in positions:
+        avm.group(
+            avm.payment(STAKER, avm.address, POSITION_MBR),
+            avm.asset_transfer(STAKER, avm.address, TOKEN, 1_000),
+            call(avm, STAKER, "stake_position", TOKEN, LS, pid),
+        )
+    avm.timestamp += LS * 86400 + 1
+    with pytest.raises(Rejected):
+        avm.group(call(avm, STAKER, "unstake_positions", TOKEN, REWARD, positions))
+    avm.group(call(avm, STAKER, "unstake_positions", TOKEN, REWARD, positions[:MAX_UNSTAKE_POSITIONS]))
+    assert [key for key in avm.boxes if key.startswith(STAKER)] == [position_key(STAKER, MAX_UNSTAKE_POSITIONS)]
+    assert avm.balance(STAKER, TOKEN) == STAKE_AMOUNT - 1_000
+
+
+def test_unstake_positions_owner_or_admin(avm):
+    avm.group(
+        avm.payment(STAKER, avm.address, POSITION_MBR),
+        avm.asset_transfer(STAKER, avm.address, TOKEN, STAKE_AMOUNT),
+        call(avm, STAKER, "stake_position", TOKEN, LS, 1),
+    )
+    avm.timestamp += LS * 86400 + 1
+    other = bytes([3]) * 32
+    with pytest.raises(Rejected):
+        avm.group(call(avm, other, "unstake_positions", TOKEN, REWARD, [(STAKER, 1)]))
+    algos = avm.algos[STAKER]
+    avm.group(call(avm, ADMIN, "unstake_positions", TOKEN, REWARD, [(STAKER, 1)]))
+    # Paid out to the owner, not the admin
+    assert avm.balance(STAKER, TOKEN) == STAKE_AMOUNT
+    assert avm.algos[STAKER] == algos + POSITION_MBR
+
+
+def test_position_unstake_refunds_mbr(avm):
+    avm.group(
+        avm.payment(STAKER, avm.address, POSITION_MBR),
+        avm.asset_transfer(STAKER, avm.address, TOKEN, STAKE_AMOUNT),
+        call(avm, STAKER, "stake_position", TOKEN, LE, 7),
+    )
+    _, _, unlock = position(avm, STAKER, 7)
+    algos = avm.algos[STAKER]
+    avm.timestamp = unlock + 1
+    avm.group(call(avm, STAKER, "unstake_position", TOKEN, REWARD, 7))
+    assert avm.algos[STAKER] == algos + POSITION_MBR
@@ -0,0 +1,95 @@
+import pytest
+
+from deploy.utils import fill_template, patch_template, varuint
+from tests.assembler import assemble, disassemble
+
+NAMES = ["TMPL_TOKEN_ID", "TMPL_REWARD_ID"]
+
+# Shaped as the built contracts: constant blocks, the template prelude, then code branching back
+# and forth across it
+TEAL = """
+#pragma version 8
+intcblock 0 1 1000000
+bytecblock 0x61 0x746c
+pushint TMPL_TOKEN_ID
+store 250
+pushint TMPL_REWARD_ID
+store 251
+intc_0
+bnz later
+callsub sub
+load 250
+intc_2
+==
+bz fail
+earlier:
+load 251
+pop
+intc_1
+return
+fail:
+err
+sub:
+bytec_0
+pop
+retsub
+later:
+intc_1
+bnz earlier
+b fail
+"""
+
+
+def resolved(bytecode):
+    """Instructions with branch targets given as instruction indices, which patching must keep."""
+    version, instructions = disassemble(bytecode)
+    index = {pc: i for i, (pc, _, _) in enumerate(instructions)}
+    return version, [
+        (op, [index[args[0]]] if op in ("bnz", "bz", "b", "callsub") else args)
+        for _, op, args in instructions
+    ]
+
+
+@pytest.mark.parametrize("values", [(1, 1), (2**40, 1), (1, 2**40), (2**40, 2**40 + 1)])
+def test_patch_matches_assembled(values):
+    values = dict(zip(NAMES, values))
+    compiled = assemble(fill_template(TEAL, NAMES))
+    patched = patch_template(compiled, NAMES, values)
+
+    filled = TEAL
+    for name, value in values.items():
+        filled = filled.replace(name, str(value))
+    assert patched == assemble(filled)
+    # Only the prelude grows
+    growth = sum(len(varuint(value)) - 1 for value in values.values())
+    assert len(patched) == len(compiled) + growth
+
+    version, instructions = resolved(patched)
+    assert version == 8
+    assert instructions[:6] == [
+        ("intcblock", [0, 1, 1_000_000]),
+        ("bytecblock", [b"a", b"tl"]),
+        ("pushint", [values["TMPL_TOKEN_ID"]]),
+        ("store", [250]),
+        ("pushint", [values["TMPL_REWARD_ID"]]),
+        ("store", [251]),
+    ]
+    # Every branch still lands on the same instruction
+    _, original = resolved(compiled)
+    assert instructions[6:] == original[6:]
+
+
+def test_branch_targets():
+    _, instructions = disassemble(patch_template(assemble(fill_template(TEAL, NAMES)), NAMES, dict.fromkeys(NAMES, 2**40)))
+    pcs = {pc: (op, tuple(args)) for pc, op, args in instructions}
+    targets = {op: pcs[args[0]] for _, op, args in instructions if op in ("bnz", "bz", "callsub")}
+    assert targets["bz"] == ("err", ())
+    assert targets["callsub"] == ("bytec_0", ())
+    # The forward bnz to `later` and the backward one to `earlier`
+    assert {pcs[args[0]] for _, op, args in instructions if op == "bnz"} == {("intc_1", ()), ("load", (251,))}
+
+
+def test_prelude_missing():
+    teal = "#pragma version 8\nintcblock 0 1\nintc_1\nreturn\n"
+    with pytest.raises(ValueError, match="TMPL_TOKEN_ID"):
+        patch_template(assemble(teal), NAMES, dict.fromkeys(NAMES, 1))
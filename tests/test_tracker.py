@@ -0,0 +1,154 @@
+import base64
+import threading
+
+import msgpack
+import pytest
+from algosdk import encoding
+from algosdk.transaction import PaymentTxn, SuggestedParams
+
+from deploy.tracker import ConfirmationTimeout, ConfirmationTracker
+
+GENESIS_HASH = bytes(32)
+GENESIS_ID = "testnet-v1.0"
+SENDER = encoding.encode_address(bytes([1]) * 32)
+START_ROUND = 100
+
+
+def payment(note, genesis_id=GENESIS_ID):
+    sp = SuggestedParams(1000, 1, 1000, base64.b64encode(GENESIS_HASH).decode(), genesis_id, flat_fee=True)
+    return PaymentTxn(SENDER, sp, SENDER, 0, note=note)
+
+
+def stib(txn, **fields):
+    """The signed txn in block of `txn`, with the genesis fields stripped as blocks store them."""
+    decoded = msgpack.unpackb(base64.b64decode(encoding.msgpack_encode(txn)), raw=False)
+    decoded.pop("gh")
+    if decoded.pop("gen", None) is not None:
+        fields["hgi"] = True
+    return {"txn": decoded, **fields}
+
+
+class BlockAlgod:
+    """Stand-in algod serving the blocks added with `add`, one round after START_ROUND each."""
+
+    def __init__(self):
+        self.blocks = {}
+        self.last_round = START_ROUND
+        self.error = None
+        self.condition = threading.Condition()
+
+    def add(self, *stibs):
+        with self.condition:
+            self.last_round += 1
+            self.blocks[self.last_round] = {
+                "rnd": self.last_round, "gh": GENESIS_HASH, "gen": GENESIS_ID, "txns": list(stibs),
+            }
+            self.condition.notify_all()
+        return self.last_round
+
+    def fail(self, error):
+        with self.condition:
+            self.error = error
+            self.condition.notify_all()
+
+    def status(self):
+        return {"last-round": self.last_round}
+
+    def status_after_block(self, round_num):
+        # Returns without a new round after a while, as algod does, so the tracker can stop
+        with self.condition:
+            self.condition.wait_for(lambda: self.error or self.last_round > round_num, timeout=0.05)
+            if self.error:
+                raise self.error
+            return {"last-round": self.last_round}
+
+    def block_info(self, round_num, response_format):
+        assert response_format == "msgpack"
+        block = self.blocks.get(round_num, {"rnd": round_num, "gh": GENESIS_HASH, "gen": GENESIS_ID})
+        return msgpack.packb({"block": block}, use_bin_type=True)
+
+
+@pytest.fixture
+def algod():
+    return BlockAlgod()
+
+
+def test_resolves_from_block(algod):
+    app_call = payment(b"app")
+    other = payment(b"other")
+    with ConfirmationTracker(algod) as tracker:
+        future = tracker.track(app_call.get_txid())
+        confirmed = algod.add(stib(other), stib(app_call, apid=1234, dt={"lg": [b"event"]}))
+        assert future.result(timeout=5) == {
+            "txid": app_call.get_txid(),
+            "confirmed-round": confirmed,
+            "application-index": 1234,
+            "logs": [base64.b64encode(b"event").decode()],
+        }
+
+
+def test_genesis_id_omitted(algod):
+    # Without hgi the genesis ID is not part of the hashed transaction
+    txn = payment(b"no gen", genesis_id=None)
+    with ConfirmationTracker(algod) as tracker:
+        future = tracker.track(txn.get_txid())
+        algod.add(stib(txn))
+        assert future.result(timeout=5)["txid"] == txn.get_txid()
+
+
+def test_confirmed_before_start(algod):
+    txn = payment(b"early")
+    confirmed = algod.add(stib(txn))
+    algod.add()
+    with ConfirmationTracker(algod) as tracker:
+        assert tracker.wait([txn.get_txid()])[0]["confirmed-round"] == confirmed
+
+
+def test_confirmed_before_tracked(algod):
+    txn = payment(b"read first")
+    marker = payment(b"marker")
+    with ConfirmationTracker(algod) as tracker:
+        confirmed = algod.add(stib(txn))
+        algod.add(stib(marker))
+        tracker.track(marker.get_txid()).result(timeout=5)
+        # The tracker has read the block, so tracking resolves at once
+        assert tracker.track(txn.get_txid()).result(timeout=0)["confirmed-round"] == confirmed
+
+
+def test_timeout(algod):
+    with ConfirmationTracker(algod) as tracker:
+        future = tracker.track(payment(b"lost").get_txid(), timeout=2)
+        algod.add()
+        algod.add()
+        with pytest.raises(ConfirmationTimeout) as raised:
+            future.result(timeout=5)
+        assert raised.value.last_round == START_ROUND + 2
+
+
+def test_history_expires(algod):
+    txn = payment(b"old")
+    algod.add(stib(txn))
+    algod.add()
+    algod.add()
+    # Starts 2 rounds back, past the round the transaction landed in
+    with ConfirmationTracker(algod, history=2) as tracker:
+        future = tracker.track(txn.get_txid(), timeout=1)
+        algod.add()
+        with pytest.raises(ConfirmationTimeout):
+            future.result(timeout=5)
+
+
+def test_algod_error_fails_pending(algod):
+    with ConfirmationTracker(algod) as tracker:
+        future = tracker.track(payment(b"pending").get_txid())
+        algod.fail(ConnectionError("algod down"))
+        with pytest.raises(ConnectionError):
+            future.result(timeout=5)
+        with pytest.raises(ConnectionError):
+            tracker.track(payment(b"later").get_txid()).result(timeout=0)
+
+
+def test_stop_cancels_pending(algod):
+    with ConfirmationTracker(algod) as tracker:
+        future = tracker.track(payment(b"never").get_txid())
+    assert future.cancelled()
@@ -0,0 +1,180 @@
+import base64
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from algosdk import error
+
+from deploy.transport import PooledAlgodClient
+
+TXID = "A" * 52
+SIGNED = base64.b64encode(b"signed").decode()
+# Closes the connection without answering
+DROP = None
+
+
+class FakeAlgod(ThreadingHTTPServer):
+    """Local HTTP server answering with `responses` in turn, then 200 OK, recording the requests."""
+
+    def __init__(self, *responses):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.responses = list(responses)
+        self.requests = []
+        self.clients = set()
+        threading.Thread(target=self.serve_forever, args=(0.01,), daemon=True).start()
+
+    @property
+    def address(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def answer(self):
+        server = self.server
+        if self.command == "POST":
+            self.rfile.read(int(self.headers["Content-Length"]))
+        server.requests.append((self.command, self.path))
+        server.clients.add(self.client_address)
+        response = server.responses.pop(0) if server.responses else (200, {"last-round": 7, "txId": TXID})
+        if response is DROP:
+            self.close_connection = True
+            return
+        status, body = response
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = answer
+
+    def log_message(self, *args):
+        pass
+
+
+def refused_address():
+    # A port nothing listens on
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(*responses):
+        server = FakeAlgod(*responses)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.shutdown()
+        server.server_close()
+
+
+def client(*addresses, retries=2):
+    return PooledAlgodClient("", list(addresses), retries=retries, backoff=0)
+
+
+def failure(status):
+    return status, {"message": f"failed with {status}"}
+
+
+def test_retry_then_success(servers):
+    server = servers(failure(503), failure(429))
+    algod = client(server.address)
+    assert algod.status()["last-round"] == 7
+    assert len(server.requests) == 3
+    stats = algod.stats()[server.address]
+    assert stats["retries"] == 2
+    assert stats["errors"] == {"503": 1, "429": 1}
+
+
+def test_failover(servers):
+    first = servers(failure(500), failure(502), failure(503))
+    second = servers()
+    algod = client(first.address, second.address)
+    assert algod.status()["last-round"] == 7
+    assert len(first.requests) == 3
+    assert len(second.requests) == 1
+    # The endpoint that answered is tried first from then on
+    algod.status()
+    assert len(first.requests) == 3
+    assert len(second.requests) == 2
+
+
+def test_failover_from_unreachable(servers):
+    server = servers()
+    algod = client(refused_address(), server.address)
+    assert algod.status()["last-round"] == 7
+    assert algod.stats()[algod.endpoints[0].address]["errors"] == {"ConnectionRefusedError": 3}
+
+
+def test_client_error_not_retried(servers):
+    server = servers(failure(404))
+    with pytest.raises(error.AlgodHTTPError) as raised:
+        client(server.address).account_info("A" * 58)
+    assert raised.value.code == 404
+    assert str(raised.value) == "failed with 404"
+    assert len(server.requests) == 1
+
+
+def test_all_endpoints_fail(servers):
+    first = servers(*[failure(503)] * 2)
+    second = servers(*[failure(503)] * 2)
+    with pytest.raises(error.AlgodHTTPError) as raised:
+        client(first.address, second.address, retries=1).status()
+    assert raised.value.code == 503
+
+
+def test_unreachable(servers):
+    with pytest.raises(error.AlgodHTTPError, match="No algod endpoint reachable"):
+        client(refused_address(), retries=0).status()
+
+
+def test_connections_reused(servers):
+    server = servers()
+    algod = client(server.address)
+    for _ in range(3):
+        algod.status()
+    assert len(server.clients) == 1
+
+
+def test_send_not_repeated(servers):
+    # The send may have reached the pool, so it is neither retried nor sent elsewhere
+    first = servers(failure(503))
+    second = servers()
+    with pytest.raises(error.AlgodHTTPError) as raised:
+        client(first.address, second.address).send_raw_transaction(SIGNED)
+    assert raised.value.code == 503
+    assert first.requests == [("POST", "/v2/transactions")]
+    assert second.requests == []
+
+
+def test_send_dropped_not_repeated(servers):
+    server = servers(DROP)
+    with pytest.raises(error.AlgodHTTPError, match="may have been applied"):
+        client(server.address).send_raw_transaction(SIGNED)
+    assert len(server.requests) == 1
+
+
+def test_dropped_retried(servers):
+    server = servers(DROP)
+    assert client(server.address).status()["last-round"] == 7
+    assert len(server.requests) == 2
+
+
+def test_send_retried_when_not_processed(servers):
+    # Refused connections and 429 answers never reached the pool
+    server = servers(failure(429))
+    algod = client(refused_address(), server.address)
+    assert algod.send_raw_transaction(SIGNED) == TXID
+    assert server.requests == [("POST", "/v2/transactions")] * 2
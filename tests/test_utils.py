@@ -0,0 +1,110 @@
+import base64
+
+import pytest
+from algosdk import account
+from algosdk.atomic_transaction_composer import AccountTransactionSigner, AtomicTransactionComposer, TransactionWithSigner
+from algosdk.transaction import ApplicationNoOpTxn, PaymentTxn, SuggestedParams
+
+from deploy.utils import MAX_GROUP_SIZE, OPCODE_BUDGET, SIMULATE_EXTRA_BUDGET, Interface, SimulationError
+
+MIN_FEE = 1000
+APP_ID = 1001
+GENESIS_HASH = base64.b64encode(bytes(32)).decode()
+
+
+def suggested_params():
+    return SuggestedParams(MIN_FEE, 1, 1000, GENESIS_HASH, "testnet-v1.0", flat_fee=True, min_fee=MIN_FEE)
+
+
+class SimulateAlgod:
+    """Stand-in algod answering simulate requests with `responses` in turn, recording the requests."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def suggested_params(self):
+        return suggested_params()
+
+    def simulate_transactions(self, request):
+        self.requests.append(request)
+        return {"txn-groups": [self.responses.pop(0)]}
+
+
+def interface(*responses):
+    interface = Interface.__new__(Interface)
+    interface.algod = SimulateAlgod(*responses)
+    return interface
+
+
+def result(inner=0):
+    return {"txn-result": {"inner-txns": [{} for _ in range(inner)]}}
+
+
+def group(*results, **fields):
+    return {"txn-results": list(results), **fields}
+
+
+@pytest.fixture
+def atc():
+    sk, address = account.generate_account()
+    sp = suggested_params()
+    signer = AccountTransactionSigner(sk)
+    atc = AtomicTransactionComposer()
+    atc.add_transaction(TransactionWithSigner(PaymentTxn(address, sp, address, 0), signer))
+    atc.add_transaction(TransactionWithSigner(ApplicationNoOpTxn(address, sp, APP_ID), signer))
+    return atc
+
+
+def fees(atc):
+    return [entry.txn.fee for entry in atc.txn_list]
+
+
+def test_fees_cover_inner_transactions(atc):
+    ui = interface(group(result(), {"txn-result": {"inner-txns": [{"inner-txns": [{}]}, {}]}}))
+    assert fees(ui.with_fees(atc)) == [MIN_FEE, 4 * MIN_FEE]
+    assert ui.algod.requests[0].extra_opcode_budget == 0
+    # The original is left as it was
+    assert fees(atc) == [MIN_FEE, MIN_FEE]
+
+
+def test_fees_ignore_unknown_fields(atc):
+    ui = interface(group(result(), result(1), **{"group-usage": 10_000_000}))
+    assert fees(ui.with_fees(atc)) == [MIN_FEE, 2 * MIN_FEE]
+
+
+def test_budget_padding(atc):
+    ui = interface(
+        group(result(), result(), **{"failure-message": "dynamic cost budget exceeded", "failed-at": [1]}),
+        group(result(), result(), **{
+            "app-budget-added": OPCODE_BUDGET + SIMULATE_EXTRA_BUDGET, "app-budget-consumed": 1900,
+        }),
+        group(result(), result(1), result(), result()),
+    )
+    padded = ui.with_fees(atc)
+    assert ui.algod.requests[1].extra_opcode_budget == SIMULATE_EXTRA_BUDGET
+    # 1200 opcodes short: two budget calls to the app called
+    budget_calls = [entry.txn for entry in padded.txn_list[2:]]
+    assert len(budget_calls) == 2
+    assert all(txn.index == APP_ID for txn in budget_calls)
+    assert len({txn.note for txn in budget_calls}) == 2
+    assert fees(padded) == [MIN_FEE, 2 * MIN_FEE, MIN_FEE, MIN_FEE]
+
+
+def test_budget_padding_past_group_size(atc):
+    ui = interface(
+        group(result(), result(), **{"failure-message": "dynamic cost budget exceeded", "failed-at": [1]}),
+        group(result(), result(), **{
+            "app-budget-added": OPCODE_BUDGET + SIMULATE_EXTRA_BUDGET,
+            "app-budget-consumed": OPCODE_BUDGET * MAX_GROUP_SIZE,
+        }),
+    )
+    with pytest.raises(SimulationError, match="budget calls"):
+        ui.with_fees(atc)
+
+
+def test_failure(atc):
+    ui = interface(group(result(), result(), **{"failure-message": "logic eval error: assert failed", "failed-at": [1]}))
+    with pytest.raises(SimulationError) as raised:
+        ui.with_fees(atc)
+    assert raised.value.failed_at == [1]